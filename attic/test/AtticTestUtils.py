@@ -0,0 +1,40 @@
+from myhdl import intbv, delay, downrange
+from random import randrange
+from Robot.Utils.Constants import LOW, HIGH
+from TestUtils import from_bytes, klv_read, klv_write
+
+def to_intbv(data):
+    """ Return the bits of data bytes, most significant first, as an intbv """
+    return intbv(from_bytes(data))[8*len(data):]
+
+def random_write(n):
+    """ Generate and return a random intbv suitable for a write operation
+
+    n -- length of the written value in number of bytes
+
+    """
+    key = randrange(0xFF) | 0x80 # write
+    return to_intbv(klv_write(key, n, randrange(2**(8*n))))
+
+def random_read(n):
+    """ Generate and return a random intbv suitable for a read operation
+
+    n -- length of the expected value in number of bytes
+
+    """
+    key = randrange(0xFF) & 0x7F # read
+    return to_intbv(klv_read(key, n))
+
+def spi_transfer(miso, mosi, sclk, ss_n, master_to_slave, slave_to_master):
+    """ Send data like an SPI master would (see SPIMaster for bytes) """
+    yield delay(50)
+    ss_n.next = LOW
+    yield delay(10)
+    for i in downrange(len(master_to_slave)):
+        sclk.next = 1
+        mosi.next = master_to_slave[i]
+        yield delay(10)
+        sclk.next = 0
+        slave_to_master[i] = miso
+        yield delay(10)
+    ss_n.next = HIGH
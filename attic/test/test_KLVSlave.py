@@ -10,7 +10,8 @@ from myhdl import Signal, intbv, toVHDL, Simulation, StopSimulation, join, delay
 
 from Attic.SPI.Protocol.KLVSlave import KLVSlave
 from Robot.Utils.Constants import LOW, HIGH
-from TestUtils import ClkGen, random_write, random_read, spi_transfer
+from AtticTestUtils import random_write, random_read, spi_transfer
+from TestUtils import ClkGen
 
 MAX_LENGTH = 256 # max length of values read or written by the Gumstix
 
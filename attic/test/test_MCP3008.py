@@ -10,7 +10,8 @@ from myhdl import Signal, Simulation, StopSimulation, intbv, join, toVHDL, trace
 
 from Attic.Device.MCP3008 import MCP3008Driver
 from Robot.Utils.Constants import LOW, HIGH
-from TestUtils import ClkGen, spi_transfer
+from AtticTestUtils import spi_transfer
+from TestUtils import ClkGen
 
 NR_TESTS = 16 # twice each channel
 
@@ -10,7 +10,7 @@ from myhdl import Signal, Simulation, intbv, join
 
 from Attic.SPI.Slave import SPISlave
 from Robot.Utils.Constants import LOW, HIGH
-from TestUtils import spi_transfer
+from AtticTestUtils import spi_transfer
 
 n = 8
 NR_TESTS = 10
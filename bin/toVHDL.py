@@ -1,163 +1,103 @@
 import sys
 sys.path.append('../lib')
 
+import hashlib
+import os
+from optparse import OptionParser
+
+import myhdl
+
+from Robot.Utils.Config import VARIANTS, ports
+
+# RobotIO.vhd only depends on these: the design sources, this script (it
+# holds the conversion parameters), the config and the MyHDL version
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DESIGN_DIR = os.path.join(ROOT, 'lib', 'Robot')
+
+# host side sources under DESIGN_DIR, not converted
+HOST_SOURCES = [os.path.join(DESIGN_DIR, 'Host'), os.path.join(DESIGN_DIR, 'Model.py')]
+OUTPUTS = ['RobotIO.vhd', 'pck_myhdl_%s.vhd' % myhdl.__version__.replace('.', '')]
+HASH_FILE = 'RobotIO.sha1'
+
+def source_hashes(variant):
+    """ Return a dict of the SHA-1 of each input of the conversion, by name """
+    paths = [os.path.abspath(__file__)]
+    for dirpath, dirnames, filenames in os.walk(DESIGN_DIR):
+        dirnames[:] = sorted(d for d in dirnames if os.path.join(dirpath, d) not in HOST_SOURCES)
+        paths += [os.path.join(dirpath, f) for f in sorted(filenames)
+                  if f.endswith('.py') and os.path.join(dirpath, f) not in HOST_SOURCES]
+
+    hashes = {'myhdl-' + myhdl.__version__: hashlib.sha1(myhdl.__version__).hexdigest(),
+              'config-' + variant: hashlib.sha1(repr(VARIANTS[variant])).hexdigest()}
+    for path in paths:
+        with open(path, 'rb') as f:
+            hashes[os.path.relpath(path, ROOT)] = hashlib.sha1(f.read()).hexdigest()
+    return hashes
+
+def read_hashes():
+    """ Return the hashes of the last conversion, or None """
+    if not os.path.exists(HASH_FILE):
+        return None
+    hashes = {}
+    with open(HASH_FILE) as f:
+        for line in f:
+            digest, name = line.split(None, 1)
+            hashes[name.strip()] = digest
+    return hashes
+
+def write_hashes(hashes):
+    """ Save hashes in the sha1sum format """
+    with open(HASH_FILE, 'w') as f:
+        for name in sorted(hashes):
+            f.write('%s  %s\n' % (hashes[name], name))
+
+def regeneration_reasons(hashes, force):
+    """ Return the list of the reasons to regenerate RobotIO.vhd """
+    if force:
+        return ['--force']
+    reasons = ['%s is missing' % o for o in OUTPUTS if not os.path.exists(o)]
+    previous = read_hashes()
+    if previous is None:
+        reasons.append('%s is missing' % HASH_FILE)
+        return reasons
+    for name in sorted(set(hashes) | set(previous)):
+        if name not in previous:
+            reasons.append('%s added' % name)
+        elif name not in hashes:
+            reasons.append('%s removed' % name)
+        elif hashes[name] != previous[name]:
+            reasons.append('%s changed' % name)
+    return reasons
+
+parser = OptionParser(usage = 'usage: %prog [--force] [--config VARIANT]',
+                      description = 'Generate RobotIO.vhd in the current directory, '
+                                    'unless it is up to date.')
+parser.add_option('-f', '--force', action = 'store_true', default = False,
+                  help = 'regenerate even if the sources did not change')
+parser.add_option('-c', '--config', type = 'choice', choices = sorted(VARIANTS), default = 'default',
+                  help = 'channel counts of RobotIO: %s (default: %%default, see '
+                         'Robot.Utils.Config)' % ', '.join(sorted(VARIANTS)))
+options, args = parser.parse_args()
+config = VARIANTS[options.config]
+
+hashes = source_hashes(options.config)
+reasons = regeneration_reasons(hashes, options.force)
+if not reasons:
+    print 'RobotIO.vhd is up to date (use --force to regenerate it)'
+    sys.exit(0)
+print 'regenerating RobotIO.vhd:', ', '.join(reasons)
+
+# remove the hashes first: they must not survive a failed conversion
+if os.path.exists(HASH_FILE):
+    os.remove(HASH_FILE)
+
 from myhdl import Signal, toVHDL
 
-from Robot.Main import RobotIO
-
-clk25      = Signal(bool(0))
-
-sspi_clk   = Signal(bool(0))
-sspi_cs    = Signal(bool(0))
-sspi_miso  = Signal(bool(0))
-sspi_mosi  = Signal(bool(0))
-
-rc1_cha    = Signal(bool(0))
-rc1_chb    = Signal(bool(0))
-rc2_cha    = Signal(bool(0))
-rc2_chb    = Signal(bool(0))
-rc3_cha    = Signal(bool(0))
-rc3_chb    = Signal(bool(0))
-rc4_cha    = Signal(bool(0))
-rc4_chb    = Signal(bool(0))
-
-mot1_brake = Signal(bool(0))
-mot1_dir   = Signal(bool(0))
-mot1_pwm   = Signal(bool(0))
-
-mot2_brake = Signal(bool(0))
-mot2_dir   = Signal(bool(0))
-mot2_pwm   = Signal(bool(0))
-
-mot3_brake = Signal(bool(0))
-mot3_dir   = Signal(bool(0))
-mot3_pwm   = Signal(bool(0))
-
-mot4_brake = Signal(bool(0))
-mot4_dir   = Signal(bool(0))
-mot4_pwm   = Signal(bool(0))
-
-mot5_brake = Signal(bool(0))
-mot5_dir   = Signal(bool(0))
-mot5_pwm   = Signal(bool(0))
-
-mot6_brake = Signal(bool(0))
-mot6_dir   = Signal(bool(0))
-mot6_pwm   = Signal(bool(0))
-
-mot7_brake = Signal(bool(0))
-mot7_dir   = Signal(bool(0))
-mot7_pwm   = Signal(bool(0))
-
-mot8_brake = Signal(bool(0))
-mot8_dir   = Signal(bool(0))
-mot8_pwm   = Signal(bool(0))
-
-adc1_clk   = Signal(bool(0))
-adc1_cs    = Signal(bool(0))
-adc1_miso  = Signal(bool(0))
-adc1_mosi  = Signal(bool(0))
-
-pwm1_ch0   = Signal(bool(0))
-pwm1_ch1   = Signal(bool(0))
-pwm1_ch2   = Signal(bool(0))
-pwm1_ch3   = Signal(bool(0))
-pwm1_ch4   = Signal(bool(0))
-pwm1_ch5   = Signal(bool(0))
-pwm1_ch6   = Signal(bool(0))
-pwm1_ch7   = Signal(bool(0))
-
-ext1_0     = Signal(bool(0))
-ext1_1     = Signal(bool(0))
-ext1_2     = Signal(bool(0))
-ext1_3     = Signal(bool(0))
-ext1_4     = Signal(bool(0))
-ext1_5     = Signal(bool(0))
-ext1_6     = Signal(bool(0))
-ext1_7     = Signal(bool(0))
-
-ext2_0     = Signal(bool(0))
-ext2_1     = Signal(bool(0))
-ext2_2     = Signal(bool(0))
-ext2_3     = Signal(bool(0))
-ext2_4     = Signal(bool(0))
-ext2_5     = Signal(bool(0))
-ext2_6     = Signal(bool(0))
-ext2_7     = Signal(bool(0))
-
-ext3_0     = Signal(bool(0))
-ext3_1     = Signal(bool(0))
-ext3_2     = Signal(bool(0))
-ext3_3     = Signal(bool(0))
-ext3_4     = Signal(bool(0))
-ext3_5     = Signal(bool(0))
-ext3_6     = Signal(bool(0))
-ext3_7     = Signal(bool(0))
-
-ext4_0     = Signal(bool(0))
-ext4_1     = Signal(bool(0))
-ext4_2     = Signal(bool(0))
-ext4_3     = Signal(bool(0))
-ext4_4     = Signal(bool(0))
-ext4_5     = Signal(bool(0))
-ext4_6     = Signal(bool(0))
-ext4_7     = Signal(bool(0))
-
-ext5_0     = Signal(bool(0))
-ext5_1     = Signal(bool(0))
-ext5_2     = Signal(bool(0))
-ext5_3     = Signal(bool(0))
-ext5_4     = Signal(bool(0))
-ext5_5     = Signal(bool(0))
-ext5_6     = Signal(bool(0))
-ext5_7     = Signal(bool(0))
-
-ext6_0     = Signal(bool(0))
-ext6_1     = Signal(bool(0))
-ext6_2     = Signal(bool(0))
-ext6_3     = Signal(bool(0))
-ext6_4     = Signal(bool(0))
-ext6_5     = Signal(bool(0))
-ext6_6     = Signal(bool(0))
-ext6_7     = Signal(bool(0))
-
-ext7_0     = Signal(bool(0))
-ext7_1     = Signal(bool(0))
-ext7_2     = Signal(bool(0))
-ext7_3     = Signal(bool(0))
-ext7_4     = Signal(bool(0))
-ext7_5     = Signal(bool(0))
-ext7_6     = Signal(bool(0))
-ext7_7     = Signal(bool(0))
-
-led_yellow_n = Signal(bool(0))
-led_green_n  = Signal(bool(0))
-led_red_n    = Signal(bool(0))
-
-RobotIO_inst = toVHDL(RobotIO,
-    clk25,
-    sspi_clk, sspi_cs, sspi_miso, sspi_mosi,
-    rc1_cha, rc1_chb,
-    rc2_cha, rc2_chb,
-    rc3_cha, rc3_chb,
-    rc4_cha, rc4_chb,
-    mot1_brake, mot1_dir, mot1_pwm,
-    mot2_brake, mot2_dir, mot2_pwm,
-    mot3_brake, mot3_dir, mot3_pwm,
-    mot4_brake, mot4_dir, mot4_pwm,
-    mot5_brake, mot5_dir, mot5_pwm,
-    mot6_brake, mot6_dir, mot6_pwm,
-    mot7_brake, mot7_dir, mot7_pwm,
-    mot8_brake, mot8_dir, mot8_pwm,
-    adc1_clk, adc1_cs, adc1_miso, adc1_mosi,
-    pwm1_ch0, pwm1_ch1, pwm1_ch2, pwm1_ch3, pwm1_ch4, pwm1_ch5, pwm1_ch6, pwm1_ch7,
-    ext1_0, ext1_1, ext1_2, ext1_3, ext1_4, ext1_5, ext1_6, ext1_7,
-    ext2_0, ext2_1, ext2_2, ext2_3, ext2_4, ext2_5, ext2_6, ext2_7,
-    ext3_0, ext3_1, ext3_2, ext3_3, ext3_4, ext3_5, ext3_6, ext3_7,
-    ext4_0, ext4_1, ext4_2, ext4_3, ext4_4, ext4_5, ext4_6, ext4_7,
-    ext5_0, ext5_1, ext5_2, ext5_3, ext5_4, ext5_5, ext5_6, ext5_7,
-    ext6_0, ext6_1, ext6_2, ext6_3, ext6_4, ext6_5, ext6_6, ext6_7,
-    ext7_0, ext7_1, ext7_2, ext7_3, ext7_4, ext7_5, ext7_6, ext7_7,
-    led_yellow_n, led_green_n, led_red_n,
-    True
-)
+from Robot.Main import top_level
+
+# ports of RobotIO, in order
+signals = [Signal(bool(0)) for name in ports(config)]
+
+RobotIO_inst = toVHDL(top_level(config), *(signals + [True]))
+
+write_hashes(hashes)
@@ -0,0 +1,67 @@
+from myhdl import concat, instance, instances, intbv
+from Robot.Utils.Constants import LOW, HIGH
+
+def DerivateFilter(input, output, shift, strobe, clk25, rst_n):
+    """
+
+    Derivate filter module
+
+    This filter outputs the difference between the current input and the
+    input at the previous strobe, multiplied by 2**shift.
+
+    This is useful as the feedback filter of a speed control system, to turn
+    the count of an odometer into a speed.
+
+    input
+
+        Input of the filter. It may wrap around (such as an odometer count):
+        the difference is computed modulo 2**(len(output) - shift).
+
+    output
+
+        Filtered output.
+
+    shift
+
+        The difference is multiplied by 2**shift, so that output has shift
+        fractional bits.
+
+    strobe
+
+        The output is computed when strobe is high on a clk25 rising edge.
+
+    clk25
+
+        25 MHz clock input.
+
+    rst_n
+
+        Active low reset input (output is reset when active).
+
+    """
+
+    # width of the difference
+    W = len(output) - shift
+    assert W >= 2 and W <= len(input), 'wrong output width'
+
+    @instance
+    def DoFilter():
+        """ Computes the difference of inputs """
+
+        previous_in = intbv(0)[W:]
+
+        # difference of inputs, modulo 2**W in its lower bits
+        diff = intbv(0)[W+1:]
+
+        while True:
+            yield clk25.posedge, rst_n.negedge
+            if rst_n == LOW:
+                previous_in[:] = input[W:]
+                output.next = 0
+            else:
+                if strobe == HIGH:
+                    diff[:] = concat(HIGH, input[W:]) - previous_in
+                    output.next = diff[W:].signed() * 2**shift
+                    previous_in[:] = input[W:]
+
+    return instances()
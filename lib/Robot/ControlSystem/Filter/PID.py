@@ -0,0 +1,160 @@
+from myhdl import instance, instances, intbv
+from Robot.Utils.Constants import LOW, HIGH
+
+def PIDFilter(input, output, gain_P, gain_I, gain_D, out_shift, max_I, strobe, clk25, rst_n):
+    """
+
+    PID filter module
+
+    This is a classic PID filter. Its output is the sum of three separate
+    terms:
+    - proportional: this is directly related to the input of the filter.
+    - integral: this is the sum of all inputs since the last reset of the filter.
+    - derivate: this term is computed from the difference between the previous
+      and the current input.
+
+    A gain is configurable for each term.
+
+    The filter runs once per strobe. The terms are added one after the other
+    on the clk25 period of the strobe and the next two, the operands of the
+    multiplication being selected by the step, so that one multiplier is
+    enough, and output is set 4 clk25 periods after the strobe.
+
+    input
+
+        Input of the filter.
+
+    output
+
+        Filtered output. Saturates to the range of output.
+
+    gain_P
+
+        Proportional gain.
+
+    gain_I
+
+        Integral gain.
+
+    gain_D
+
+        Derivate gain.
+
+    out_shift
+
+        Common divisor for output. The division is done by shifting the output
+        by the specified number of bits.
+
+    max_I
+
+        Integral term saturation level.
+
+    strobe
+
+        The filter runs when strobe is high on a clk25 rising edge.
+
+    clk25
+
+        25 MHz clock input.
+
+    rst_n
+
+        Active low reset input (internal variables are reset when active).
+
+    """
+
+    # bounds of the sum of the three terms
+    MAX_IN = max(-input.min, input.max)
+    MAX_ACC = MAX_IN * (gain_P.max - 1) + max_I.max * (gain_I.max - 1) + 2 * MAX_IN * (gain_D.max - 1)
+
+    # output saturation levels
+    OUT_MAX = output.max - 1
+    OUT_MIN = output.min
+
+    @instance
+    def DoFilter():
+        """ Computes and saturates output """
+
+        integral = intbv(0, min = -max_I.max + 1, max = max_I.max)
+        derivate = intbv(0, min = input.min - input.max + 1, max = input.max - input.min)
+        previous_in = intbv(0, min = input.min, max = input.max)
+
+        # signed copy of max_I
+        limit_I = intbv(0, min = -max_I.max + 1, max = max_I.max)
+
+        # integral before saturation
+        new_integral = intbv(0, min = integral.min + input.min, max = integral.max + input.max)
+
+        # operands of the multiplier: a term and its gain
+        factor = intbv(0, min = min(input.min, integral.min, derivate.min),
+                       max = max(input.max, integral.max, derivate.max))
+        coef = intbv(0, min = min(gain_P.min, gain_I.min, gain_D.min),
+                     max = max(gain_P.max, gain_I.max, gain_D.max))
+
+        # sum of the terms, and output before saturation
+        acc = intbv(0, min = -MAX_ACC, max = MAX_ACC + 1)
+        new_output = intbv(0, min = -MAX_ACC, max = MAX_ACC + 1)
+
+        # 0 when waiting for strobe, then 1 and 2 for the next terms, then 3
+        # for the output
+        step = intbv(0, min = 0, max = 4)
+
+        while True:
+            yield clk25.posedge, rst_n.negedge
+            if rst_n == LOW:
+                integral[:] = 0
+                derivate[:] = 0
+                previous_in[:] = 0
+                acc[:] = 0
+                step[:] = 0
+                output.next = 0
+            else:
+                if step == 3:
+                    # compute, saturate and drive output
+                    new_output[:] = acc >> out_shift
+                    if new_output > OUT_MAX:
+                        output.next = OUT_MAX
+                    elif new_output < OUT_MIN:
+                        output.next = OUT_MIN
+                    else:
+                        output.next = new_output
+                    step[:] = 0
+
+                elif step != 0 or strobe == HIGH:
+                    if step == 0:
+                        # compute and saturate integral term
+                        limit_I[:] = max_I
+                        new_integral[:] = integral + input
+                        if new_integral > limit_I:
+                            integral[:] = limit_I
+                        elif new_integral < -limit_I:
+                            integral[:] = -limit_I
+                        else:
+                            integral[:] = new_integral
+
+                        # compute derivate term
+                        derivate[:] = input - previous_in
+
+                        # keep input for next derivate computation
+                        previous_in[:] = input
+
+                        # proportional term
+                        acc[:] = 0
+                        factor[:] = input
+                        coef[:] = gain_P
+
+                    elif step == 1:
+                        # integral term
+                        factor[:] = integral
+                        coef[:] = gain_I
+
+                    else:
+                        # derivate term
+                        factor[:] = derivate
+                        coef[:] = gain_D
+
+                    # the only multiplier
+                    acc[:] = acc + factor * coef
+                    step[:] = step + 1
+
+    return instances()
@@ -0,0 +1,84 @@
+from myhdl import instance, instances, intbv
+from Robot.Utils.Constants import LOW, HIGH
+
+def RampFilter(input, output, var_1st_ord_pos, var_1st_ord_neg, strobe, clk25, rst_n):
+    """
+
+    Ramp filter module
+
+    This filter ensures that its output is continuous and respects maximum rise
+    and fall coefficients.
+
+    This is useful to ensure that a speed consign is continuous, even if the input
+    speed consign changes dramatically, while respecting maximum acceleration and
+    deceleration values.
+
+    The input is a speed consign. The filter is configured with acceleration
+    limits. Those limits determine the shape of the output (rise and fall
+    coefficients). The output is a filtered speed consign that can be applied
+    to a PID filter in a speed control system, for example.
+
+    For example, if the input changes suddenly from 0 to 100, then the output
+    will vary from 0 to 100 while respecting the maximum acceleration.
+
+    input
+
+        Input of the filter.
+
+    output
+
+        Filtered output.
+
+    var_1st_ord_pos
+
+        Maximum positive value of the first order derivate of the output, per
+        strobe. If the output is a speed, then this is the maximum
+        acceleration.
+
+    var_1st_ord_neg
+
+        ABS(maximum negative value of the first order derivate of the output),
+        per strobe. If the output is a speed, then this is the maximum
+        deceleration.
+
+    strobe
+
+        The output moves when strobe is high on a clk25 rising edge.
+
+    clk25
+
+        25 MHz clock input.
+
+    rst_n
+
+        Active low reset input (output is reset when active).
+
+    """
+
+    @instance
+    def DoFilter():
+        """ Moves output towards input """
+
+        # R/W copy of output
+        int_output = intbv(0, min = output.min, max = output.max)
+
+        while True:
+            yield clk25.posedge, rst_n.negedge
+            if rst_n == LOW:
+                int_output[:] = 0
+                output.next = 0
+            else:
+                if strobe == HIGH:
+                    if input > int_output:
+                        if input - int_output < var_1st_ord_pos:
+                            int_output[:] = input
+                        else:
+                            int_output[:] = int_output + var_1st_ord_pos
+                    else:
+                        if int_output - input < var_1st_ord_neg:
+                            int_output[:] = input
+                        else:
+                            int_output[:] = int_output - var_1st_ord_neg
+                    output.next = int_output
+
+    return instances()
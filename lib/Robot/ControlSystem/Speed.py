@@ -0,0 +1,83 @@
+from myhdl import Signal, instances, intbv
+from Robot.ControlSystem.Filter.Derivate import DerivateFilter
+from Robot.ControlSystem.Filter.PID import PIDFilter
+from Robot.ControlSystem.Filter.Ramp import RampFilter
+from Robot.ControlSystem.Manager import ControlSystemManager
+
+def SpeedControl(speed, count, consign,
+                 gain_P, gain_I, gain_D, out_shift, max_I, accel, decel,
+                 strobe, clk25, rst_n, shift = 8):
+    """
+
+    Speed control system for a motor
+
+    Closes the speed loop of a motor with the count of its odometer:
+    - the consign filter is a ramp filter, limiting accelerations,
+    - the correct filter is a PID filter,
+    - the feedback filter is a derivate filter, turning the count into a
+      speed.
+
+    The loop runs once per strobe. Speeds are in ticks per strobe period,
+    with shift fractional bits.
+
+    speed
+
+        Output speed of the motor (see MotorDriver).
+
+    count
+
+        Input count of the odometer (see OdometerReader).
+
+    consign
+
+        Input speed consign, in ticks per strobe period, with shift
+        fractional bits.
+
+    gain_P, gain_I, gain_D, out_shift, max_I
+
+        Parameters of the PID filter (see PIDFilter).
+
+    accel, decel
+
+        Maximum acceleration and deceleration of the consign, per strobe
+        (see RampFilter).
+
+    strobe
+
+        The loop runs when strobe is high on a clk25 rising edge.
+
+    clk25
+
+        25 MHz clock input.
+
+    rst_n
+
+        Active low reset input (the loop is reset when active).
+
+    shift
+
+        Number of fractional bits of speeds.
+
+    """
+
+    # consign filter
+    ramp_input = Signal(intbv(0, min = consign.min, max = consign.max))
+    ramp_output = Signal(intbv(0, min = consign.min, max = consign.max))
+    Ramp_inst = RampFilter(ramp_input, ramp_output, accel, decel, strobe, clk25, rst_n)
+
+    # feedback filter
+    derivate_input = Signal(intbv(0, min = count.min, max = count.max))
+    derivate_output = Signal(intbv(0, min = consign.min, max = consign.max))
+    Derivate_inst = DerivateFilter(derivate_input, derivate_output, shift, strobe, clk25, rst_n)
+
+    # correct filter
+    pid_input = Signal(intbv(0, min = consign.min - consign.max, max = consign.max - consign.min))
+    pid_output = Signal(intbv(0, min = speed.min, max = speed.max))
+    PID_inst = PIDFilter(pid_input, pid_output, gain_P, gain_I, gain_D, out_shift, max_I, strobe, clk25, rst_n)
+
+    Manager_inst = ControlSystemManager(ramp_input, ramp_output,
+                                        pid_input, pid_output,
+                                        derivate_input, derivate_output,
+                                        speed, count, consign)
+
+    return instances()
@@ -1,7 +1,7 @@
 from myhdl import instance, instances, intbv
 from Robot.Utils.Constants import LOW, CLK_FREQ
 
-def LEDDriver(led, clk, rst_n):
+def LEDDriver(led, clk, rst_n, time_scale = 1):
     """
 
     Toggle a LED every second (1s off, 1s on).
@@ -18,30 +18,41 @@ def LEDDriver(led, clk, rst_n):
 
         Active low reset input (resets internal counter when active).
 
+    time_scale
+
+        For simulation only: the LED toggles time_scale times faster
+        (rounded down). The driver behaves as without time_scale when
+        it is 1.
+
     """
 
     TOGGLE_FREQ = 1
     CNT_MAX = int(CLK_FREQ/TOGGLE_FREQ - 1)
 
+    # cnt counts time_scale clock periods per clock period (see ServoDriver)
+    assert 1 <= time_scale <= CNT_MAX, 'wrong time_scale'
+    CNT_FIRST = time_scale - 1
+    CNT_LAST = CNT_MAX - (CNT_MAX - CNT_FIRST) % time_scale
+
     @instance
     def DriveLED():
         """ Toggle LED every second """
 
         # cnt overflows at 1Hz
-        cnt = intbv(0, min = 0, max = CNT_MAX + 1)
+        cnt = intbv(CNT_FIRST, min = 0, max = CNT_MAX + 1)
         led_on = LOW
 
         while True:
             yield clk.posedge, rst_n.negedge
             if rst_n == LOW:
-                cnt[:] = 0
+                cnt[:] = CNT_FIRST
                 led_on = LOW
             else:
-                if cnt == CNT_MAX:
-                    cnt[:] = 0
+                if cnt == CNT_LAST:
+                    cnt[:] = CNT_FIRST
                     led_on = not led_on
                     led.next = led_on
                 else:
-                    cnt += 1
+                    cnt += time_scale
 
     return instances()
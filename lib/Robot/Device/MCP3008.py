@@ -0,0 +1,189 @@
+from myhdl import enum, instance, instances, intbv, concat
+from Robot.Utils.Constants import LOW, HIGH, CLK_FREQ
+
+t_State = enum('IDLE', 'SELECT', 'TRANSFER', 'DONE')
+
+def MCP3008Driver(
+    ch0, ch1, ch2, ch3, ch4, ch5, ch6, ch7,
+    spi_clk, spi_ss_n, spi_miso, spi_mosi,
+    clk25, rst_n, spi_freq = 1000000, scan_freq = 1000):
+    """
+
+    Background scanner for Microchip MCP3008 8-Channel 10-Bit A/D Converter
+
+    Converts the 8 channels one after the other, scan_freq times per second,
+    and keeps the latest value of each channel on its output. The SPI clock
+    is generated from clk25, independently from the Gumstix SPI clock.
+
+    The slave needs either SPI Mode 0 or 3. Mode 3 is used here.
+
+    The 17-bit data we send:
+    - start bit (a 1)
+    - single-ended bit (a 1)
+    - 3 bits for the channel (most significant bit first)
+    - 12 padding bits (we send zeros)
+
+    The 17-bit data we get back
+    - 6 padding bits
+    - a null bit
+    - the 10-bit value
+
+    ch[0-7]
+
+        Output 10-bit unsigned value for each A/D channel.
+
+    spi_clk, spi_ss_n, spi_miso, spi_mosi
+
+        SPI signals for communication with MCP3008 (FPGA is master)
+
+    clk25
+
+        25 MHz clock input.
+
+    rst_n
+
+        Active low reset input.
+
+    spi_freq
+
+        Frequency of the generated SPI clock, in Hz. The MCP3008 accepts
+        up to 1.35 MHz at 2.7 V.
+
+    scan_freq
+
+        Number of scans of the 8 channels per second. A scan takes about
+        8 * 19 SPI clock periods: if scan_freq is too high, a new scan starts
+        as soon as the previous one is done.
+
+    """
+
+    for ch in (ch0, ch1, ch2, ch3, ch4, ch5, ch6, ch7):
+        assert len(ch) >= 10, 'wrong channel width'
+
+    # word size: 17 bits
+    ws = 17
+
+    # Counter for spi_freq clock (counter must overflow twice per period)
+    SPI_CNT_MAX = int(CLK_FREQ/(spi_freq*2) - 1)
+    assert SPI_CNT_MAX >= 1, 'spi_freq too high'
+
+    # Counter for scan_freq scans
+    SCAN_CNT_MAX = int(CLK_FREQ/scan_freq - 1)
+
+    @instance
+    def ScanADC():
+        """ Converts all channels at scan_freq """
+
+        state = t_State.IDLE
+
+        # currently converted channel
+        channel = intbv(0)[3:]
+
+        # half SPI clock period counter
+        spi_cnt = intbv(0, min = 0, max = SPI_CNT_MAX + 1)
+
+        # scan period counter
+        scan_cnt = intbv(0, min = 0, max = SCAN_CNT_MAX + 1)
+
+        # number of bits received (0 to 17)
+        bit_cnt = intbv(0, min = 0, max = ws + 1)
+
+        # shift registers with bits to send to and received from MCP3008
+        txsreg = intbv(0)[ws:]
+        rxsreg = intbv(0)[10:]
+
+        # start a new scan when the previous one is done
+        scan_pending = False
+
+        # level of spi_clk (an output port is not read back)
+        clk_level = HIGH
+
+        while True:
+            yield clk25.posedge, rst_n.negedge
+            if rst_n == LOW:
+                state = t_State.IDLE
+                channel[:] = 0
+                spi_cnt[:] = 0
+                scan_cnt[:] = 0
+                scan_pending = False
+                clk_level = HIGH
+                spi_clk.next = HIGH
+                spi_ss_n.next = HIGH
+                spi_mosi.next = LOW
+            else:
+                if scan_cnt == SCAN_CNT_MAX:
+                    scan_cnt[:] = 0
+                    scan_pending = True
+                else:
+                    scan_cnt += 1
+
+                if state == t_State.IDLE:
+                    clk_level = HIGH
+                    spi_clk.next = HIGH
+                    spi_ss_n.next = HIGH
+                    spi_mosi.next = LOW
+                    if scan_pending:
+                        scan_pending = False
+                        channel[:] = 0
+                        spi_cnt[:] = 0
+                        state = t_State.SELECT
+
+                elif spi_cnt != SPI_CNT_MAX:
+                    # Wait for the next SPI clock edge
+                    spi_cnt += 1
+
+                else:
+                    spi_cnt[:] = 0
+
+                    if state == t_State.SELECT:
+                        # Select slave, mosi is low until the start bit
+                        txsreg[:] = concat(HIGH, HIGH, channel, intbv(0)[12:])
+                        bit_cnt[:] = 0
+                        spi_ss_n.next = LOW
+                        state = t_State.TRANSFER
+
+                    elif state == t_State.TRANSFER:
+                        if clk_level == HIGH:
+                            # Propagate on falling edge (mode 3)
+                            clk_level = LOW
+                            spi_clk.next = LOW
+                            spi_mosi.next = txsreg[ws-1]
+                            txsreg[ws:1] = txsreg[ws-1:]
+                        else:
+                            # Capture on rising edge (mode 3)
+                            clk_level = HIGH
+                            spi_clk.next = HIGH
+                            rxsreg[:] = concat(rxsreg[9:], spi_miso)
+                            if bit_cnt == ws - 1:
+                                state = t_State.DONE
+                            bit_cnt += 1
+
+                    elif state == t_State.DONE:
+                        # Deselect slave and set output
+                        spi_ss_n.next = HIGH
+                        spi_mosi.next = LOW
+                        if channel == 0:
+                            ch0.next = rxsreg
+                        elif channel == 1:
+                            ch1.next = rxsreg
+                        elif channel == 2:
+                            ch2.next = rxsreg
+                        elif channel == 3:
+                            ch3.next = rxsreg
+                        elif channel == 4:
+                            ch4.next = rxsreg
+                        elif channel == 5:
+                            ch5.next = rxsreg
+                        elif channel == 6:
+                            ch6.next = rxsreg
+                        else:
+                            ch7.next = rxsreg
+
+                        # Next time convert next channel
+                        if channel == 7:
+                            state = t_State.IDLE
+                        else:
+                            channel += 1
+                            state = t_State.SELECT
+
+    return instances()
@@ -1,7 +1,7 @@
-from myhdl import instance, instances, intbv
+from myhdl import Signal, always, concat, instance, instances, intbv
 from Robot.Utils.Constants import LOW, HIGH
 
-def MotorDriver(pwm, dir, en_n, clk25, speed, rst_n, optocoupled):
+def MotorDriver(pwm, dir, en_n, clk25, speed, rst_n, optocoupled, time_scale = 1):
     """
 
     PWM signal generator with direction signal for DC motors.
@@ -39,59 +39,216 @@ def MotorDriver(pwm, dir, en_n, clk25, speed, rst_n, optocoupled):
 
         Set to True if outputs should be inverted to account for optocouplers.
 
+    time_scale
+
+        For simulation only: the PWM period and the duty cycle are divided
+        by time_scale (rounded down). The driver behaves as without
+        time_scale when it is 1.
+
     """
 
-    assert speed.min >= -2**10 and speed.max <= 2**10, 'wrong speed constraints'
+    return MotorBank([pwm], [dir], [en_n], clk25, [speed], rst_n, optocoupled, time_scale, phases = [0])
+
+def MotorBank(pwms, dirs, en_ns, clk25, speeds, rst_n, optocoupled, time_scale = 1, phases = None,
+              resolutions = None, prescalers = None):
+    """
+
+    PWM signal generator with direction signal for several DC motors
+
+    Drives each motor like MotorDriver, but all motors share one period
+    counter: each motor only has its own duty cycle and comparator, and
+    its period starts phase clk25 periods after the period of the counter,
+    so that the H-bridges do not all switch on at the same time.
+
+    The PWM period of each motor can be changed at run time, in powers of
+    two: a period lasts 2**resolution ticks of 2**prescaler clk25 periods
+    each, from about 190 Hz (25 MHz / 2**17) up, and the speed is scaled to
+    it by dropping its low bits (1024 is always the whole period). Periods
+    and speeds are scaled by shifts, without any multiplier. With the
+    default resolution (10) and prescaler (0), a motor is driven exactly
+    like with MotorDriver.
+
+    The speed, the resolution and the prescaler of a motor are applied
+    together at the first clk25 period that starts both its current period
+    and the requested one, so that changing them never cuts a pulse short.
+
+    pwms, dirs, en_ns
+
+        Lists of output PWM, direction and active low enable signals, one
+        per motor
+
+    clk25
+
+        25 MHz clock input
+
+    speeds
+
+        List of 11-bit signed speed values in 1024ths of the PWM period,
+        one per motor (see MotorDriver)
+
+    rst_n
+
+        Active low reset input (resets the period counter and restores the
+        default resolution and prescaler until the next period starts).
+
+    optocoupled
+
+        Set to True if outputs should be inverted to account for optocouplers.
+
+    time_scale
+
+        Same as MotorDriver, but must be a power of two. Periods shorter
+        than time_scale clk25 periods are not supported.
+
+    phases
+
+        List of the phase offsets of the motors, in clk25 periods (0 to
+        1023). By default, the periods of the motors are spread evenly
+        over the default PWM period. With a time_scale, the offsets are
+        divided by time_scale too (rounded down).
+
+    resolutions
+
+        Optional list of 4-bit resolutions, one per motor: number of ticks
+        per PWM period, as a power of two (0 to 10, larger values act as
+        10; 10 by default: about 25 KHz)
+
+    prescalers
+
+        Optional list of 3-bit prescalers, one per motor: number of clk25
+        periods per tick, as a power of two (0 to 7, 0 by default)
+
+    """
+
+    assert len(pwms) == len(dirs) == len(en_ns) == len(speeds), 'one speed per motor'
+    for speed in speeds:
+        assert speed.min >= -2**10 and speed.max <= 2**10, 'wrong speed constraints'
+
+    RES_MAX = 10
+    PRESCALER_MAX = 7
+
+    # the counter spans the longest period, and moves by time_scale per
+    # clk25 period (see ServoDriver): it wraps around exactly if time_scale
+    # is a power of two, as needed to share it between periods
+    CNT_WIDTH = RES_MAX + PRESCALER_MAX
+    CNT_FIRST = time_scale - 1
+    CNT_LAST = 2**CNT_WIDTH - 1
+    assert 1 <= time_scale <= 2**RES_MAX and time_scale & CNT_FIRST == 0, 'wrong time_scale'
+
+    if phases is None:
+        phases = [2**RES_MAX * i // len(pwms) for i in range(len(pwms))]
+    assert len(phases) == len(pwms), 'one phase per motor'
+    assert all(0 <= phase < 2**RES_MAX for phase in phases), 'wrong phase'
+
+    if resolutions is None:
+        resolutions = [Signal(intbv(RES_MAX)[4:]) for i in range(len(pwms))]
+    if prescalers is None:
+        prescalers = [Signal(intbv(0)[3:]) for i in range(len(pwms))]
+    assert len(resolutions) == len(prescalers) == len(pwms), 'one resolution and prescaler per motor'
+    for resolution, prescaler in zip(resolutions, prescalers):
+        assert len(resolution) == 4 and len(prescaler) == 3, 'wrong resolution or prescaler width'
+
+    cnt = Signal(intbv(CNT_FIRST)[CNT_WIDTH:])
+
+    @always(clk25.posedge, rst_n.negedge)
+    def CountPeriod():
+        """ Count the longest period, shared by all motors """
+        if rst_n == LOW:
+            cnt.next = CNT_FIRST
+        else:
+            if cnt == CNT_LAST:
+                cnt.next = CNT_FIRST
+            else:
+                cnt.next = cnt + time_scale
+
+    Channel_inst = [_MotorChannel(pwms[i], dirs[i], en_ns[i], speeds[i], resolutions[i], prescalers[i], cnt,
+                                  phases[i] - phases[i] % time_scale, CNT_FIRST, clk25, rst_n, optocoupled)
+                    for i in range(len(pwms))]
+
+    return instances()
+
+def _MotorChannel(pwm, dir, en_n, speed, resolution, prescaler, cnt, phase, first, clk25, rst_n, optocoupled):
+    """ Drives one motor of a MotorBank from the shared period counter cnt,
+    its periods start when cnt - phase is first modulo their length """
 
     # account for optocouplers
     LOW_OPTO  = LOW if not optocoupled else HIGH
     HIGH_OPTO = HIGH if not optocoupled else LOW
 
-    CNT_MAX = 2**10 - 1;
+    RES_MAX = 10
+    DUTY_MAX = 2**RES_MAX - 1
+    W = len(cnt)
+    PHASE = phase
+    CNT_FIRST = first
 
     @instance
     def DriveMotor():
         """ Generate PWM, dir and brake signals for motor """
 
-        # cnt overflows at 25KHz (approximately)
-        cnt = intbv(0, min = 0, max = CNT_MAX + 1)
+        # position in the longest period, with the borrow of the subtraction
+        position = intbv(0)[W + 1:]
+
+        # resolution of the requested period, and its number of bits of
+        # the counter
+        bits = intbv(0)[4:]
+        length = intbv(0)[5:]
 
-        # 10-bit duty cycle
-        duty_cycle = intbv(0)[10:]
+        # masks of the position in the current and in the requested periods
+        period_mask = intbv(DUTY_MAX)[W:]
+        next_mask = intbv(0)[W:]
+
+        # 10-bit speed, in ticks of the period, and duty cycle in clk25
+        # periods
+        magnitude = intbv(0)[10:]
+        ticks = intbv(0)[10:]
+        duty_cycle = intbv(0)[W:]
 
         while True:
             yield clk25.posedge, rst_n.negedge
             if rst_n == LOW:
-                cnt[:] = 0
+                period_mask[:] = DUTY_MAX
                 duty_cycle[:] = 0
                 dir.next = HIGH_OPTO
                 pwm.next = LOW_OPTO
                 en_n.next = LOW_OPTO
             else:
-                # accept new consign at the beginning of a period
-                if cnt == 0:
+                position[:] = concat(HIGH, cnt[W:]) - PHASE
+
+                # mask of the requested period
+                if resolution >= RES_MAX:
+                    bits[:] = RES_MAX
+                else:
+                    bits[:] = resolution
+                length[:] = bits + prescaler
+                for i in range(W):
+                    next_mask[i] = i < length
+
+                # accept new consign, resolution and prescaler at the
+                # beginning of both the current and the requested periods
+                if (position[W:] & (period_mask | next_mask)) == CNT_FIRST:
+                    period_mask[:] = next_mask
+
                     # extract duty cycle and direction
                     if speed >= 0:
-                        duty_cycle[:] = speed
+                        magnitude[:] = speed
                         dir.next = HIGH_OPTO
-                    elif -speed >= CNT_MAX: # handle -1024 case
-                        duty_cycle[:] = CNT_MAX
+                    elif -speed >= DUTY_MAX: # handle -1024 case
+                        magnitude[:] = DUTY_MAX
                         dir.next = LOW_OPTO
                     else:
-                        duty_cycle[:] = -speed
+                        magnitude[:] = -speed
                         dir.next = LOW_OPTO
 
+                    # scale to the period (no change with 1024)
+                    ticks[:] = magnitude >> (RES_MAX - bits)
+                    duty_cycle[:] = ticks << prescaler
+
                 # reached consign?
-                if cnt >= duty_cycle:
+                if (position[W:] & period_mask) >= duty_cycle:
                     pwm.next = LOW_OPTO
                 else:
                     pwm.next = HIGH_OPTO
 
-                if cnt == CNT_MAX:
-                    cnt[:] = 0
-                else:
-                    cnt += 1
-
                 en_n.next = LOW_OPTO
 
-    return instances()
+    return DriveMotor
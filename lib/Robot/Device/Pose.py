@@ -0,0 +1,159 @@
+from myhdl import Signal, concat, enum, instance, instances, intbv
+from Robot.Utils.CORDIC import SinCos
+from Robot.Utils.Constants import LOW, HIGH
+
+t_State = enum('IDLE', 'ROTATE', 'MOVE')
+
+def PoseEstimator(x, y, theta, left_count, right_count, angle_scale, clear, clk25, rst_n):
+    """
+
+    Dead-reckoning for a differential drive robot
+
+    Integrates the moves of the left and right odometers into the position
+    (x, y) and heading theta of the robot. The pose is updated on every
+    odometer tick, or every 20 clk25 periods if ticks come faster than that:
+    - the robot moves by the mean of the left and right moves, along theta,
+      using a CORDIC for the sine and cosine of theta,
+    - theta turns by the difference of the right and left moves, times
+      angle_scale.
+
+    x, y
+
+        Output position, in odometer ticks with 8 fractional bits.
+
+    theta
+
+        Output heading, as a binary angle: a full turn is 2**len(theta).
+        0 is along the x axis, turning counterclockwise when the right
+        odometer moves forward more than the left one.
+
+    left_count, right_count
+
+        Input counts of the left and right odometers (see OdometerReader).
+
+    angle_scale
+
+        Input turn of the robot for one tick of difference between the right
+        and left odometers, in theta units. This is
+        2**len(theta) / (2 * pi * track), where track is the distance
+        between the odometer wheels, in ticks.
+
+    clear
+
+        Input: the pose is reset to 0 when clear is high on a clk25 rising
+        edge. Clear the pose after changing the odometers.
+
+    clk25
+
+        25 MHz clock input.
+
+    rst_n
+
+        Active low reset input (the pose is reset when active).
+
+    """
+
+    assert len(x) == 32 and len(y) == 32 and len(theta) == 32, 'wrong pose width'
+    assert len(angle_scale) <= 24, 'angle_scale too wide'
+
+    # width of the moves between two updates: up to 20 ticks per odometer
+    M = 6
+
+    # fractional bits of the internal position: x and y are the upper bits
+    F = 17
+    P = 24 + F
+
+    # fixed-point sine and cosine, with 16 fractional bits
+    cos_theta = Signal(intbv(0, min = -2**17, max = 2**17))
+    sin_theta = Signal(intbv(0, min = -2**17, max = 2**17))
+    angle = Signal(intbv(0)[16:])
+    start, done = Signal(LOW), Signal(LOW)
+    SinCos_inst = SinCos(cos_theta, sin_theta, angle, start, done, clk25, rst_n)
+
+    @instance
+    def Integrate():
+        """ Updates the pose with the moves of the odometers """
+
+        state = t_State.IDLE
+
+        # counts at the previous update (lower bits)
+        previous_left = intbv(0)[M:]
+        previous_right = intbv(0)[M:]
+
+        # differences of counts, modulo 2**M in their lower bits
+        diff_left = intbv(0)[M+1:]
+        diff_right = intbv(0)[M+1:]
+
+        # moves of the odometers since the previous update
+        left_move = intbv(0, min = -2**(M-1), max = 2**(M-1))
+        right_move = intbv(0, min = -2**(M-1), max = 2**(M-1))
+
+        # move of the robot along theta, in half ticks
+        distance = intbv(0, min = -2**M, max = 2**M)
+
+        # turn of the robot, and its lower 32 bits
+        turn = intbv(0, min = -2**31, max = 2**31)
+        turn_bits = intbv(0)[32:]
+
+        # internal pose
+        x_pos = intbv(0, min = -2**(P-1), max = 2**(P-1))
+        y_pos = intbv(0, min = -2**(P-1), max = 2**(P-1))
+        heading = intbv(0)[33:]
+
+        while True:
+            yield clk25.posedge, rst_n.negedge
+            if rst_n == LOW:
+                state = t_State.IDLE
+                previous_left[:] = 0
+                previous_right[:] = 0
+                x_pos[:] = 0
+                y_pos[:] = 0
+                heading[:] = 0
+                start.next = LOW
+                x.next = 0
+                y.next = 0
+                theta.next = 0
+            else:
+                start.next = LOW
+                if clear == HIGH:
+                    state = t_State.IDLE
+                    previous_left[:] = left_count[M:]
+                    previous_right[:] = right_count[M:]
+                    x_pos[:] = 0
+                    y_pos[:] = 0
+                    heading[:] = 0
+                    x.next = 0
+                    y.next = 0
+                    theta.next = 0
+
+                elif state == t_State.IDLE:
+                    diff_left[:] = concat(HIGH, left_count[M:]) - previous_left
+                    diff_right[:] = concat(HIGH, right_count[M:]) - previous_right
+                    if diff_left[M:] != 0 or diff_right[M:] != 0:
+                        # It moved: get the sine and cosine of theta
+                        left_move[:] = diff_left[M:].signed()
+                        right_move[:] = diff_right[M:].signed()
+                        previous_left[:] = left_count[M:]
+                        previous_right[:] = right_count[M:]
+                        angle.next = heading[32:16]
+                        start.next = HIGH
+                        state = t_State.ROTATE
+
+                elif state == t_State.ROTATE:
+                    if done == HIGH:
+                        distance[:] = left_move + right_move
+                        turn[:] = (right_move - left_move) * angle_scale
+                        state = t_State.MOVE
+
+                else:
+                    # Move along theta, then turn
+                    x_pos[:] = x_pos + distance * cos_theta
+                    y_pos[:] = y_pos + distance * sin_theta
+                    turn_bits[:] = turn[32:]
+                    heading[:] = heading[32:] + turn_bits
+                    x.next = x_pos[P:P-32].signed()
+                    y.next = y_pos[P:P-32].signed()
+                    theta.next = heading[32:]
+                    state = t_State.IDLE
+
+    return instances()
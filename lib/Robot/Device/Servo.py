@@ -1,7 +1,7 @@
-from myhdl import instance, instances, intbv
+from myhdl import Signal, always_comb, instance, instances, intbv
 from Robot.Utils.Constants import LOW, HIGH, CLK_FREQ
 
-def ServoDriver(pwm, clk25, consign, rst_n, optocoupled):
+def ServoDriver(pwm, clk25, consign, rst_n, optocoupled, time_scale = 1):
     """
 
     PWM signal generator for servo motors
@@ -44,36 +44,114 @@ def ServoDriver(pwm, clk25, consign, rst_n, optocoupled):
 
         Set to True if output should be inverted to account for optocoupler.
 
+    time_scale
+
+        For simulation only: the PWM period and the duty cycle are divided
+        by time_scale (rounded down), so that a period lasts a few clk25
+        periods only. The driver behaves as without time_scale when it
+        is 1.
+
     """
 
-    assert consign.min >= 0 and consign.max <= 2**16, 'wrong consign constraints'
+    return ServoBank([pwm], clk25, [consign], rst_n, optocoupled, time_scale)
 
-    # account for optocouplers
-    LOW_OPTO  = LOW if not optocoupled else HIGH
-    HIGH_OPTO = HIGH if not optocoupled else LOW
+def ServoBank(pwms, clk25, consigns, rst_n, optocoupled, time_scale = 1):
+    """
+
+    PWM signal generator for several servo motors
+
+    Drives each PWM output like ServoDriver, but all outputs share one
+    period counter: each output only has its own duty cycle register and
+    comparator, so that many servos fit in a small FPGA. The periods of
+    all outputs start together.
+
+    pwms
+
+        List of output PWM signals
+
+    clk25
+
+        25 MHz clock input
+
+    consigns
+
+        List of 16-bit unsigned consign values in clock ticks, one per PWM
+        output (see ServoDriver)
+
+    rst_n
+
+        Active low reset input (resets the period counter when active).
+
+    optocoupled, time_scale
+
+        Same as ServoDriver.
+
+    """
+
+    assert len(pwms) == len(consigns), 'one consign per PWM output'
+    for consign in consigns:
+        assert consign.min >= 0 and consign.max <= 2**16, 'wrong consign constraints'
 
     PWM_FREQ = 50
     CNT_MAX = int(CLK_FREQ/PWM_FREQ - 1)
 
+    # cnt counts time_scale clk25 periods per clk25 period, from CNT_FIRST
+    # to CNT_LAST, so that it reaches consign after consign / time_scale
+    # clk25 periods
+    assert 1 <= time_scale <= CNT_MAX, 'wrong time_scale'
+    CNT_FIRST = time_scale - 1
+    CNT_LAST = CNT_MAX - (CNT_MAX - CNT_FIRST) % time_scale
+
+    # cnt overflows at 50Hz
+    cnt = Signal(intbv(CNT_FIRST, min = 0, max = CNT_MAX + 1))
+
+    @instance
+    def CountPeriod():
+        """ Counts the PWM period of all outputs """
+        while True:
+            yield clk25.posedge, rst_n.negedge
+            if rst_n == LOW:
+                cnt.next = CNT_FIRST
+            else:
+                if cnt == CNT_LAST:
+                    cnt.next = CNT_FIRST
+                else:
+                    cnt.next = cnt + time_scale
+
+    # high for the first clk25 period of each PWM period
+    period_start = Signal(HIGH)
+    @always_comb
+    def DrivePeriodStart():
+        """ Drives period start signal """
+        period_start.next = cnt == CNT_FIRST
+
+    Channel_inst = [_ServoChannel(pwms[i], consigns[i], cnt, period_start, clk25, rst_n, optocoupled)
+                    for i in range(len(pwms))]
+
+    return instances()
+
+def _ServoChannel(pwm, consign, cnt, period_start, clk25, rst_n, optocoupled):
+    """ Drives one PWM output of a ServoBank with the shared period counter """
+
+    # account for optocouplers
+    LOW_OPTO  = LOW if not optocoupled else HIGH
+    HIGH_OPTO = HIGH if not optocoupled else LOW
+
     @instance
     def DriveServo():
         """ Generate PWM for servo """
 
-        # cnt overflows at 50Hz
-        cnt = intbv(0, min = 0, max = CNT_MAX + 1)
-
         # 16-bit duty cycle
         duty_cycle = intbv(0)[16:]
 
         while True:
             yield clk25.posedge, rst_n.negedge
             if rst_n == LOW:
-                cnt[:] = 0
                 duty_cycle[:] = 0
                 pwm.next = LOW_OPTO
             else:
                 # accept new consign at the beginning of a period
-                if cnt == 0:
+                if period_start == HIGH:
                     duty_cycle[:] = consign
 
                 # reached consign?
@@ -82,9 +160,4 @@ def ServoDriver(pwm, clk25, consign, rst_n, optocoupled):
                 else:
                     pwm.next = HIGH_OPTO
 
-                if cnt == CNT_MAX:
-                    cnt[:] = 0
-                else:
-                    cnt += 1
-
-    return instances()
+    return DriveServo
@@ -0,0 +1,133 @@
+from myhdl import concat, instance, instances, intbv
+from Robot.Utils.Constants import LOW, HIGH, CLK_FREQ
+
+def VelocityEstimator(ticks, period, count, clk25, rst_n, window_freq = 100):
+    """
+
+    Velocity estimator for odometers
+
+    Watches the count of an OdometerReader and measures its speed in two
+    ways:
+    - the number of ticks counted during a fixed window of clk25 periods,
+      accurate at high speeds,
+    - the number of clk25 periods between the last two ticks, accurate at
+      low speeds (when there are only a few ticks per window).
+
+    ticks
+
+        Output number of ticks counted during the last window. Positive
+        when moving forward, negative when moving backward.
+
+    period
+
+        Output number of clk25 periods between the last two ticks. Positive
+        when moving forward, negative when moving backward. When no tick
+        came for longer than the last period, the time since the last tick
+        is output instead. 0 when stopped: no tick for period.max - 1 clk25
+        periods.
+
+    count
+
+        Input count from OdometerReader. It must not change by more than
+        one tick per clk25 period.
+
+    clk25
+
+        25 MHz clock input.
+
+    rst_n
+
+        Active low reset input.
+
+    window_freq
+
+        Number of windows per second.
+
+    """
+
+    # width of ticks: count is followed modulo 2**T
+    T = len(ticks)
+    assert T <= len(count), 'ticks wider than count'
+
+    # difference of counts modulo 2**T when moving one tick backward
+    TICK_BACKWARD = 2**T - 1
+
+    # Counter for window_freq windows
+    WINDOW_CNT_MAX = int(CLK_FREQ/window_freq - 1)
+
+    # Longest period measured
+    PERIOD_MAX = period.max - 1
+
+    @instance
+    def Estimate():
+        """ Measures ticks per window and period between ticks """
+
+        # previous count, and count at the start of the window (lower bits)
+        previous_count = intbv(0, min = count.min, max = count.max)
+        window_count = intbv(0)[T:]
+
+        # difference of counts, modulo 2**T in its lower bits
+        diff = intbv(0)[T+1:]
+
+        # window period counter
+        window_cnt = intbv(0, min = 0, max = WINDOW_CNT_MAX + 1)
+
+        # number of clk25 periods since the last tick
+        edge_cnt = intbv(0, min = 0, max = PERIOD_MAX + 1)
+
+        # direction of the last tick
+        forward = True
+
+        # no tick for PERIOD_MAX clk25 periods
+        stopped = True
+
+        while True:
+            yield clk25.posedge, rst_n.negedge
+            if rst_n == LOW:
+                previous_count[:] = 0
+                window_count[:] = 0
+                window_cnt[:] = 0
+                edge_cnt[:] = 0
+                forward = True
+                stopped = True
+                ticks.next = 0
+                period.next = 0
+            else:
+                # Ticks per window
+                if window_cnt == WINDOW_CNT_MAX:
+                    window_cnt[:] = 0
+                    diff[:] = concat(HIGH, count[T:]) - window_count
+                    ticks.next = diff[T:].signed()
+                    window_count[:] = count[T:]
+                else:
+                    window_cnt += 1
+
+                # Period between ticks
+                if not stopped:
+                    if edge_cnt == PERIOD_MAX:
+                        stopped = True
+                        period.next = 0
+                    else:
+                        edge_cnt += 1
+
+                if count != previous_count:
+                    diff[:] = concat(HIGH, count[T:]) - previous_count[T:]
+                    if diff[T:] == 1 or diff[T:] == TICK_BACKWARD:
+                        # It moved: the period is known unless it was stopped
+                        forward = diff[T:] == 1
+                        if not stopped:
+                            if forward:
+                                period.next = edge_cnt
+                            else:
+                                period.next = -edge_cnt
+                        stopped = False
+                        edge_cnt[:] = 0
+                    previous_count[:] = count
+                elif not stopped and period != 0:
+                    # No tick for longer than the last period: slowing down
+                    if forward and edge_cnt > period:
+                        period.next = edge_cnt
+                    elif not forward and edge_cnt > -period:
+                        period.next = -edge_cnt
+
+    return instances()
@@ -0,0 +1,162 @@
+#
+# Cache of the registers written by the host
+#
+# A control loop sets the same consigns at each tick, most of them
+# unchanged: RegisterCache only writes the registers whose value changed
+# since they were last written, once per tick however many times they
+# were set, so that the SPI bus carries the changes only.
+#
+# Since RobotIO keeps the values written until they are written again
+# (the reset key does not clear them), this is safe as long as the host
+# is the only master. Still, each register is written again refresh
+# ticks after its last write, changed or not, in case RobotIO missed or
+# lost a value (a corrupted frame, a reconfigured FPGA). invalidate()
+# writes all registers again at the next tick.
+#
+# The writes of a tick only count as written once commit() is called,
+# after the batch was sent: if the transfer fails, the next tick writes
+# them again, whatever the values set then.
+#
+# When enough motor speeds are written in a tick, they are written all at
+# once with the bulk key (see RegisterMap), whenever that is shorter than
+# their own keys: 4 changed speeds or more on the robot.
+#
+# Like Robot.Utils.RegisterMap, this module does not depend on MyHDL.
+#
+
+# key of all motor speeds at once (see RegisterMap)
+MOTORS_KEY = 0x90
+
+class RegisterCache(object):
+    """
+
+    Cache of the registers written with a RobotIOClient
+
+    Set the registers with set() during a tick, then flush() appends the
+    writes of the tick to the batch of the client, before the reads of the
+    tick: the whole tick is sent as one batch. Call commit() once the batch
+    is sent.
+
+    client
+
+        RobotIOClient (see Robot.Host.Client) writing the registers with
+        their own keys.
+
+    refresh
+
+        Number of ticks after which a register is written again even if its
+        value did not change (None to never write unchanged values).
+
+    """
+
+    def __init__(self, client, refresh = 50):
+        assert refresh is None or refresh >= 1, 'wrong refresh'
+        self.client = client
+        self.refresh = refresh
+
+        # values set during the current tick, by name
+        self.staged = {}
+
+        # last value written and tick of the write, by name
+        self.written = {}
+
+        # value and tick of the writes of the last flush, until commit()
+        self.pending = {}
+
+        # motor speeds written with the bulk key, in the order of its
+        # fields, and the lengths of their writes with the bulk key and
+        # with their own keys
+        l = client.write_keys.get(MOTORS_KEY)
+        self.speeds = sorted(l.index, key = l.index.get) if l is not None else []
+        self.speeds_length = 2 + l.length if l is not None else 0
+        self.speed_lengths = dict((n, 2 + client.write_keys[client.write_names[n]].length) for n in self.speeds)
+
+        # number of flushes, and number of writes appended and dropped
+        self.tick = 0
+        self.writes = 0
+        self.dropped = 0
+
+    def set(self, name, value):
+        """ Sets signal name to value at the next flush, the last value set in a tick wins """
+        key = self.client.write_names[name]
+        offset, mask, sign = self.client.write_keys[key].fields[0]
+        if name in self.staged:
+            self.dropped += 1
+        self.staged[name] = value & mask
+
+    def invalidate(self):
+        """ Forgets the values written, so that the next flush writes all registers again """
+        for name, (value, tick) in self.pending.items() + self.written.items():
+            self.staged.setdefault(name, value)
+        self.pending.clear()
+        self.written.clear()
+
+    def commit(self):
+        """ Records the writes of the last flush as written, once its batch was sent """
+        self.written.update(self.pending)
+        self.pending.clear()
+
+    def _stale(self, name, tick):
+        """ Return True if the value of name must be written again at tick """
+        return self.refresh is not None and tick - self.written[name][1] >= self.refresh
+
+    def _speeds(self, names):
+        """ Return the values of all motor speeds if the writes of names are better coalesced with the
+        bulk key, None otherwise """
+        if sum(self.speed_lengths.get(n, 0) for n in names) <= self.speeds_length:
+            return None
+        values = []
+        for name in self.speeds:
+            if name in self.staged:
+                values.append(self.staged[name])
+            elif name in self.written:
+                values.append(self.written[name][0])
+            else:
+                # the value of RobotIO is unknown
+                return None
+        return values
+
+    def flush(self):
+        """ Appends the writes of the tick to the batch of the client, and starts the next tick
+
+        The writes of the previous flush are written again if it was not
+        committed.
+
+        """
+        tick = self.tick
+        for name, (value, written) in self.pending.items():
+            self.written.pop(name, None)
+            self.staged.setdefault(name, value)
+        self.pending.clear()
+        for name, (value, written) in self.written.items():
+            if name not in self.staged and self._stale(name, tick):
+                self.staged[name] = value
+
+        names = []
+        for name in self.staged:
+            value = self.staged[name]
+            if name in self.written and self.written[name][0] == value and not self._stale(name, tick):
+                self.dropped += 1
+            else:
+                names.append(name)
+
+        # the writes in the order of their keys, the bulk key replacing the
+        # own keys of the speeds (None for the bulk key)
+        write_names = self.client.write_names
+        speeds = self._speeds(names)
+        if speeds is None:
+            writes = [(write_names[n], n) for n in names]
+        else:
+            writes = [(write_names[n], n) for n in names if n not in self.speed_lengths] + [(MOTORS_KEY, None)]
+        for key, name in sorted(writes):
+            if name is None:
+                self.client.write_key(MOTORS_KEY, *speeds)
+                for name, value in zip(self.speeds, speeds):
+                    self.pending[name] = (value, tick)
+            else:
+                value = self.staged[name]
+                self.client.write_key(key, value)
+                self.pending[name] = (value, tick)
+            self.writes += 1
+        self.staged.clear()
+        self.tick = tick + 1
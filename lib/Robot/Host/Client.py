@@ -0,0 +1,199 @@
+#
+# Host side of the KLV protocol of RobotIO
+#
+# RobotIOClient builds a batch of KLV commands (see Robot.Utils.RegisterMap)
+# in a buffer allocated once, sends the whole batch in one full-duplex
+# transfer (one SPI frame), and decodes the values read right from the
+# buffer the answer was received in. The keys, lengths and field layouts of
+# the register map are looked up once, when the client is created: building
+# and decoding a batch allocates nothing but the integers of the values.
+#
+# The transfer is the transfer function of a transport (see
+# Robot.Host.Transport): transfer(tx, rx) sends the bytes of tx and stores
+# the bytes received meanwhile in rx, a writable buffer of the same length.
+# tx and rx are memoryviews of the buffers of the client.
+#
+# Like Robot.Utils.RegisterMap, this module does not depend on MyHDL.
+#
+import struct
+
+from collections import namedtuple
+from Robot.Utils.Config import DEFAULT
+from Robot.Utils.RegisterMap import READ, WRITE, fields as register_fields, key_fields, keys, length
+
+# values that struct packs and unpacks, by length
+_FORMATS = {1: struct.Struct('>B'), 2: struct.Struct('>H'), 4: struct.Struct('>I'), 8: struct.Struct('>Q')}
+
+# Layout of the value of a key:
+# - key: the key byte
+# - length: the length of the value, in bytes
+# - format: the struct of the value, or None if struct cannot unpack it
+# - fields: (offset, mask, sign bit) of each field, sorted by offset (the
+#   sign bit is 0 for unsigned fields)
+# - index: the index in fields of each field, by name
+Layout = namedtuple('Layout', 'key length format fields index')
+
+def layout(key, fields):
+    """ Return the layout of the value of key in the register map fields """
+    kf = key_fields(key, fields)
+    n = length(key, fields)
+    return Layout(key, n, _FORMATS.get(n),
+                  tuple((f.offset, 2**f.width - 1, 2**(f.width - 1) if f.signed else 0) for f in kf),
+                  dict((f.name, i) for i, f in enumerate(kf)))
+
+class RobotIOClient(object):
+    """
+
+    KLV client of RobotIO
+
+    Build a batch with write(), write_key(), read() and read_key(), send
+    it with send(), then decode the values read with value() and values().
+    clear() starts the next batch.
+
+    transfer
+
+        Full-duplex transfer function of the transport, such as the
+        transfer method of a Transport (see above).
+
+    config
+
+        Channel counts of RobotIO (see Robot.Utils.Config), the robot by
+        default.
+
+    size
+
+        Size of the buffers: the max length of a batch, in bytes.
+
+    """
+
+    def __init__(self, transfer, config = DEFAULT, size = 4096):
+        self.transfer = transfer
+        self.config = config
+        self.tx = bytearray(size)
+        self.rx = bytearray(size)
+        self.tx_view = memoryview(self.tx)
+        self.rx_view = memoryview(self.rx)
+
+        # value bytes sent with read commands (RobotIO ignores them)
+        self.zeros = memoryview(bytearray(256))
+
+        # layout of each key, and own key of each signal read or written
+        # alone (see RegisterMap.key)
+        f = register_fields(config)
+        self.read_keys = dict((k, layout(k, f)) for k in keys(READ, f))
+        self.write_keys = dict((k, layout(k, f)) for k in keys(WRITE, f))
+        self.read_names = dict((n, k) for k, l in self.read_keys.items() if len(l.fields) == 1 for n in l.index)
+        self.write_names = dict((n, k) for k, l in self.write_keys.items() if len(l.fields) == 1 for n in l.index)
+
+        # offset of the value and layout of each read command of the batch
+        # (a command takes 3 bytes at least)
+        self.read_offsets = [0] * (size // 3)
+        self.read_layouts = [None] * (size // 3)
+
+        self.clear()
+
+    def clear(self):
+        """ Starts a new batch """
+        self.length = 0
+        self.reads = 0
+
+    def _command(self, key, length):
+        """ Appends the key and length bytes of a command, and returns the offset of its value """
+        offset = self.length + 2
+        end = offset + length
+        if end > len(self.tx):
+            raise ValueError('batch too long: %d bytes' % end)
+        self.tx[offset - 2] = key
+        self.tx[offset - 1] = length
+        self.length = end
+        return offset
+
+    def write_key(self, key, *values):
+        """
+
+        Appends the write of key to the batch
+
+        values are the values of the fields of key, sorted by offset, such
+        as the speeds of motor1, motor2... with key 0x90. Signed values are
+        sent in two's complement.
+
+        """
+        l = self.write_keys[key]
+        if len(values) != len(l.fields):
+            raise ValueError('%d values expected for key 0x%02X' % (len(l.fields), key))
+        value = 0
+        for i in xrange(len(values)):
+            offset, mask, sign = l.fields[i]
+            value |= (values[i] & mask) << offset
+        offset = self._command(key, l.length)
+        if l.format is not None:
+            l.format.pack_into(self.tx, offset, value)
+        else:
+            for i in xrange(offset + l.length - 1, offset - 1, -1):
+                self.tx[i] = value & 0xFF
+                value >>= 8
+
+    def write(self, name, value):
+        """ Appends the write of signal name to the batch, with its own key """
+        self.write_key(self.write_names[name], value)
+
+    def read_key(self, key):
+        """ Appends the read of key to the batch, and returns its index for value() """
+        l = self.read_keys[key]
+        offset = self._command(key, l.length)
+        self.tx_view[offset:offset + l.length] = self.zeros[:l.length]
+        index = self.reads
+        self.read_offsets[index] = offset
+        self.read_layouts[index] = l
+        self.reads = index + 1
+        return index
+
+    def read(self, name):
+        """ Appends the read of signal name to the batch, with its own key, and returns its index for
+        value() """
+        return self.read_key(self.read_names[name])
+
+    def send(self):
+        """ Transfers the batch """
+        self.transfer(self.tx_view[:self.length], self.rx_view[:self.length])
+
+    def _raw(self, index):
+        """ Return the value received for read command index, as an unsigned integer """
+        l = self.read_layouts[index]
+        offset = self.read_offsets[index]
+        if l.format is not None:
+            return l.format.unpack_from(self.rx, offset)[0]
+        value = 0
+        for i in xrange(offset, offset + l.length):
+            value = (value << 8) | self.rx[i]
+        return value
+
+    @staticmethod
+    def _field(value, field):
+        """ Return field (offset, mask, sign bit) of value """
+        offset, mask, sign = field
+        value = (value >> offset) & mask
+        if value & sign:
+            value -= mask + 1
+        return value
+
+    def value(self, index, name = None):
+        """
+
+        Return the value read by command index of the sent batch
+
+        The value is the one of field name of the key, or of its only field
+        if name is None.
+
+        """
+        l = self.read_layouts[index]
+        if name is None:
+            if len(l.fields) != 1:
+                raise ValueError('key 0x%02X has several fields' % l.key)
+            return self._field(self._raw(index), l.fields[0])
+        return self._field(self._raw(index), l.fields[l.index[name]])
+
+    def values(self, index):
+        """ Return the values of all fields read by command index of the sent batch, sorted by offset """
+        raw = self._raw(index)
+        return [self._field(raw, f) for f in self.read_layouts[index].fields]
@@ -0,0 +1,147 @@
+#
+# Transports of the KLV frames of the host
+#
+# A transport sends the frames of the host to RobotIO, one full-duplex
+# transfer per frame: transfer(tx, rx) sends the bytes of tx and stores
+# the bytes received meanwhile in rx, a writable buffer of the same length
+# (see Robot.Host.Client). sleep(seconds) lets the robot run meanwhile.
+#
+# - SpidevTransport talks to RobotIO through the SPI device of the
+#   Gumstix (needs the spidev module),
+# - ModelTransport talks to a RobotIOModel instead, so that host code runs
+#   without a robot (the tests also have a transport to the MyHDL
+#   simulation of RobotIO).
+#
+# All transports account for their transfers the same way: number of
+# transfers and bytes, time on the SPI bus at the SPI clock frequency, and
+# host time spent in transfer() (total and worst transfer), see stats().
+#
+# Like Robot.Utils.RegisterMap, this module does not depend on MyHDL.
+#
+import time
+
+from Robot.Utils.Constants import CLK_FREQ
+
+class Transport(object):
+    """
+
+    Base of the transports: accounts for the transfers of _transfer()
+
+    spi_freq
+
+        Frequency of the SPI clock, in Hz.
+
+    clock
+
+        Function returning the host time in seconds (time.time by
+        default).
+
+    """
+
+    def __init__(self, spi_freq, clock = time.time):
+        self.spi_freq = spi_freq
+        self.clock = clock
+        self.reset_stats()
+
+    def reset_stats(self):
+        """ Clears the accounting of the transfers """
+        self.transfers = 0
+        self.bytes = 0
+        self.host_time = 0.0
+        self.max_host_time = 0.0
+
+    def stats(self):
+        """
+
+        Return the accounting of the transfers since the last reset_stats()
+
+        - transfers: number of transfers,
+        - bytes: number of bytes sent (as many were received),
+        - bus_time: time on the SPI bus, in seconds,
+        - host_time: host time spent in transfer(), in seconds,
+        - max_host_time: host time spent in the longest transfer, in
+          seconds.
+
+        """
+        return dict(transfers = self.transfers, bytes = self.bytes, bus_time = 8.0 * self.bytes / self.spi_freq,
+                    host_time = self.host_time, max_host_time = self.max_host_time)
+
+    def transfer(self, tx, rx):
+        """ Sends the bytes of tx and stores the bytes received in rx (see above) """
+        assert len(tx) == len(rx), 'tx and rx of different lengths'
+        start = self.clock()
+        self._transfer(tx, rx)
+        spent = self.clock() - start
+        self.transfers += 1
+        self.bytes += len(tx)
+        self.host_time += spent
+        self.max_host_time = max(self.max_host_time, spent)
+
+    def _transfer(self, tx, rx):
+        """ Transfers a frame, see transfer() """
+        raise NotImplementedError
+
+    def sleep(self, seconds):
+        """ Lets the robot run for seconds """
+        raise NotImplementedError
+
+class SpidevTransport(Transport):
+    """
+
+    Transport to RobotIO through a Linux SPI device (/dev/spidevB.D)
+
+    RobotIO is an SPI slave in mode 1 (see RobotIO). A frame is limited to
+    the buffer size of the spidev driver (4096 bytes by default).
+
+    bus, device
+
+        Numbers of the SPI device.
+
+    spi_freq
+
+        Frequency of the SPI clock, in Hz.
+
+    """
+
+    def __init__(self, bus = 0, device = 0, spi_freq = 1000000, clock = time.time):
+        import spidev
+        Transport.__init__(self, spi_freq, clock)
+        self.spi = spidev.SpiDev()
+        self.spi.open(bus, device)
+        self.spi.mode = 1
+        self.spi.bits_per_word = 8
+        self.spi.max_speed_hz = spi_freq
+
+    def _transfer(self, tx, rx):
+        rx[:] = bytearray(self.spi.xfer2(tx.tolist()))
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def close(self):
+        """ Closes the SPI device """
+        self.spi.close()
+
+class ModelTransport(Transport):
+    """
+
+    Transport to a RobotIOModel, in place of RobotIO
+
+    The model keeps its own time: it advances with the bytes transferred
+    (at the SPI frequency of the model) and with sleep().
+
+    model
+
+        RobotIOModel answering the frames.
+
+    """
+
+    def __init__(self, model, clock = time.time):
+        Transport.__init__(self, 8.0 * CLK_FREQ / model.byte_time, clock)
+        self.model = model
+
+    def _transfer(self, tx, rx):
+        rx[:] = self.model.transfer(tx)
+
+    def sleep(self, seconds):
+        self.model.advance(int(round(seconds * CLK_FREQ)))
@@ -1,42 +1,62 @@
+import ast
+import inspect
+import linecache
+import textwrap
+
 from myhdl import ConcatSignal, Signal, always, always_comb, concat, enum, instance, instances, intbv
 from Robot.Device.LED import LEDDriver
-from Robot.Device.Motor import MotorDriver
+from Robot.Device.MCP3008 import MCP3008Driver
+from Robot.Device.Motor import MotorBank
 from Robot.Device.Odometer import OdometerReader
-from Robot.Device.Servo import ServoDriver
-from Robot.Utils.Constants import LOW, HIGH
+from Robot.Device.Pose import PoseEstimator
+from Robot.Device.Servo import ServoBank
+from Robot.Device.Velocity import VelocityEstimator
+from Robot.ControlSystem.Speed import SpeedControl
+from Robot.Utils.Config import DEFAULT, loops, ports as port_names, servo_port
+from Robot.Utils.Constants import LOW, HIGH, CLK_FREQ
+from Robot.Utils.RegisterFile import Constant, ReadRegisters, WriteRegisters
+from Robot.Utils.RegisterMap import READ, WRITE, fields as register_fields, key, keys, length, names
 
-# max length of values read or written by the Gumstix
-# (the maximum for this value is 256)
-MAX_LENGTH = 8
 SPI_State = enum('IDLE', 'TRANSFER')
-KLV_State = enum('READ_KEY', 'GET_READ_LENGTH', 'GET_WRITE_LENGTH', 'MASTER_WRITE', 'MASTER_READ', 'MASTER_ADC')
-
-def RobotIO(
-    clk25,
-    sspi_clk, sspi_cs, sspi_miso, sspi_mosi,
-    rc1_cha, rc1_chb,
-    rc2_cha, rc2_chb,
-    rc3_cha, rc3_chb,
-    rc4_cha, rc4_chb,
-    mot1_brake, mot1_dir, mot1_pwm,
-    mot2_brake, mot2_dir, mot2_pwm,
-    mot3_brake, mot3_dir, mot3_pwm,
-    mot4_brake, mot4_dir, mot4_pwm,
-    mot5_brake, mot5_dir, mot5_pwm,
-    mot6_brake, mot6_dir, mot6_pwm,
-    mot7_brake, mot7_dir, mot7_pwm,
-    mot8_brake, mot8_dir, mot8_pwm,
-    adc1_clk, adc1_cs, adc1_miso, adc1_mosi,
-    pwm1_ch0, pwm1_ch1, pwm1_ch2, pwm1_ch3, pwm1_ch4, pwm1_ch5, pwm1_ch6, pwm1_ch7,
-    ext1_0, ext1_1, ext1_2, ext1_3, ext1_4, ext1_5, ext1_6, ext1_7,
-    ext2_0, ext2_1, ext2_2, ext2_3, ext2_4, ext2_5, ext2_6, ext2_7,
-    ext3_0, ext3_1, ext3_2, ext3_3, ext3_4, ext3_5, ext3_6, ext3_7,
-    ext4_0, ext4_1, ext4_2, ext4_3, ext4_4, ext4_5, ext4_6, ext4_7,
-    ext5_0, ext5_1, ext5_2, ext5_3, ext5_4, ext5_5, ext5_6, ext5_7,
-    ext6_0, ext6_1, ext6_2, ext6_3, ext6_4, ext6_5, ext6_6, ext6_7,
-    ext7_0, ext7_1, ext7_2, ext7_3, ext7_4, ext7_5, ext7_6, ext7_7,
-    led_yellow_n, led_green_n, led_red_n,
-    optocoupled
+KLV_State = enum('READ_KEY', 'GET_READ_LENGTH', 'GET_WRITE_LENGTH', 'MASTER_WRITE', 'MASTER_READ')
+
+def _LatchCount(snapshot, count, snapshot_consign, snapshot_consign_prev, clk25):
+    """ Latches count with the other odometers (see LatchOdometers) """
+
+    @always(clk25.posedge)
+    def LatchCount():
+        """ Latches count """
+        if snapshot_consign != snapshot_consign_prev:
+            snapshot.next = count
+
+    return LatchCount
+
+def _ResetLoop(loop_rst_n, rst_n, loop_enable):
+    """ Keeps a speed loop reset while disabled """
+
+    @always_comb
+    def ResetLoop():
+        """ Resets disabled speed loop """
+        loop_rst_n.next = rst_n and loop_enable
+
+    return ResetLoop
+
+def _SelectMotorSpeed(motor_drive, motor_speed, loop_speed, loop_enable):
+    """ Drives a motor with the output of its speed loop when enabled """
+
+    @always_comb
+    def SelectMotorSpeed():
+        """ Drives motor with its speed or its speed loop """
+        if loop_enable == HIGH:
+            motor_drive.next = loop_speed
+        else:
+            motor_drive.next = motor_speed
+
+    return SelectMotorSpeed
+
+def _RobotIO(config, ports,
+    optocoupled, adc_scan_freq = 1000, velocity_window_freq = 100, speed_loop_freq = 24414,
+    time_scale = 1
     ):
     """
 
@@ -49,28 +69,57 @@ def RobotIO(
     rcX_ch* -- Quadrature encoder X signals (channels A and B)
     motX_* -- pwm, dir and brake signals for DC motor X
     adc1_* -- SPI signals to ADC board 1 (FPGA is master, ADC chip is slave)
-    pwm1_* -- PWM signals to PWM board 1 (for servo motors)
-    ext1_* -- Extension port 1 signals
-    ext2_* -- Extension port 2 signals
-    ext3_* -- Extension port 3 signals
-    ext4_* -- Extension port 4 signals
-    ext5_* -- Extension port 5 signals
-    ext6_* -- Extension port 6 signals
-    ext7_* -- Extension port 7 signals
+    pwmX_* -- PWM signals to PWM board X (for servo motors)
+    extX_* -- Extension port X signals
     led_*_n -- Active-low LED signal
     optocoupled -- motors and servos drivers account for optocouplers if this is set to True
+    adc_scan_freq -- number of scans of the 8 channels of ADC board 1 per second
+    time_scale -- for simulation only: divides the PWM periods of motors and
+                  servos and the toggle period of the red LED (see ServoDriver)
+
+    The ports depend on the channel counts of config (see
+    Robot.Utils.Config). This function is the body of the RobotIO module
+    of each config: top_level() gives it the ports as arguments.
 
     """
 
+    clk25, led_yellow_n, led_green_n, led_red_n = [ports[n] for n in
+        ('clk25', 'led_yellow_n', 'led_green_n', 'led_red_n')]
+    sspi_clk, sspi_cs, sspi_miso, sspi_mosi = [ports[n] for n in
+        ('sspi_clk', 'sspi_cs', 'sspi_miso', 'sspi_mosi')]
+    adc1_clk, adc1_cs, adc1_miso, adc1_mosi = [ports[n] for n in
+        ('adc1_clk', 'adc1_cs', 'adc1_miso', 'adc1_mosi')]
+
+    # register map of config
+    fields = register_fields(config)
+
+    # max length of values read or written by the Gumstix
+    # (the maximum for this value is 256)
+    # 20 bytes are needed to read all odometers of the robot at once with a
+    # timestamp (key 0x18)
+    MAX_LENGTH = max(length(k, fields) for k in keys(READ, fields) + keys(WRITE, fields))
+    assert MAX_LENGTH <= 256, 'values too long'
+
+    # key of the chip-wide reset
+    RESET_KEY = key('reset', WRITE, fields)
+
+    # key clearing the pose
+    POSE_CLEAR_KEY = key('pose_clear', WRITE, fields)
+
+    # last key and value written by the master (see RX() and the register
+    # file below), write_strobe is high for 1 clk25 period after each write
+    write_key = Signal(intbv(0)[8:])
+    write_value = Signal(intbv(0)[MAX_LENGTH*8:])
+    write_strobe = Signal(LOW)
+
     # chip-wide active low reset signal
-    # brought low for 1 clk25 period when rst_n_consign changes
-    rst_n, rst_n_consign, rst_n_consign_prev = Signal(HIGH), Signal(HIGH), Signal(HIGH)
+    # brought low for 1 clk25 period when the master writes the reset key
+    rst_n = Signal(HIGH)
     @always(clk25.posedge)
     def DriveReset():
         """ Drives reset signal """
-        if rst_n_consign != rst_n_consign_prev:
+        if write_strobe == HIGH and write_key == RESET_KEY:
             rst_n.next = LOW
-            rst_n_consign_prev.next = rst_n_consign
         else:
             rst_n.next = HIGH
 
@@ -84,62 +133,184 @@ def RobotIO(
         led_yellow_n.next = not led_yellow_consign
 
     # Toggle red led every second
-    Led1_inst = LEDDriver(led_red_n, clk25, rst_n)
-
-    # !Odometers (rc1-4)
-    rc1_count = Signal(intbv(0, min = -2**31, max = 2**31))
-    rc2_count = Signal(intbv(0, min = -2**31, max = 2**31))
-    rc3_count = Signal(intbv(0, min = -2**31, max = 2**31))
-    rc4_count = Signal(intbv(0, min = -2**31, max = 2**31))
-    Odometer1_inst = OdometerReader(rc1_count, rc1_cha, rc1_chb, clk25, rst_n)
-    Odometer2_inst = OdometerReader(rc2_count, rc2_cha, rc2_chb, clk25, rst_n)
-    Odometer3_inst = OdometerReader(rc3_count, rc3_cha, rc3_chb, clk25, rst_n)
-    Odometer4_inst = OdometerReader(rc4_count, rc4_cha, rc4_chb, clk25, rst_n)
-
-    # !Motors (mot1-8)
-    motor1_speed = Signal(intbv(0, min = -2**10, max = 2**10))
-    motor2_speed = Signal(intbv(0, min = -2**10, max = 2**10))
-    motor3_speed = Signal(intbv(0, min = -2**10, max = 2**10))
-    motor4_speed = Signal(intbv(0, min = -2**10, max = 2**10))
-    motor5_speed = Signal(intbv(0, min = -2**10, max = 2**10))
-    motor6_speed = Signal(intbv(0, min = -2**10, max = 2**10))
-    motor7_speed = Signal(intbv(0, min = -2**10, max = 2**10))
-    motor8_speed = Signal(intbv(0, min = -2**10, max = 2**10))
-    Motor1_inst = MotorDriver(mot1_pwm, mot1_dir, mot1_brake, clk25, motor1_speed, rst_n, optocoupled)
-    Motor2_inst = MotorDriver(mot2_pwm, mot2_dir, mot2_brake, clk25, motor2_speed, rst_n, optocoupled)
-    Motor3_inst = MotorDriver(mot3_pwm, mot3_dir, mot3_brake, clk25, motor3_speed, rst_n, optocoupled)
-    Motor4_inst = MotorDriver(mot4_pwm, mot4_dir, mot4_brake, clk25, motor4_speed, rst_n, optocoupled)
-    Motor5_inst = MotorDriver(mot5_pwm, mot5_dir, mot5_brake, clk25, motor5_speed, rst_n, optocoupled)
-    Motor6_inst = MotorDriver(mot6_pwm, mot6_dir, mot6_brake, clk25, motor6_speed, rst_n, optocoupled)
-    Motor7_inst = MotorDriver(mot7_pwm, mot7_dir, mot7_brake, clk25, motor7_speed, rst_n, optocoupled)
-    Motor8_inst = MotorDriver(mot8_pwm, mot8_dir, mot8_brake, clk25, motor8_speed, rst_n, optocoupled)
-
-    # !Servo motors
-    servo1_consign = Signal(intbv(0)[16:])
-    servo2_consign = Signal(intbv(0)[16:])
-    servo3_consign = Signal(intbv(0)[16:])
-    servo4_consign = Signal(intbv(0)[16:])
-    servo5_consign = Signal(intbv(0)[16:])
-    servo6_consign = Signal(intbv(0)[16:])
-    servo7_consign = Signal(intbv(0)[16:])
-    servo8_consign = Signal(intbv(0)[16:])
-    Servo1_ch0_inst = ServoDriver(pwm1_ch0, clk25, servo1_consign, rst_n, optocoupled)
-    Servo1_ch1_inst = ServoDriver(pwm1_ch1, clk25, servo2_consign, rst_n, optocoupled)
-    Servo1_ch2_inst = ServoDriver(pwm1_ch2, clk25, servo3_consign, rst_n, optocoupled)
-    Servo1_ch3_inst = ServoDriver(pwm1_ch3, clk25, servo4_consign, rst_n, optocoupled)
-    Servo1_ch4_inst = ServoDriver(pwm1_ch4, clk25, servo5_consign, rst_n, optocoupled)
-    Servo1_ch5_inst = ServoDriver(pwm1_ch5, clk25, servo6_consign, rst_n, optocoupled)
-    Servo1_ch6_inst = ServoDriver(pwm1_ch6, clk25, servo7_consign, rst_n, optocoupled)
-    Servo1_ch7_inst = ServoDriver(pwm1_ch7, clk25, servo8_consign, rst_n, optocoupled)
+    Led1_inst = LEDDriver(led_red_n, clk25, rst_n, time_scale)
+
+    # !Odometers (rc1, rc2...)
+    RC = range(config.odometers)
+    W = config.odometer_width
+    rc_count = [Signal(intbv(0, min = -2**(W-1), max = 2**(W-1))) for i in RC]
+    Odometer_inst = [OdometerReader(rc_count[i], ports['rc%d_cha' % (i+1)], ports['rc%d_chb' % (i+1)], clk25, rst_n)
+                     for i in RC]
+
+    # Odometer speeds: ticks per window and clk25 periods between ticks
+    rc_ticks = [Signal(intbv(0, min = -2**15, max = 2**15)) for i in RC]
+    rc_period = [Signal(intbv(0, min = -2**23, max = 2**23)) for i in RC]
+    Velocity_inst = [VelocityEstimator(rc_ticks[i], rc_period[i], rc_count[i], clk25, rst_n, velocity_window_freq)
+                     for i in RC]
+
+    # Free-running timebase, in clk25 periods (wraps around every 172s)
+    timebase = Signal(intbv(0)[32:])
+    @instance
+    def CountTime():
+        """ Counts clk25 periods, with wrap around """
+        # one more bit for the carry
+        count = intbv(0)[len(timebase)+1:]
+        while True:
+            yield clk25.posedge
+            count[:] = count[len(timebase):] + 1
+            timebase.next = count[len(timebase):]
+
+    # !Pose: dead-reckoning with two odometers, left and right are selected
+    # by the master (0 for rc1, 1 for rc2..., the last odometer above)
+    pose_x = Signal(intbv(0, min = -2**31, max = 2**31))
+    pose_y = Signal(intbv(0, min = -2**31, max = 2**31))
+    pose_theta = Signal(intbv(0)[32:])
+    SELECT = max(1, (config.odometers - 1).bit_length())
+    pose_left = Signal(intbv(0)[SELECT:])
+    pose_right = Signal(intbv(min(1, config.odometers - 1))[SELECT:])
+    pose_left_count = Signal(intbv(0, min = -2**(W-1), max = 2**(W-1)))
+    pose_right_count = Signal(intbv(0, min = -2**(W-1), max = 2**(W-1)))
+    pose_angle_scale = Signal(intbv(0)[24:])
+    pose_clear = Signal(LOW)
+    LAST_ODOMETER = config.odometers - 1
+    @always_comb
+    def SelectPoseOdometers():
+        """ Selects the left and right odometers of the pose """
+        if pose_left < LAST_ODOMETER:
+            pose_left_count.next = rc_count[int(pose_left)]
+        else:
+            pose_left_count.next = rc_count[LAST_ODOMETER]
+        if pose_right < LAST_ODOMETER:
+            pose_right_count.next = rc_count[int(pose_right)]
+        else:
+            pose_right_count.next = rc_count[LAST_ODOMETER]
+
+    # pose_clear is high for 1 clk25 period when the master writes the
+    # pose clear key
+    @always_comb
+    def DrivePoseClear():
+        """ Drives pose clear signal """
+        if write_strobe == HIGH and write_key == POSE_CLEAR_KEY:
+            pose_clear.next = HIGH
+        else:
+            pose_clear.next = LOW
+
+    Pose_inst = PoseEstimator(pose_x, pose_y, pose_theta, pose_left_count, pose_right_count,
+                              pose_angle_scale, pose_clear, clk25, rst_n)
+
+    # Snapshot of all odometer counts, of the pose and of the timebase, read
+    # by the master with keys 0x10, 0x18 to 0x1F and 0x60
+    # snapshot_consign is toggled by RX() when a read key is received, so
+    # that all counts, the pose and the timestamp are latched on the same
+    # clk25 rising edge, before the length byte is over
+    snapshot_consign, snapshot_consign_prev = Signal(LOW), Signal(LOW)
+    timestamp = Signal(intbv(0)[32:])
+    rc_snapshot = [Signal(intbv(0, min = -2**(W-1), max = 2**(W-1))) for i in RC]
+    pose_x_snapshot = Signal(intbv(0, min = -2**31, max = 2**31))
+    pose_y_snapshot = Signal(intbv(0, min = -2**31, max = 2**31))
+    pose_theta_snapshot = Signal(intbv(0)[32:])
+    @always(clk25.posedge)
+    def LatchOdometers():
+        """ Latches the pose and the timebase with all odometer counts """
+        if snapshot_consign != snapshot_consign_prev:
+            timestamp.next = timebase
+            pose_x_snapshot.next = pose_x
+            pose_y_snapshot.next = pose_y
+            pose_theta_snapshot.next = pose_theta
+            snapshot_consign_prev.next = snapshot_consign
+
+    LatchCount_inst = [_LatchCount(rc_snapshot[i], rc_count[i], snapshot_consign, snapshot_consign_prev, clk25)
+                       for i in RC]
+
+    # !Motors (mot1, mot2...)
+    MOT = range(config.motors)
+    motor_speed = [Signal(intbv(0, min = -2**10, max = 2**10)) for i in MOT]
+
+    # speeds applied to motors with a speed loop: motorX_speed, or the
+    # output of their speed loop when enabled
+    LOOP = range(loops(config))
+    motor_drive = [Signal(intbv(0, min = -2**10, max = 2**10)) for i in LOOP] + motor_speed[len(LOOP):]
+
+    # PWM resolution and prescaler of each motor, set by the master (see
+    # MotorBank): about 25 KHz with 10-bit resolution by default
+    motor_resolution = [Signal(intbv(10)[4:]) for i in MOT]
+    motor_prescaler = [Signal(intbv(0)[3:]) for i in MOT]
+
+    # the periods of the motors start at times spread evenly over the
+    # default PWM period to spread the current drawn by the H-bridges
+    if MOT:
+        Motor_inst = MotorBank([ports['mot%d_pwm' % (i+1)] for i in MOT], [ports['mot%d_dir' % (i+1)] for i in MOT],
+                               [ports['mot%d_brake' % (i+1)] for i in MOT], clk25, motor_drive, rst_n,
+                               optocoupled, time_scale, resolutions = motor_resolution, prescalers = motor_prescaler)
+
+    # !Speed loops: the first motors with the odometers of the same number
+    #
+    # Each loop is enabled by the master with loopX_enable. Its consign is in
+    # ticks per loop period with 8 fractional bits. Gains and limits are
+    # shared by all loops (see SpeedControl).
+    loop_consign = [Signal(intbv(0, min = -2**15, max = 2**15)) for i in LOOP]
+    loop_enable = [Signal(LOW) for i in LOOP]
+    loop_gain_p = Signal(intbv(0)[16:])
+    loop_gain_i = Signal(intbv(0)[16:])
+    loop_gain_d = Signal(intbv(0)[16:])
+    loop_out_shift = Signal(intbv(0)[6:])
+    loop_max_i = Signal(intbv(0)[24:])
+    loop_accel = Signal(intbv(0)[16:])
+    loop_decel = Signal(intbv(0)[16:])
+
+    # loop_strobe is high for 1 clk25 period at speed_loop_freq
+    LOOP_CNT_MAX = int(CLK_FREQ/speed_loop_freq - 1)
+    loop_strobe = Signal(LOW)
+    @instance
+    def DriveLoopStrobe():
+        """ Drives speed loops strobe """
+        cnt = intbv(0, min = 0, max = LOOP_CNT_MAX + 1)
+        while True:
+            yield clk25.posedge, rst_n.negedge
+            if rst_n == LOW:
+                cnt[:] = 0
+                loop_strobe.next = LOW
+            else:
+                if cnt == LOOP_CNT_MAX:
+                    cnt[:] = 0
+                    loop_strobe.next = HIGH
+                else:
+                    cnt += 1
+                    loop_strobe.next = LOW
+
+    # loops are kept reset while disabled
+    loop_rst_n = [Signal(HIGH) for i in LOOP]
+    ResetLoop_inst = [_ResetLoop(loop_rst_n[i], rst_n, loop_enable[i]) for i in LOOP]
+
+    loop_speed = [Signal(intbv(0, min = -2**10, max = 2**10)) for i in LOOP]
+    Loop_inst = [SpeedControl(loop_speed[i], rc_count[i], loop_consign[i],
+                              loop_gain_p, loop_gain_i, loop_gain_d, loop_out_shift, loop_max_i, loop_accel, loop_decel,
+                              loop_strobe, clk25, loop_rst_n[i])
+                 for i in LOOP]
+
+    SelectMotorSpeed_inst = [_SelectMotorSpeed(motor_drive[i], motor_speed[i], loop_speed[i], loop_enable[i])
+                             for i in LOOP]
+
+    # !Servo motors, 8 per PWM board, with one period counter for all
+    SERVO = range(config.servos)
+    servo_consign = [Signal(intbv(0)[16:]) for i in SERVO]
+    if SERVO:
+        Servo_inst = ServoBank([ports[servo_port(i+1)] for i in SERVO], clk25, servo_consign, rst_n,
+                               optocoupled, time_scale)
+
+    # !ADC (adc1): the 8 channels of the MCP3008 are converted in the
+    # background and their latest values are kept here
+    adc1_value = [Signal(intbv(0)[10:]) for i in range(8)]
+    ADC1_inst = MCP3008Driver(*(adc1_value + [adc1_clk, adc1_cs, adc1_miso, adc1_mosi, clk25, rst_n]),
+                              scan_freq = adc_scan_freq)
 
     # !EXT ports
-    ext1_port = ConcatSignal(ext1_7, ext1_6, ext1_5, ext1_4, ext1_3, ext1_2, ext1_1, ext1_0)
-    ext2_port = ConcatSignal(ext2_7, ext2_6, ext2_5, ext2_4, ext2_3, ext2_2, ext2_1, ext2_0)
-    ext3_port = ConcatSignal(ext3_7, ext3_6, ext3_5, ext3_4, ext3_3, ext3_2, ext3_1, ext3_0)
-    ext4_port = ConcatSignal(ext4_7, ext4_6, ext4_5, ext4_4, ext4_3, ext4_2, ext4_1, ext4_0)
-    ext5_port = ConcatSignal(ext5_7, ext5_6, ext5_5, ext5_4, ext5_3, ext5_2, ext5_1, ext5_0)
-    ext6_port = ConcatSignal(ext6_7, ext6_6, ext6_5, ext6_4, ext6_3, ext6_2, ext6_1, ext6_0)
-    ext7_port = ConcatSignal(ext7_7, ext7_6, ext7_5, ext7_4, ext7_3, ext7_2, ext7_1, ext7_0)
+    ext_port = [ConcatSignal(*[ports['ext%d_%d' % (i+1, j)] for j in reversed(range(8))])
+                for i in range(config.ext_ports)]
+
+    # Fixed value for testing
+    fixed_value = Signal(intbv(0xDEADC0DE)[32:])
+    FixedValue_inst = Constant(fixed_value, 0xDEADC0DE, clk25)
 
     # Registers for SPI read/write tests
     stored_uint8  = Signal(intbv(0)[8:])
@@ -149,76 +320,65 @@ def RobotIO(
     stored_int16  = Signal(intbv(0, min = -2**15, max = 2**15))
     stored_int32  = Signal(intbv(0, min = -2**31, max = 2**31))
 
-
-
-    # Communication with Microchip MCP3008 8-Channel 10-Bit A/D Converter
-    #
-    # The slave needs either SPI Mode 0 or 3.
+    # Register file
     #
-    # The SPI clock generated by our SPI Master (the Gumstix) is forwarded
-    # to the MCP3008. It is inverted to use SPI Mode 3.
-    #
-    # The 17-bit data we send:
-    # - start bit (a 1)
-    # - single-ended bit (a 1)
-    # - 3 bits for the channel (most significant bit first)
-    # - 12 padding bits (we send zeros)
-    #
-    # The 17-bit data we get back
-    # - 6 padding bits
-    # - a null byte
-    # - the 10-bit value
-    #
-    # Communication with MCP3008 during a KLV exchange
-    #
-    # The 17-bit exchange starts when the 7th bit of the key is received.
-    # If the 7 first bits of the key correspond to one of the channel keys,
-    # the start bit is sent. Thus, the remaining 16 bits are aligned with
-    # the length byte and the first value byte. Bits 2 to 9 are received
-    # during the length byte, and sent as the first value byte. Bits 10 to 17
-    # are received during the first value byte, and sent as the second value
-    # byte.
-
-    # bit counter (0 to 16, 17 when done)
-    adc1_ws = 17
-    adc1_cnt = Signal(intbv(adc1_ws, min=0, max=adc1_ws+1))
-
-    # 3-bit channel number
-    adc1_channel = Signal(intbv(0)[3:])
-
-    @always_comb
-    def ADCClock():
-        """
-
-        Drives adc1_clk.
-
-        """
-        adc1_clk.next = not sspi_clk
-
-    @instance
-    def ADCTX():
-        """
-
-        MCP3008 SPI transmission: drives adc1_mosi.
+    # The signals read and written by the master are described as data in
+    # the register map (see Robot.Utils.RegisterMap) and the decoding logic
+    # is generated from it:
+    # - each read key drives one entry of read_bank, and RX() uses a ROM to
+    #   find the entry of the received key,
+    # - each written signal compares write_key with its own keys when
+    #   write_strobe is high, so that all signals written with one value
+    #   (such as all motor speeds with key 0x90) change on the same clk25
+    #   rising edge.
+    registers = dict(
+        timestamp = timestamp,
+        pose_x_snapshot = pose_x_snapshot, pose_y_snapshot = pose_y_snapshot,
+        pose_theta_snapshot = pose_theta_snapshot,
+        pose_left = pose_left, pose_right = pose_right, pose_angle_scale = pose_angle_scale,
+        fixed_value = fixed_value,
+        stored_uint8 = stored_uint8, stored_uint16 = stored_uint16, stored_uint32 = stored_uint32,
+        stored_int8 = stored_int8, stored_int16 = stored_int16, stored_int32 = stored_int32,
+        led_green_consign = led_green_consign, led_yellow_consign = led_yellow_consign,
+        loop_gain_p = loop_gain_p, loop_gain_i = loop_gain_i, loop_gain_d = loop_gain_d,
+        loop_out_shift = loop_out_shift, loop_max_i = loop_max_i,
+        loop_accel = loop_accel, loop_decel = loop_decel,
+    )
+    for i in RC:
+        registers['rc%d_count' % (i+1)] = rc_count[i]
+        registers['rc%d_snapshot' % (i+1)] = rc_snapshot[i]
+        registers['rc%d_ticks' % (i+1)] = rc_ticks[i]
+        registers['rc%d_period' % (i+1)] = rc_period[i]
+    for i in MOT:
+        registers['motor%d_speed' % (i+1)] = motor_speed[i]
+        registers['motor%d_resolution' % (i+1)] = motor_resolution[i]
+        registers['motor%d_prescaler' % (i+1)] = motor_prescaler[i]
+    for i in LOOP:
+        registers['loop%d_consign' % (i+1)] = loop_consign[i]
+        registers['loop%d_enable' % (i+1)] = loop_enable[i]
+    for i in SERVO:
+        registers['servo%d_consign' % (i+1)] = servo_consign[i]
+    for i in range(8):
+        registers['adc1_ch%d_value' % i] = adc1_value[i]
+    for i in range(config.ext_ports):
+        registers['ext%d_port' % (i+1)] = ext_port[i]
+
+    # one entry per read key, and one for unknown keys
+    read_bank = [Signal(intbv(0)[MAX_LENGTH*8:]) for i in range(len(keys(READ, fields)) + 1)]
+    ReadRegisters_inst, READ_INDEX = ReadRegisters(read_bank, registers, fields, clk25)
+
+    # write_consign is toggled by RX() when the master has written a value
+    write_consign, write_consign_prev = Signal(LOW), Signal(LOW)
+    @always(clk25.posedge)
+    def DriveWriteStrobe():
+        """ Drives write strobe """
+        if write_consign != write_consign_prev:
+            write_strobe.next = HIGH
+            write_consign_prev.next = write_consign
+        else:
+            write_strobe.next = LOW
 
-        """
-        while True:
-            # Propagate on adc1_clk falling edge (mode 3)
-            # == sspi_clk rising edge
-            yield sspi_clk.posedge
-            if adc1_cnt < adc1_ws:
-                # Start bit
-                if adc1_cnt == 0:
-                    adc1_mosi.next = HIGH
-                # Single ended / differential bit
-                elif adc1_cnt == 1:
-                    adc1_mosi.next = HIGH
-                # 3-bit channel
-                elif adc1_cnt >= 2 and adc1_cnt <= 4:
-                    adc1_mosi.next = adc1_channel[4-adc1_cnt]
-                # 12-bit padding
-                else:
-                    adc1_mosi.next = LOW
+    WriteRegisters_inst = WriteRegisters(registers, fields, write_key, write_value, write_strobe, clk25)
 
 
     # Communication with SPI Master.
@@ -295,9 +455,6 @@ def RobotIO(
 
         """
 
-        # shift register with bits received from MCP3008
-        adc1_rxsreg = intbv(0)[ws:]
-
         # shift register with bits received from master
         rxsreg = intbv(0)[ws:]
 
@@ -316,6 +473,9 @@ def RobotIO(
         # index of the currently read or written value byte
         index = MAX_LENGTH*ws
 
+        # index in read_bank of the key read by the master
+        read_index = intbv(0, min = 0, max = len(read_bank))
+
         # state in the KLV protocol
         state = KLV_State.READ_KEY
 
@@ -323,30 +483,10 @@ def RobotIO(
             # Capture on falling edge (mode 1)
             yield sspi_clk.negedge
 
-            # ADC special: handle ADC RX
-            if adc1_cnt < adc1_ws:
-                if adc1_cnt >= 7:
-                    # shift in new bit
-                    adc1_rxsreg[ws:] = concat(adc1_rxsreg[ws-1:], adc1_miso)
-                else:
-                    # ignore all but bits 7-16
-                    adc1_rxsreg[ws:] = concat(adc1_rxsreg[ws-1:], LOW)
-                if adc1_cnt + 1 == adc1_ws:
-                    adc1_cs.next = HIGH
-                adc1_cnt.next = adc1_cnt + 1
-
             if sspi_cs == LOW:
                 # shift in new bit
                 rxsreg[ws:] = concat(rxsreg[ws-1:], sspi_mosi)
 
-                # ADC special: detect ADC keys early to send start bit
-                if spi_cnt == ws-2:
-                    if state == KLV_State.READ_KEY:
-                        key[:] = concat(rxsreg[ws-1:], LOW)
-                        if key >= 0x50 and key <= 0x57:
-                            adc1_cs.next = LOW
-                            adc1_cnt.next = 0
-
                 # Read a whole word
                 if spi_cnt == ws-1:
                     txdata.next = 0
@@ -356,14 +496,10 @@ def RobotIO(
                         # read key sent by master
                         key[:] = rxsreg
 
-                        # ADC Special: set channel, go to special state
-                        if key >= 0x50 and key <= 0x57:
-                            adc1_channel.next = key - 0x50
-                            length[:] = 3 # length + 2 value bytes
-                            index = ws*(length-1)
-                            state = KLV_State.MASTER_ADC
                         # Master reads
-                        elif key[ws-1] == 0:
+                        if key[ws-1] == 0:
+                            # latch the odometer snapshot now (see keys 0x10, 0x18 to 0x1F and 0x60)
+                            snapshot_consign.next = not snapshot_consign
                             state = KLV_State.GET_READ_LENGTH
                         # Master writes
                         else:
@@ -391,55 +527,9 @@ def RobotIO(
                             index = ws*(length-1)
                             state = KLV_State.MASTER_READ
 
-                            # Odometers: use bit slicing to convert signed to unsigned
-                            if key == 0x11:
-                                value_for_master[len(rc1_count):] = rc1_count[len(rc1_count):]
-                            elif key == 0x12:
-                                value_for_master[len(rc2_count):] = rc2_count[len(rc2_count):]
-                            elif key == 0x13:
-                                value_for_master[len(rc3_count):] = rc3_count[len(rc3_count):]
-                            elif key == 0x14:
-                                value_for_master[len(rc4_count):] = rc4_count[len(rc4_count):]
-
-                            # EXT ports
-                            elif key == 0x31:
-                                value_for_master[len(ext1_port):] = ext1_port
-                            elif key == 0x32:
-                                value_for_master[len(ext2_port):] = ext2_port
-                            elif key == 0x33:
-                                value_for_master[len(ext3_port):] = ext3_port
-                            elif key == 0x34:
-                                value_for_master[len(ext4_port):] = ext4_port
-                            elif key == 0x35:
-                                value_for_master[len(ext5_port):] = ext5_port
-                            elif key == 0x36:
-                                value_for_master[len(ext6_port):] = ext6_port
-                            elif key == 0x37:
-                                value_for_master[len(ext7_port):] = ext7_port
-
-                            # Fixed value for testing
-                            elif key == 0x42:
-                                value_for_master[32:] = 0xDEADC0DE
-
-                            # Read stored values for testing
-                            elif key == 0x71:
-                                value_for_master[len(stored_uint8):] = stored_uint8
-                            elif key == 0x72:
-                                value_for_master[len(stored_uint16):] = stored_uint16
-                            elif key == 0x73:
-                                value_for_master[len(stored_uint32):] = stored_uint32
-                            # use bit slicing to convert signed to unsigned
-                            elif key == 0x74:
-                                value_for_master[len(stored_int8):] = stored_int8[len(stored_int8):]
-                            elif key == 0x75:
-                                value_for_master[len(stored_int16):] = stored_int16[len(stored_int16):]
-                            elif key == 0x76:
-                                value_for_master[len(stored_int32):] = stored_int32[len(stored_int32):]
-                            else:
-                                # Dummy value sent when key is unknown.
-                                # The value is fixed. The master read 'length'
-                                # bytes from it.
-                                value_for_master[:] = 0xDEADBEEFBAADF00D
+                            # look the key up in the register map
+                            read_index[:] = READ_INDEX[int(key)]
+                            value_for_master[:] = read_bank[read_index]
 
                             # send first byte immediately
                             txdata.next = value_for_master[(index + ws):index]
@@ -459,71 +549,10 @@ def RobotIO(
                             # Got everything
                             state = KLV_State.READ_KEY
 
-                            # Reset
-                            if key == 0x81:
-                                rst_n_consign.next = not rst_n_consign
-
-                            # Green LED
-                            elif key == 0x82:
-                                led_green_consign.next = value_from_master[0]
-
-                            # Yellow LED
-                            elif key == 0x83:
-                                led_yellow_consign.next = value_from_master[0]
-
-                            # Motors
-                            elif key == 0x91:
-                                motor1_speed.next = value_from_master[len(motor1_speed):].signed()
-                            elif key == 0x92:
-                                motor2_speed.next = value_from_master[len(motor2_speed):].signed()
-                            elif key == 0x93:
-                                motor3_speed.next = value_from_master[len(motor3_speed):].signed()
-                            elif key == 0x94:
-                                motor4_speed.next = value_from_master[len(motor4_speed):].signed()
-                            elif key == 0x95:
-                                motor5_speed.next = value_from_master[len(motor5_speed):].signed()
-                            elif key == 0x96:
-                                motor6_speed.next = value_from_master[len(motor6_speed):].signed()
-                            elif key == 0x97:
-                                motor7_speed.next = value_from_master[len(motor7_speed):].signed()
-                            elif key == 0x98:
-                                motor8_speed.next = value_from_master[len(motor8_speed):].signed()
-
-                            # Servos
-                            elif key == 0xA1:
-                                servo1_consign.next = value_from_master[len(servo1_consign):]
-                            elif key == 0xA2:
-                                servo2_consign.next = value_from_master[len(servo2_consign):]
-                            elif key == 0xA3:
-                                servo3_consign.next = value_from_master[len(servo3_consign):]
-                            elif key == 0xA4:
-                                servo4_consign.next = value_from_master[len(servo4_consign):]
-                            elif key == 0xA5:
-                                servo5_consign.next = value_from_master[len(servo5_consign):]
-                            elif key == 0xA6:
-                                servo6_consign.next = value_from_master[len(servo6_consign):]
-                            elif key == 0xA7:
-                                servo7_consign.next = value_from_master[len(servo7_consign):]
-                            elif key == 0xA8:
-                                servo8_consign.next = value_from_master[len(servo8_consign):]
-
-                            # Store values for testing
-                            elif key == 0xF1:
-                                stored_uint8.next = value_from_master[len(stored_uint8):]
-                            elif key == 0xF2:
-                                stored_uint16.next = value_from_master[len(stored_uint16):]
-                            elif key == 0xF3:
-                                stored_uint32.next = value_from_master[len(stored_uint32):]
-                            elif key == 0xF4:
-                                stored_int8.next = value_from_master[len(stored_int8):].signed()
-                            elif key == 0xF5:
-                                stored_int16.next = value_from_master[len(stored_int16):].signed()
-                            elif key == 0xF6:
-                                stored_int32.next = value_from_master[len(stored_int32):].signed()
-
-                            # Convert to case block
-                            else:
-                                pass
+                            # hand the value over to the register file
+                            write_key.next = key
+                            write_value.next = value_from_master
+                            write_consign.next = not write_consign
 
                     # decrement index when each value byte expected by the master has been sent
                     elif state == KLV_State.MASTER_READ:
@@ -535,19 +564,85 @@ def RobotIO(
                             # Sent everything
                             state = KLV_State.READ_KEY
 
-                    # send adc bytes
-                    elif state == KLV_State.MASTER_ADC:
-                        if index >= ws:
-                            # Send next byte
-                            index -= ws
-                            txdata.next = adc1_rxsreg
-                        else:
-                            # Sent everything
-                            state = KLV_State.READ_KEY
-
             # Deselected
             else:
                 state = KLV_State.READ_KEY
                 txdata.next = 0
 
     return instances()
+
+# RobotIO modules already generated, by config
+_TOP_LEVELS = {}
+
+def _body_lines(func):
+    """
+
+    Return the source lines of the statements of func, without its
+    docstring and without its final return statement
+
+    Raise ValueError unless func ends with 'return instances()' on a line
+    of its own, the return statement of the module of each config.
+
+    """
+    lines = inspect.getsourcelines(func)[0]
+    body = ast.parse(textwrap.dedent(''.join(lines))).body[0].body
+    if isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Str):
+        body = body[1:]
+    last = body[-1]
+    if not isinstance(last, ast.Return) or lines[last.lineno - 1].strip() != 'return instances()':
+        raise ValueError("%s() must end with 'return instances()' on a line of its own" % func.__name__)
+    return lines[body[0].lineno - 1:last.lineno - 1]
+
+def top_level(config):
+    """
+
+    Return the RobotIO module of config (see Robot.Utils.Config)
+
+    MyHDL takes the ports of the top-level module from the source of its
+    function, so the module of each config is generated as source: it has
+    the ports of config as arguments, and the body of _RobotIO() with
+    config and the ports dict set from them. The registers are also given
+    their own names in the module, so that they keep them in the VHDL code
+    and in the hierarchy of the simulation.
+
+    A wrapper calling _RobotIO() would not do: MyHDL prefixes the signals
+    and the processes of a called module with its instance name, and it
+    only names the signals bound to local variables, not the registers
+    held in a dict.
+
+    """
+    if config in _TOP_LEVELS:
+        return _TOP_LEVELS[config]
+
+    signals = port_names(config)
+    args, varargs, varkw, defaults = inspect.getargspec(_RobotIO)
+    options = args[-len(defaults):]
+    statements = _body_lines(_RobotIO)
+
+    lines = ['def RobotIO(%s,\n' % ', '.join(signals)]
+    lines += ['    %s, %s):\n' % (', '.join(args[2:-len(defaults)]),
+                                  ', '.join('%s = %r' % a for a in zip(options, defaults)))]
+    lines += ['    """%s"""\n' % _RobotIO.__doc__]
+    lines += ['    config = CONFIG\n']
+    lines += ['    ports = dict(%s)\n' % ', '.join('%s = %s' % (n, n) for n in signals)]
+    lines += statements
+    lines += ['    %s = registers[%r]\n' % (n, n) for n in register_names(config)]
+    lines += ['    return instances()\n']
+    source = ''.join(lines)
+
+    # inspect finds the source of the module and of its generators in
+    # linecache
+    filename = '<RobotIO %r>' % (config,)
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    namespace = dict(globals(), CONFIG = config)
+    exec compile(source, filename, 'exec') in namespace
+    _TOP_LEVELS[config] = namespace['RobotIO']
+    return _TOP_LEVELS[config]
+
+def register_names(config):
+    """ Return the names of the registers of config, read or written """
+    fields = register_fields(config)
+    return sorted(set(names(READ, fields) + names(WRITE, fields)) - set(['reset', 'pose_clear']))
+
+# RobotIO of the robot
+RobotIO = top_level(DEFAULT)
@@ -0,0 +1,445 @@
+#
+# Transaction-level model of RobotIO
+#
+# RobotIOModel answers the KLV frames of the master byte for byte like
+# RobotIO does, without simulating the SPI bus nor the clk25 clock. It is
+# meant to test host software at protocol level, much faster than the MyHDL
+# simulation of RobotIO.
+#
+# The model keeps its own time, in clk25 periods. Time advances with the
+# bytes transferred (at spi_freq) and with advance(). The devices are
+# modelled with the timing of their hardware, to within a few clk25
+# periods:
+# - odometers move at the speed set with set_speed(), or jump with move(),
+# - velocity windows, ADC scans and PWM periods start at the same times as
+#   in RobotIO, relative to the last reset,
+# - the pose follows the selected odometers.
+#
+# The speed loops are not modelled: there is no motor to close them on.
+# Their registers can be written, and a motor driven by an enabled loop
+# has no known speed.
+#
+# The model has the channel counts of a Config (see Robot.Utils.Config),
+# the robot by default.
+#
+# Like Robot.Utils.RegisterMap, this module does not depend on MyHDL.
+#
+from math import cos, floor, pi, sin
+from Robot.Utils.Config import DEFAULT, loops
+from Robot.Utils.Constants import CLK_FREQ
+from Robot.Utils.RegisterMap import READ, WRITE, UNKNOWN_VALUE, fields, key, key_fields, keys, length
+
+def max_length(config = DEFAULT):
+    """ Return the max length of the values of config (see RobotIO) """
+    f = fields(config)
+    return max(length(k, f) for k in keys(READ, f) + keys(WRITE, f))
+
+# max length of the values of the robot
+MAX_LENGTH = max_length()
+
+# see MotorBank and ServoBank
+MOTOR_RESOLUTION = 10
+MOTOR_PERIOD = 2**MOTOR_RESOLUTION
+MOTOR_DUTY_MAX = 2**10 - 1
+SERVO_PERIOD = CLK_FREQ // 50
+
+# see MCP3008Driver: a channel is converted in 36 half periods of its SPI
+# clock (select, 17 bits, deselect)
+ADC_SPI_FREQ = 1000000
+ADC_CONVERSION = 36 * int(CLK_FREQ / (ADC_SPI_FREQ * 2))
+
+# see VelocityEstimator
+PERIOD_MAX = 2**23 - 1
+
+# see PoseEstimator
+POSE_MOVE_MAX = 2**5 - 1
+
+# states of the KLV decoding (see RobotIO RX())
+_KEY, _READ_LENGTH, _WRITE_LENGTH, _MASTER_READ, _MASTER_WRITE = range(5)
+
+def _wrap(value, width, signed):
+    """ Return the lower width bits of value, as a signed value if needed """
+    value &= (1 << width) - 1
+    if signed and value >> (width - 1):
+        value -= 1 << width
+    return value
+
+class RobotIOModel(object):
+    """
+
+    Transaction-level model of RobotIO
+
+    config
+
+        Channel counts of the modelled RobotIO (see Robot.Utils.Config).
+
+    adc_scan_freq, velocity_window_freq
+
+        Same as the parameters of RobotIO.
+
+    spi_freq
+
+        Frequency of the SPI clock of the master. A byte transferred
+        advances time by 8 SPI clock periods.
+
+    """
+
+    def __init__(self, adc_scan_freq = 1000, velocity_window_freq = 100, spi_freq = 1000000,
+                 config = DEFAULT):
+        self.config = config
+        self.byte_time = 8 * CLK_FREQ // spi_freq
+        self.window = int(CLK_FREQ / velocity_window_freq)
+
+        # a scan starts scan_freq times per second, or right after the
+        # previous one if it takes longer than that
+        scan_time = 8 * ADC_CONVERSION + 1
+        self.scan_period = max(int(CLK_FREQ / adc_scan_freq), scan_time + 1)
+        self.scan_first = int(CLK_FREQ / adc_scan_freq)
+
+        # fields of each key, sorted by offset
+        register_fields = fields(config)
+        self.read_fields = dict((k, key_fields(k, register_fields)) for k in keys(READ, register_fields))
+        self.write_fields = dict((k, key_fields(k, register_fields)) for k in keys(WRITE, register_fields))
+        self.reset_key = key('reset', WRITE, register_fields)
+        self.pose_clear_key = key('pose_clear', WRITE, register_fields)
+        self.mask = 2**(8*max_length(config)) - 1
+
+        # inputs, set by the test
+        self.ext_inputs = [0] * config.ext_ports
+        self.adc_inputs = [0] * 8
+        self.speeds = [0.0] * config.odometers
+
+        # time since power up, in clk25 periods
+        self.time = 0
+
+        # KLV decoding: current key, value and number of value bytes left
+        self.state = _KEY
+        self.key, self.value, self.index = 0, 0, 0
+
+        # values of the registers of the register map, by name
+        self.registers = dict((f.name, 0) for f in register_fields)
+        self.registers['fixed_value'] = 0xDEADC0DE
+        self.registers['pose_right'] = min(1, config.odometers - 1)
+        for i in range(1, config.motors + 1):
+            self.registers['motor%d_resolution' % i] = MOTOR_RESOLUTION
+
+        # motor speeds and servo consigns applied by the PWM generators, a
+        # new consign is applied at the start of both the current and the
+        # new PWM periods, with the PWM resolution and prescaler of the
+        # motor
+        self.motor_duties = [0] * config.motors
+        self.motor_lengths = [MOTOR_PERIOD] * config.motors
+        self.servo_duties = [0] * config.servos
+
+        # the periods of the motors are spread evenly over the default PWM
+        # period (see MotorBank)
+        self.motor_phases = [MOTOR_PERIOD * i // config.motors for i in range(config.motors)]
+
+        self.reset()
+
+    def reset(self):
+        """ Resets the model like the reset key does """
+        self.reset_time = self.time
+        for i in range(1, self.config.odometers + 1):
+            self.registers['rc%d_count' % i] = 0
+            self.registers['rc%d_ticks' % i] = 0
+        self.fractions = [0.0] * self.config.odometers
+        self.window_end = self.time + self.window
+        self.window_counts = [0] * self.config.odometers
+        self.motor_duties = [0] * self.config.motors
+        self.motor_lengths = [MOTOR_PERIOD] * self.config.motors
+        self.motor_next = [self.time + phase for phase in self.motor_phases]
+        self._sample_motors(self.time)
+        self._sample_servos()
+        self.servo_next = self.time + SERVO_PERIOD
+        self.adc_next = self.time + self.scan_first + 1 + ADC_CONVERSION
+        self._clear_pose()
+
+    #
+    # Inputs and outputs
+    #
+
+    def move(self, number, ticks):
+        """ Moves odometer number (from 1) by ticks at once """
+        name = 'rc%d_count' % number
+        self.registers[name] = _wrap(self.registers[name] + ticks, self.config.odometer_width, True)
+        self._update_pose()
+
+    def set_speed(self, number, speed):
+        """ Sets the speed of odometer number (from 1), in ticks per second """
+        self.speeds[number - 1] = float(speed)
+
+    def count(self, number):
+        """ Return the count of odometer number (from 1) """
+        return self.registers['rc%d_count' % number]
+
+    def motor(self, number):
+        """
+
+        Return the speed applied to motor number (from 1), -1023 to 1023,
+        without the bits dropped by its PWM resolution
+
+        Returns None when the motor is driven by its speed loop.
+
+        """
+        if number <= loops(self.config) and self.registers['loop%d_enable' % number]:
+            return None
+        return self.motor_duties[number - 1]
+
+    def motor_period(self, number):
+        """ Return the length of the PWM period of motor number (from 1), in clk25 periods """
+        return self.motor_lengths[number - 1]
+
+    def servo(self, number):
+        """ Return the pulse width of servo number (from 1), in clk25 periods """
+        return self.servo_duties[number - 1]
+
+    def leds(self):
+        """ Return the state of the green and yellow LEDs """
+        return bool(self.registers['led_green_consign']), bool(self.registers['led_yellow_consign'])
+
+    #
+    # Time
+    #
+
+    def advance(self, cycles):
+        """ Advances time by cycles clk25 periods """
+        start, end = self.time, self.time + cycles
+        while self.time < end:
+            step_end = min(end, self.window_end)
+            self._move_odometers(step_end - self.time)
+            self.time = step_end
+            if self.time == self.window_end:
+                self._close_window()
+
+        # PWM periods and ADC conversions that ended meanwhile
+        self._sample_motors(end)
+        if end >= self.servo_next:
+            self._sample_servos()
+            self.servo_next += ((end - self.servo_next) // SERVO_PERIOD + 1) * SERVO_PERIOD
+        if end >= self.adc_next:
+            self._scan_adc(start, end)
+
+    def _move_odometers(self, cycles):
+        """ Moves the odometers at their speed for cycles clk25 periods """
+        moved = False
+        for i in range(self.config.odometers):
+            if self.speeds[i]:
+                self.fractions[i] += self.speeds[i] * cycles / CLK_FREQ
+                ticks = int(floor(self.fractions[i]))
+                if ticks:
+                    self.fractions[i] -= ticks
+                    name = 'rc%d_count' % (i + 1)
+                    self.registers[name] = _wrap(self.registers[name] + ticks, self.config.odometer_width, True)
+                    moved = True
+        if moved:
+            self._update_pose()
+
+    def _close_window(self):
+        """ Sets the ticks of the window that ends now """
+        for i in range(self.config.odometers):
+            count = self.registers['rc%d_count' % (i + 1)]
+            self.registers['rc%d_ticks' % (i + 1)] = _wrap(count - self.window_counts[i], 16, True)
+            self.window_counts[i] = count
+        self.window_end += self.window
+
+    def _periods(self):
+        """ Sets the periods between ticks from the speeds """
+        for i in range(self.config.odometers):
+            speed = self.speeds[i]
+            period = int(round(CLK_FREQ / abs(speed))) if speed else 0
+            if period > PERIOD_MAX:
+                period = 0
+            self.registers['rc%d_period' % (i + 1)] = period if speed >= 0 else -period
+
+    def _sample_motors(self, end):
+        """ Applies the speeds, PWM resolutions and prescalers of the motors whose period started by end
+        (-1024 is applied as -1023)
+
+        The periods are powers of two, counted from the first period after
+        reset: a new setting applies at the first start of the current
+        period that is also a start of the new period.
+
+        """
+        for i in range(self.config.motors):
+            start = self.motor_next[i]
+            if end >= start:
+                number = i + 1
+                first = self.reset_time + self.motor_phases[i]
+                current = self.motor_lengths[i]
+                resolution = min(self.registers['motor%d_resolution' % number], MOTOR_RESOLUTION)
+                length = 2**(resolution + self.registers['motor%d_prescaler' % number])
+                applied = first + -(-(start - first) // length) * length
+                if end >= applied:
+                    speed = self.registers['motor%d_speed' % number]
+                    drop = MOTOR_RESOLUTION - resolution
+                    duty = min(abs(speed), MOTOR_DUTY_MAX) >> drop << drop
+                    self.motor_duties[i] = duty if speed >= 0 else -duty
+                    self.motor_lengths[i] = length
+                    start, current = applied, length
+                self.motor_next[i] = start + ((end - start) // current + 1) * current
+
+    def _sample_servos(self):
+        """ Applies the servo consigns """
+        for i in range(self.config.servos):
+            self.servo_duties[i] = self.registers['servo%d_consign' % (i + 1)]
+
+    def _scan_adc(self, start, end):
+        """ Sets the ADC channels converted between start and end """
+        first = self.reset_time + self.scan_first + 1
+        self.adc_next = end + self.scan_period
+        for channel in range(8):
+            # end of the last conversion of channel before end
+            offset = first + (channel + 1) * ADC_CONVERSION
+            if end < offset:
+                self.adc_next = min(self.adc_next, offset)
+                continue
+            done = offset + (end - offset) // self.scan_period * self.scan_period
+            if done > start:
+                self.registers['adc1_ch%d_value' % channel] = self.adc_inputs[channel] & 0x3FF
+            self.adc_next = min(self.adc_next, done + self.scan_period)
+
+    #
+    # Pose
+    #
+
+    def _clear_pose(self):
+        """ Resets the pose, from the current counts """
+        self.pose_counts = self._pose_counts()
+        self.x_pos, self.y_pos, self.heading = 0, 0, 0
+        self._set_pose()
+
+    def _pose_counts(self):
+        """ Return the counts of the left and right odometers of the pose """
+        last = self.config.odometers
+        return (self.registers['rc%d_count' % min(self.registers['pose_left'] + 1, last)],
+                self.registers['rc%d_count' % min(self.registers['pose_right'] + 1, last)])
+
+    def _update_pose(self):
+        """ Integrates the moves of the odometers since the last update """
+        left, right = self._pose_counts()
+        width = self.config.odometer_width
+        left_move = _wrap(left - self.pose_counts[0], width, True)
+        right_move = _wrap(right - self.pose_counts[1], width, True)
+        self.pose_counts = (left, right)
+
+        # PoseEstimator integrates at most POSE_MOVE_MAX ticks per update
+        while left_move or right_move:
+            left_step = max(-POSE_MOVE_MAX, min(POSE_MOVE_MAX, left_move))
+            right_step = max(-POSE_MOVE_MAX, min(POSE_MOVE_MAX, right_move))
+            left_move -= left_step
+            right_move -= right_step
+
+            # sine and cosine of the upper 16 bits of the heading, with 16
+            # fractional bits, and distance in half ticks
+            angle = (self.heading >> 16) * 2 * pi / 2**16
+            distance = left_step + right_step
+            self.x_pos += distance * int(round(cos(angle) * 2**16))
+            self.y_pos += distance * int(round(sin(angle) * 2**16))
+            turn = (right_step - left_step) * self.registers['pose_angle_scale']
+            self.heading = (self.heading + turn) % 2**32
+        self._set_pose()
+
+    def _set_pose(self):
+        """ Sets the pose registers: x and y with 8 fractional bits """
+        self.registers['pose_x'] = _wrap(self.x_pos >> 9, 32, True)
+        self.registers['pose_y'] = _wrap(self.y_pos >> 9, 32, True)
+        self.registers['pose_theta'] = self.heading
+
+    #
+    # KLV protocol
+    #
+
+    def _snapshot(self):
+        """ Latches the odometer counts, the pose and the timebase """
+        r = self.registers
+        r['timestamp'] = self.time % 2**32
+        for i in range(1, self.config.odometers + 1):
+            r['rc%d_snapshot' % i] = r['rc%d_count' % i]
+        r['pose_x_snapshot'] = r['pose_x']
+        r['pose_y_snapshot'] = r['pose_y']
+        r['pose_theta_snapshot'] = r['pose_theta']
+
+    def read(self, key):
+        """ Return the value read by the master with key """
+        if key not in self.read_fields:
+            return UNKNOWN_VALUE
+        self._periods()
+        for i in range(self.config.ext_ports):
+            self.registers['ext%d_port' % (i + 1)] = self.ext_inputs[i]
+        value = 0
+        for f in self.read_fields[key]:
+            value |= _wrap(self.registers[f.name], f.width, False) << f.offset
+        return value
+
+    def write(self, key, value):
+        """ Stores the value written by the master with key """
+        if key == self.reset_key:
+            self.reset()
+        elif key == self.pose_clear_key:
+            self._clear_pose()
+        for f in self.write_fields.get(key, ()):
+            self.registers[f.name] = _wrap(value >> f.offset, f.width, f.signed)
+
+    def transfer(self, frame):
+        """
+
+        Return the bytes sent by RobotIO while the master sends frame
+
+        frame
+
+            Bytes sent by the master while RobotIO is selected: a stream of
+            KLV commands. As in RobotIO, a command may continue in the next
+            frame.
+
+        """
+        frame = bytearray(frame)
+        answer = bytearray(len(frame))
+        start = self.time
+
+        for i, byte in enumerate(frame):
+            if self.state == _KEY:
+                self.key = byte
+                if byte < 0x80:
+                    # the snapshot is latched when the key is received
+                    self.advance(start + (i + 1) * self.byte_time - self.time)
+                    self._snapshot()
+                    self.state = _READ_LENGTH
+                else:
+                    self.state = _WRITE_LENGTH
+
+            elif self.state == _READ_LENGTH:
+                if byte > 0:
+                    # the value is latched when the length is received
+                    self.advance(start + (i + 1) * self.byte_time - self.time)
+                    self.value = self.read(self.key) & self.mask
+                    self.index = byte
+                    self.state = _MASTER_READ
+                else:
+                    self.state = _KEY
+
+            elif self.state == _MASTER_READ:
+                self.index -= 1
+                answer[i] = (self.value >> (8 * self.index)) & 0xFF
+                if self.index == 0:
+                    self.state = _KEY
+
+            elif self.state == _WRITE_LENGTH:
+                if byte > 0:
+                    self.value = 0
+                    self.index = byte
+                    self.state = _MASTER_WRITE
+                else:
+                    self.state = _KEY
+
+            else:
+                self.value = (self.value << 8) | byte
+                self.index -= 1
+                if self.index == 0:
+                    # the value is written when its last byte is received
+                    self.advance(start + (i + 1) * self.byte_time - self.time)
+                    self.write(self.key, self.value & self.mask)
+                    self.state = _KEY
+
+        self.advance(start + len(frame) * self.byte_time - self.time)
+        return answer
@@ -0,0 +1,124 @@
+from math import atan, pi, sqrt
+from myhdl import instance, instances, intbv
+from Robot.Utils.Constants import LOW, HIGH
+
+def SinCos(cos, sin, angle, start, done, clk25, rst_n, iterations = 14):
+    """
+
+    Fixed-point sine and cosine with an iterative CORDIC
+
+    The angle is rotated by one CORDIC step per clk25 period, so a result is
+    ready iterations + 1 clk25 periods after start.
+
+    cos, sin
+
+        Output cosine and sine of angle, with len(cos) - 2 fractional bits.
+
+    angle
+
+        Input binary angle: a full turn is 2**len(angle).
+
+    start
+
+        Input: angle is sampled and the computation starts when start is high
+        on a clk25 rising edge.
+
+    done
+
+        Output high for 1 clk25 period when cos and sin are set.
+
+    clk25
+
+        25 MHz clock input.
+
+    rst_n
+
+        Active low reset input.
+
+    iterations
+
+        Number of CORDIC steps. More steps than len(angle) - 2 do not add
+        precision.
+
+    """
+
+    A = len(angle)
+    W = len(cos)
+    assert len(sin) == W and cos.min < 0 and sin.min < 0, 'cos and sin must be signed and of the same width'
+    assert iterations <= A - 2, 'too many iterations for angle width'
+
+    # arctangent of 2**-i, in binary angle units
+    ATAN = tuple([int(round(atan(2.0**-i) * 2**A / (2*pi))) for i in range(iterations)])
+
+    # start with the inverse of the CORDIC gain so that the result is not scaled
+    gain = 1.0
+    for i in range(iterations):
+        gain *= sqrt(1 + 2.0**(-2*i))
+    X0 = int(round(2**(W-2) / gain))
+
+    @instance
+    def Rotate():
+        """ Rotates (X0, 0) by angle """
+
+        # current vector and remaining angle
+        x = intbv(0, min = -2**(W-1), max = 2**(W-1))
+        y = intbv(0, min = -2**(W-1), max = 2**(W-1))
+        z = intbv(0, min = -2**(A-1), max = 2**(A-1))
+
+        # shifted vector and arctangent of the current step
+        dx = intbv(0, min = -2**(W-1), max = 2**(W-1))
+        dy = intbv(0, min = -2**(W-1), max = 2**(W-1))
+        atan_i = intbv(0, min = 0, max = 2**(A-2))
+
+        # angle reduced to [-pi/2, pi/2], the result is negated if needed
+        reduced = intbv(0)[A:]
+        negate = False
+
+        # current step
+        i = intbv(0, min = 0, max = iterations + 1)
+        busy = False
+
+        while True:
+            yield clk25.posedge, rst_n.negedge
+            if rst_n == LOW:
+                busy = False
+                i[:] = 0
+                done.next = LOW
+            else:
+                done.next = LOW
+                if not busy:
+                    if start == HIGH:
+                        # angles in [pi/2, 3pi/2[ are rotated by pi
+                        reduced[:] = angle
+                        negate = reduced[A-1] != reduced[A-2]
+                        if negate:
+                            reduced[A-1] = not reduced[A-1]
+                        x[:] = X0
+                        y[:] = 0
+                        z[:] = reduced.signed()
+                        i[:] = 0
+                        busy = True
+                elif i == iterations:
+                    if negate:
+                        cos.next = -x
+                        sin.next = -y
+                    else:
+                        cos.next = x
+                        sin.next = y
+                    done.next = HIGH
+                    busy = False
+                else:
+                    dx[:] = x >> i
+                    dy[:] = y >> i
+                    atan_i[:] = ATAN[int(i)]
+                    if z >= 0:
+                        x[:] = x - dy
+                        y[:] = y + dx
+                        z[:] = z - atan_i
+                    else:
+                        x[:] = x + dy
+                        y[:] = y - dx
+                        z[:] = z + atan_i
+                    i += 1
+
+    return instances()
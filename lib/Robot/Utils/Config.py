@@ -0,0 +1,64 @@
+#
+# Channel counts and widths of RobotIO
+#
+# RobotIO, its register map, its model and its test benches are all
+# derived from a Config:
+# - odometers: number of quadrature encoders (rc1, rc2...), each with a
+#   velocity estimator, and selectable by the pose estimator
+# - odometer_width: width of the odometer counts, in bits (16 to 32)
+# - motors: number of DC motors (mot1, mot2...)
+# - servos: number of servo motors, 8 per PWM board (pwm1_ch0 to pwm1_ch7,
+#   pwm2_ch0...)
+# - ext_ports: number of 8-bit extension ports (ext1, ext2...)
+#
+# The first min(odometers, motors) motors have a speed loop closed on the
+# odometer of the same number.
+#
+# Like Robot.Utils.RegisterMap, this module does not depend on MyHDL.
+#
+from collections import namedtuple
+
+Config = namedtuple('Config', 'odometers odometer_width motors servos ext_ports')
+
+# the robot
+DEFAULT = Config(odometers = 4, odometer_width = 32, motors = 8, servos = 8, ext_ports = 7)
+
+# larger chassis
+LARGE = Config(odometers = 8, odometer_width = 32, motors = 16, servos = 8, ext_ports = 7)
+
+# two wheels and their odometers only, for short synthesis runs
+SMALL = Config(odometers = 2, odometer_width = 16, motors = 2, servos = 0, ext_ports = 0)
+
+VARIANTS = {'default': DEFAULT, 'large': LARGE, 'small': SMALL}
+
+def check(config):
+    """ Raise ValueError if config is out of range """
+    if config.odometers < 1:
+        raise ValueError('at least one odometer is needed (for the pose)')
+    if not 16 <= config.odometer_width <= 32:
+        raise ValueError('odometer_width must be 16 to 32 bits')
+    for name in ['motors', 'servos', 'ext_ports']:
+        if getattr(config, name) < 0:
+            raise ValueError('%s must not be negative' % name)
+
+def loops(config):
+    """ Return the number of speed loops """
+    return min(config.odometers, config.motors)
+
+def ports(config):
+    """ Return the names of the top-level ports of RobotIO, in order """
+    names = ['clk25', 'sspi_clk', 'sspi_cs', 'sspi_miso', 'sspi_mosi']
+    for i in range(1, config.odometers + 1):
+        names += ['rc%d_cha' % i, 'rc%d_chb' % i]
+    for i in range(1, config.motors + 1):
+        names += ['mot%d_brake' % i, 'mot%d_dir' % i, 'mot%d_pwm' % i]
+    names += ['adc1_clk', 'adc1_cs', 'adc1_miso', 'adc1_mosi']
+    names += [servo_port(i) for i in range(1, config.servos + 1)]
+    for i in range(1, config.ext_ports + 1):
+        names += ['ext%d_%d' % (i, j) for j in range(8)]
+    names += ['led_yellow_n', 'led_green_n', 'led_red_n']
+    return names
+
+def servo_port(number):
+    """ Return the name of the PWM output of servo number (from 1) """
+    return 'pwm%d_ch%d' % ((number - 1) // 8 + 1, (number - 1) % 8)
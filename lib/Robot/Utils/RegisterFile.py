@@ -0,0 +1,181 @@
+from myhdl import ConcatSignal, Signal, always, always_comb, intbv
+from Robot.Utils.Constants import HIGH
+from Robot.Utils.RegisterMap import READ, WRITE, UNKNOWN_VALUE, key_fields, keys, name_fields, names
+
+def _Drive(output, input):
+    """ Drives output with the unsigned bits of input """
+
+    @always_comb
+    def DriveOutput():
+        output.next = input[len(input):]
+
+    return DriveOutput
+
+def Constant(output, value, clk25):
+    """
+
+    Drives output with value
+
+    output is assigned at each clk25 rising edge rather than left undriven
+    with value as initial value: the converter writes the constant of an
+    assignment as a bit string, whereas it declares an undriven signal with
+    a VHDL integer, limited to 32 bits.
+
+    """
+
+    assert 0 <= value < 2**len(output), 'value too long for %d bits' % len(output)
+
+    @always(clk25.posedge)
+    def DriveConstant():
+        output.next = value
+
+    return DriveConstant
+
+def ReadRegisters(bank, signals, fields, clk25):
+    """
+
+    Read side of the register file
+
+    Each entry of the bank is driven with the value of one read key, that
+    is the concatenation of the fields of the key. The last entry is driven
+    with UNKNOWN_VALUE.
+
+    Returns the instances and the ROM giving the bank index of each key.
+
+    bank
+
+        List of signals, one per read key and one for unknown keys
+
+    signals
+
+        Dictionary of the signals read, by name
+
+    fields
+
+        Fields of the register map
+
+    clk25
+
+        25 MHz clock input
+
+    """
+
+    read_keys = keys(READ, fields)
+    assert len(bank) == len(read_keys) + 1, 'wrong bank size'
+
+    drivers = []
+    for i, key in enumerate(read_keys):
+        # unsigned wires and zero padding, most significant first
+        parts = []
+        offset = 0
+        for f in key_fields(key, fields):
+            signal = signals[f.name]
+            assert len(signal) == f.width, 'wrong width for %s' % f.name
+            assert f.offset >= offset, 'overlapping fields for key 0x%02X' % key
+            if f.offset > offset:
+                parts.insert(0, Signal(intbv(0)[f.offset - offset:]))
+            wire = Signal(intbv(0)[f.width:])
+            drivers.append(_Drive(wire, signal))
+            parts.insert(0, wire)
+            offset = f.offset + f.width
+        assert offset <= len(bank[i]), 'value too long for key 0x%02X' % key
+        if len(parts) > 1:
+            drivers.append(_Drive(bank[i], ConcatSignal(*parts)))
+        else:
+            drivers.append(_Drive(bank[i], parts[0]))
+
+    drivers.append(Constant(bank[-1], UNKNOWN_VALUE, clk25))
+
+    # bank index of all keys (unknown keys use the last entry)
+    rom = [len(read_keys)] * 256
+    for i, key in enumerate(read_keys):
+        rom[key] = i
+
+    return drivers, tuple(rom)
+
+def WriteRegister(target, fields, write_key, write_value, write_strobe, clk25):
+    """
+
+    Write side of the register file, for one signal
+
+    target is set on the clk25 rising edge where write_strobe is high, if
+    write_key is one of the keys of its fields.
+
+    target
+
+        Signal written
+
+    fields
+
+        Fields of the register map writing target (one or two)
+
+    write_key, write_value
+
+        Last key and value written by the master
+
+    write_strobe
+
+        High for one clk25 period after the master wrote a value
+
+    clk25
+
+        25 MHz clock input
+
+    """
+
+    assert len(fields) in (1, 2), 'too many keys for %s' % fields[0].name
+    width = len(target)
+    for f in fields:
+        assert f.width == width, 'wrong width for %s' % f.name
+
+    # with one key only, the second test is never reached
+    key1, key2 = fields[0].key, fields[-1].key
+
+    # fields of the value written by the master, as shadow signals
+    if isinstance(target.val, bool):
+        value1, value2 = write_value(fields[0].offset), write_value(fields[-1].offset)
+    else:
+        value1 = write_value(fields[0].offset + width, fields[0].offset)
+        value2 = write_value(fields[-1].offset + width, fields[-1].offset)
+
+    if fields[0].signed:
+        @always(clk25.posedge)
+        def WriteSigned():
+            """ Stores the written value into target """
+            if write_strobe == HIGH:
+                if write_key == key1:
+                    target.next = value1[width:].signed()
+                elif write_key == key2:
+                    target.next = value2[width:].signed()
+        return WriteSigned
+    else:
+        @always(clk25.posedge)
+        def WriteUnsigned():
+            """ Stores the written value into target """
+            if write_strobe == HIGH:
+                if write_key == key1:
+                    target.next = value1
+                elif write_key == key2:
+                    target.next = value2
+        return WriteUnsigned
+
+def WriteRegisters(signals, fields, write_key, write_value, write_strobe, clk25):
+    """
+
+    Write side of the register file, for all signals
+
+    signals
+
+        Dictionary of the signals written, by name. Names of the register
+        map missing from signals are ignored.
+
+    See WriteRegister for the other arguments.
+
+    """
+
+    writers = []
+    for name in names(WRITE, fields):
+        if name in signals:
+            writers.append(WriteRegister(signals[name], name_fields(name, WRITE, fields),
+                                         write_key, write_value, write_strobe, clk25))
+    return writers
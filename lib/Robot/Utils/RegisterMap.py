@@ -0,0 +1,238 @@
+#
+# Register map of the KLV protocol spoken by RobotIO
+#
+# The master (the Gumstix) sends a stream of KLV (Key byte, Length byte,
+# Value bytes) encoded commands. Keys upto 0x7F are read commands. Keys from
+# 0x80 are write commands. Values are sent most significant byte first.
+#
+# Each field of the map gives:
+# - key: the key byte
+# - name: the name of the RobotIO signal read or written with this key
+# - width: the width of the field, in bits
+# - signed: True if the field is a two's complement value
+# - direction: READ or WRITE
+# - offset: the position of the field in the value, in bits
+#
+# Several fields may share a key, to read or write several signals with one
+# value. A signal may be written with at most two keys (its own key, and
+# a key shared with other signals).
+#
+# The map depends on the channel counts of RobotIO: fields() builds the map
+# of a Config (see Robot.Utils.Config) and FIELDS is the map of the robot.
+# Each group of keys keeps its first key when it fits, so that the keys of
+# the robot are the same in all configs that have as many channels or less.
+#
+# A config with more channels than the robot moves the groups that follow
+# a grown one, and the host must use the keys of its map. With the LARGE
+# config (8 odometers, 16 motors):
+# - the counts and timestamp keys start at 0x19 instead of 0x18 (rc1 with
+#   the timestamp at 0x1A instead of 0x19), the timestamp alone is 0x22
+#   instead of 0x1F,
+# - the ticks per window start at 0x23 instead of 0x21, the periods
+#   between ticks at 0x2B instead of 0x25, the EXT ports at 0x33 instead
+#   of 0x31,
+# - the loop enables start at 0xB9 instead of 0xB5,
+# - the pose keys start at 0xD9 instead of 0xD1.
+#
+# This module does not depend on MyHDL: it is meant to be used on the host
+# as well.
+#
+from collections import namedtuple
+from Robot.Utils.Config import DEFAULT, check, loops
+
+READ, WRITE = 'read', 'write'
+
+Field = namedtuple('Field', 'key name width signed direction offset')
+
+def _place(groups, direction):
+    """
+
+    Return the fields of groups, with their final keys
+
+    groups is a list of (first key, fields) where the keys of the fields are
+    relative to the first key of their group. Each group starts at its
+    first key, or right after the previous group if it grew past it, so
+    that the keys of the robot do not depend on the other configs.
+
+    """
+    placed = []
+    free = 0x00 if direction == READ else 0x80
+    for first, group in groups:
+        if not group:
+            continue
+        first = max(first, free)
+        placed += [f._replace(key = first + f.key) for f in group]
+        free = max(f.key for f in placed) + 1
+    if free > (0x80 if direction == READ else 0x100):
+        raise ValueError('too many %s keys' % direction)
+    return placed
+
+def fields(config = DEFAULT):
+    """ Return the fields of the register map of config (see Robot.Utils.Config) """
+    check(config)
+    rc = range(1, config.odometers + 1)
+    w = config.odometer_width
+    read = []
+
+    # Odometers: all counts latched together, rc1 in the lower bytes, then
+    # one count per key
+    read.append((0x10, [Field(0, 'rc%d_snapshot' % i, w, True, READ, w*(i-1)) for i in rc] +
+                       [Field(i, 'rc%d_count' % i, w, True, READ, 0) for i in rc]))
+
+    # Odometers: all counts and the timestamp latched together, timestamp
+    # in the lower bytes (clk25 periods, see RobotIO timebase), then one
+    # count and the timestamp latched together per key
+    group = [Field(0, 'timestamp', 32, False, READ, 0)]
+    group += [Field(0, 'rc%d_snapshot' % i, w, True, READ, 32 + w*(i-1)) for i in rc]
+    for i in rc:
+        group += [
+            Field(i, 'timestamp', 32, False, READ, 0),
+            Field(i, 'rc%d_snapshot' % i, w, True, READ, 32),
+        ]
+    read.append((0x18, group))
+
+    # Timestamp alone
+    read.append((0x1F, [Field(0, 'timestamp', 32, False, READ, 0)]))
+
+    # Odometers: ticks per window (see VelocityEstimator)
+    read.append((0x21, [Field(i-1, 'rc%d_ticks' % i, 16, True, READ, 0) for i in rc]))
+
+    # Odometers: clk25 periods between ticks (see VelocityEstimator)
+    read.append((0x25, [Field(i-1, 'rc%d_period' % i, 24, True, READ, 0) for i in rc]))
+
+    # EXT ports
+    read.append((0x31, [Field(i-1, 'ext%d_port' % i, 8, False, READ, 0)
+                        for i in range(1, config.ext_ports + 1)]))
+
+    # Fixed value for testing (0xDEADC0DE)
+    read.append((0x42, [Field(0, 'fixed_value', 32, False, READ, 0)]))
+
+    # ADC: latest value of each channel, then all channels at once, 2 bytes
+    # each, channel 0 in the lower bytes
+    read.append((0x50, [Field(i, 'adc1_ch%d_value' % i, 10, False, READ, 0) for i in range(8)] +
+                       [Field(8, 'adc1_ch%d_value' % i, 10, False, READ, 16*i) for i in range(8)]))
+
+    # Pose: x, y (ticks with 8 fractional bits) and theta (a full turn is 2**32),
+    # latched together, theta in the lower bytes
+    read.append((0x60, [
+        Field(0, 'pose_theta_snapshot', 32, False, READ, 0),
+        Field(0, 'pose_y_snapshot',     32, True,  READ, 32),
+        Field(0, 'pose_x_snapshot',     32, True,  READ, 64),
+    ]))
+
+    # Read stored values for testing
+    read.append((0x71, [
+        Field(0, 'stored_uint8',  8,  False, READ, 0),
+        Field(1, 'stored_uint16', 16, False, READ, 0),
+        Field(2, 'stored_uint32', 32, False, READ, 0),
+        Field(3, 'stored_int8',   8,  True,  READ, 0),
+        Field(4, 'stored_int16',  16, True,  READ, 0),
+        Field(5, 'stored_int32',  32, True,  READ, 0),
+    ]))
+
+    write = []
+
+    # Reset (the value is ignored)
+    write.append((0x81, [Field(0, 'reset', 8, False, WRITE, 0)]))
+
+    # Green and yellow LEDs
+    write.append((0x82, [
+        Field(0, 'led_green_consign',  1, False, WRITE, 0),
+        Field(1, 'led_yellow_consign', 1, False, WRITE, 0),
+    ]))
+
+    # Motors: all speeds at once, motor1 in the lower bits, then one speed
+    # per key
+    mot = range(1, config.motors + 1)
+    write.append((0x90, [Field(0, 'motor%d_speed' % i, 11, True, WRITE, 11*(i-1)) for i in mot] +
+                        [Field(i, 'motor%d_speed' % i, 11, True, WRITE, 0) for i in mot]))
+
+    # Servos
+    write.append((0xA1, [Field(i-1, 'servo%d_consign' % i, 16, False, WRITE, 0)
+                         for i in range(1, config.servos + 1)]))
+
+    # Speed loops: consigns, in ticks per loop period with 8 fractional bits
+    loop = range(1, loops(config) + 1)
+    write.append((0xB1, [Field(i-1, 'loop%d_consign' % i, 16, True, WRITE, 0) for i in loop]))
+
+    # Speed loops: enable (motorX_speed is ignored while enabled)
+    write.append((0xB5, [Field(i-1, 'loop%d_enable' % i, 1, False, WRITE, 0) for i in loop]))
+
+    # Speed loops: gains and limits, shared by all loops
+    if loop:
+        write.append((0xC1, [
+            Field(0, 'loop_gain_p',    16, False, WRITE, 0),
+            Field(1, 'loop_gain_i',    16, False, WRITE, 0),
+            Field(2, 'loop_gain_d',    16, False, WRITE, 0),
+            Field(3, 'loop_out_shift', 6,  False, WRITE, 0),
+            Field(4, 'loop_max_i',     24, False, WRITE, 0),
+            Field(5, 'loop_accel',     16, False, WRITE, 0),
+            Field(6, 'loop_decel',     16, False, WRITE, 0),
+        ]))
+
+    # Motors: PWM resolution of each motor, in bits of ticks per period (10
+    # by default, larger values act as 10), applied with its speed and
+    # prescaler at the start of both its current and its new periods (see
+    # MotorBank)
+    write.append((0xC9, [Field(i-1, 'motor%d_resolution' % i, 4, False, WRITE, 0) for i in mot]))
+
+    # Pose: left and right odometers (0 for rc1, 1 for rc2...), angle scale
+    # (see PoseEstimator) and clear (the value is ignored)
+    select = max(1, (config.odometers - 1).bit_length())
+    write.append((0xD1, [
+        Field(0, 'pose_left',        select, False, WRITE, 0),
+        Field(1, 'pose_right',       select, False, WRITE, 0),
+        Field(2, 'pose_angle_scale', 24,     False, WRITE, 0),
+        Field(3, 'pose_clear',       8,      False, WRITE, 0),
+    ]))
+
+    # Motors: PWM prescaler of each motor, in bits of clk25 periods per tick
+    # (0 by default, see MotorBank)
+    write.append((0xE1, [Field(i-1, 'motor%d_prescaler' % i, 3, False, WRITE, 0) for i in mot]))
+
+    # Store values for testing
+    write.append((0xF1, [
+        Field(0, 'stored_uint8',  8,  False, WRITE, 0),
+        Field(1, 'stored_uint16', 16, False, WRITE, 0),
+        Field(2, 'stored_uint32', 32, False, WRITE, 0),
+        Field(3, 'stored_int8',   8,  True,  WRITE, 0),
+        Field(4, 'stored_int16',  16, True,  WRITE, 0),
+        Field(5, 'stored_int32',  32, True,  WRITE, 0),
+    ]))
+
+    return tuple(_place(read, READ) + _place(write, WRITE))
+
+# fields of the robot
+FIELDS = fields()
+
+# Dummy value sent when the key is unknown. The value is fixed. The master
+# reads 'length' bytes from it.
+UNKNOWN_VALUE = 0xDEADBEEFBAADF00D
+
+def direction(key):
+    """ Return the direction of key: READ upto 0x7F, WRITE from 0x80 """
+    return READ if key < 0x80 else WRITE
+
+def keys(dir, fields = FIELDS):
+    """ Return the sorted keys of direction dir """
+    return sorted(set(f.key for f in fields if f.direction == dir))
+
+def key_fields(key, fields = FIELDS):
+    """ Return the fields of key, sorted by offset """
+    return sorted((f for f in fields if f.key == key), key = lambda f: f.offset)
+
+def name_fields(name, dir, fields = FIELDS):
+    """ Return the fields of direction dir for signal name, sorted by key """
+    return sorted((f for f in fields if f.name == name and f.direction == dir), key = lambda f: f.key)
+
+def names(dir, fields = FIELDS):
+    """ Return the sorted names of the signals read or written """
+    return sorted(set(f.name for f in fields if f.direction == dir))
+
+def key(name, dir, fields = FIELDS):
+    """ Return the key reading or writing name alone """
+    return [f.key for f in name_fields(name, dir, fields) if len(key_fields(f.key, fields)) == 1][0]
+
+def length(key, fields = FIELDS):
+    """ Return the length in bytes of the value of key """
+    return max((f.offset + f.width + 7) // 8 for f in key_fields(key, fields))
@@ -0,0 +1,262 @@
+import sys
+sys.path.append('../lib')
+
+import json
+
+from functools import partial
+from myhdl import delay, instance
+from myhdl._instance import _Instantiator
+from optparse import OptionParser
+from Robot.Main import KLV_State, SPI_State
+from Robot.Utils.RegisterMap import READ, WRITE, direction, key_fields, keys, length
+from Robot.Utils.Constants import LOW, HIGH
+
+# transitions of the KLV decoding in RX(), one per received word
+KLV_TRANSITIONS = [
+    ('READ_KEY', 'GET_READ_LENGTH'), ('READ_KEY', 'GET_WRITE_LENGTH'),
+    ('GET_READ_LENGTH', 'MASTER_READ'), ('GET_READ_LENGTH', 'READ_KEY'),
+    ('GET_WRITE_LENGTH', 'MASTER_WRITE'), ('GET_WRITE_LENGTH', 'READ_KEY'),
+    ('MASTER_READ', 'MASTER_READ'), ('MASTER_READ', 'READ_KEY'),
+    ('MASTER_WRITE', 'MASTER_WRITE'), ('MASTER_WRITE', 'READ_KEY'),
+]
+
+# transitions of the SPI transmission in TX(), one per rising edge of the
+# SPI clock (TRANSFER to IDLE also happens when the master deselects RobotIO)
+SPI_TRANSITIONS = [('IDLE', 'IDLE'), ('IDLE', 'TRANSFER'), ('TRANSFER', 'TRANSFER'), ('TRANSFER', 'IDLE')]
+
+# lengths of values, compared to the length of the key
+LENGTHS = ['zero', 'short', 'exact', 'long']
+
+# keys of the ADC channels, read from the latest scan of MCP3008Driver
+ADC_KEYS = [k for k in keys(READ) if all(f.name.startswith('adc1_') for f in key_fields(k))]
+
+def key_label(k):
+    """ Return the coverage bin of key k: its value, or unknown read/write """
+    if k in keys(direction(k)):
+        return '0x%02X' % k
+    return 'unknown %s' % direction(k)
+
+def length_label(k, n):
+    """ Return the coverage bin of length n sent with key k """
+    if n == 0:
+        return 'zero'
+    if k not in keys(direction(k)):
+        return 'nonzero'
+    return LENGTHS[2 + cmp(n, length(k))]
+
+def bins():
+    """ Return the bins of each section of the coverage, in report order """
+    all_keys = [key_label(k) for k in keys(READ) + keys(WRITE)] + ['unknown read', 'unknown write']
+    lengths = []
+    for k in keys(READ) + keys(WRITE):
+        lengths += ['%s %s' % (key_label(k), l) for l in LENGTHS]
+    for d in [READ, WRITE]:
+        lengths += ['unknown %s %s' % (d, l) for l in ['zero', 'nonzero']]
+    return [
+        ('klv_transitions', ['%s > %s' % t for t in KLV_TRANSITIONS]),
+        ('spi_transitions', ['%s > %s' % t for t in SPI_TRANSITIONS]),
+        ('frame_ends', [s for s in KLV_State._names]),
+        ('keys', all_keys),
+        ('lengths', lengths),
+        ('adc_reads', ['%s %s' % (key_label(k), l) for k in ADC_KEYS for l in LENGTHS]),
+    ]
+
+class KLVCoverage(object):
+    """ Record what the KLV decoder of RobotIO goes through in a simulation
+
+    Use it like traceSignals: coverage(RobotIO, *args, **kwargs) elaborates
+    RobotIO, with tracer (like traceSignals or a SelectiveTracer) if it is
+    given, and returns its instances along with a monitor. The monitor
+    samples the states of TX() and RX() after each edge of the SPI clock and
+    counts, in counts[section][bin]:
+    - klv_transitions: the KLV state transitions, one per received word,
+    - spi_transitions: the SPI state transitions, one per rising edge,
+    - frame_ends: the KLV state when the master deselects RobotIO (the
+      decoding carries on in the next frame),
+    - keys: the keys received, unknown keys in a read and a write bin,
+    - lengths: the lengths received for each key, compared to its length,
+    - adc_reads: the lengths received for the keys of the ADC channels.
+    Elaboration and sampling fail with ValueError when RX() or TX() lose one
+    of the variables the monitor samples (see RX_LOCALS, TX_LOCALS and
+    SIGNALS), rather than count wrong bins.
+
+    tracer -- optional tracer elaborating RobotIO
+
+    """
+
+    # variables of RobotIO sampled by the monitor: local variables of RX()
+    # and TX(), and the signals of their enclosing scope
+    RX_LOCALS = ('state', 'key', 'length')
+    TX_LOCALS = ('state',)
+    SIGNALS = ('sspi_clk', 'sspi_cs', 'spi_cnt')
+
+    def __init__(self, tracer = None):
+        self.tracer = tracer
+        self.counts = dict((section, {}) for section, section_bins in bins())
+
+    def hit(self, section, label):
+        """ Count one hit of a bin """
+        self.counts[section][label] = self.counts[section].get(label, 0) + 1
+
+    @staticmethod
+    def find(instances, name):
+        """ Return the generator instance called name in a tree of instances, None if there is none """
+        if isinstance(instances, (list, tuple)):
+            for i in instances:
+                found = KLVCoverage.find(i, name)
+                if found is not None:
+                    return found
+        elif isinstance(instances, _Instantiator) and instances.genfunc.func_name == name:
+            return instances
+        return None
+
+    @staticmethod
+    def probe(top, name, local_names):
+        """ Return the generator instance called name in the instances top
+
+        Raise ValueError if there is no such instance or if its function
+        has no local variable of local_names: the monitor would not sample
+        what it counts.
+
+        """
+        inst = KLVCoverage.find(top, name)
+        if inst is None:
+            raise ValueError('KLVCoverage: RobotIO has no %s() instance' % name)
+        missing = set(local_names) - set(inst.genfunc.func_code.co_varnames)
+        if missing:
+            raise ValueError('KLVCoverage: %s() has no local variable %s' % (name, ', '.join(sorted(missing))))
+        return inst
+
+    @staticmethod
+    def closure(inst, names):
+        """ Return the variables names of the enclosing scope of a generator instance, by name
+
+        Raise ValueError if one of them is missing.
+
+        """
+        func = inst.genfunc
+        variables = dict(zip(func.func_code.co_freevars, [c.cell_contents for c in func.func_closure or []]))
+        missing = set(names) - set(variables)
+        if missing:
+            raise ValueError('KLVCoverage: %s() does not use %s' % (func.func_name, ', '.join(sorted(missing))))
+        return dict((n, variables[n]) for n in names)
+
+    @staticmethod
+    def sample(inst, name):
+        """ Return the current value of the local variable name of a generator instance """
+        frame = inst.gen.gi_frame
+        if frame is None or name not in frame.f_locals:
+            raise ValueError('KLVCoverage: %s() has no value of %s' % (inst.genfunc.func_name, name))
+        return frame.f_locals[name]
+
+    def __call__(self, dut, *args, **kwargs):
+        elaborate = partial(self.tracer, dut) if self.tracer is not None else dut
+        top = elaborate(*args, **kwargs)
+        rx, tx = self.probe(top, 'RX', self.RX_LOCALS), self.probe(top, 'TX', self.TX_LOCALS)
+        return top, self.monitor(rx, tx, self.closure(rx, self.SIGNALS))
+
+    def monitor(self, rx, tx, signals):
+        """ Sample the local variables of RX() and TX() after each SPI clock edge
+
+        signals -- signals of the enclosing scope of RX(), by name (see SIGNALS)
+
+        """
+        sspi_clk, sspi_cs, spi_cnt = signals['sspi_clk'], signals['sspi_cs'], signals['spi_cnt']
+        ws = spi_cnt.max
+
+        @instance
+        def KLVMonitor():
+            klv_state, spi_state = str(KLV_State.READ_KEY), str(SPI_State.IDLE)
+            while True:
+                yield sspi_clk.posedge, sspi_clk.negedge, sspi_cs.posedge
+                edge = 'cs' if sspi_cs == HIGH else 'rising' if sspi_clk == HIGH else 'falling'
+                selected, word = sspi_cs == LOW, spi_cnt == ws - 1
+                # let TX() and RX() react to the edge first
+                yield delay(0)
+
+                if edge == 'rising':
+                    state = str(self.sample(tx, 'state'))
+                    self.hit('spi_transitions', '%s > %s' % (spi_state, state))
+                    spi_state = state
+                elif edge == 'falling' and selected and word:
+                    state = str(self.sample(rx, 'state'))
+                    self.hit('klv_transitions', '%s > %s' % (klv_state, state))
+                    k, n = int(self.sample(rx, 'key')), int(self.sample(rx, 'length'))
+                    if klv_state == 'READ_KEY':
+                        self.hit('keys', key_label(k))
+                    elif klv_state in ('GET_READ_LENGTH', 'GET_WRITE_LENGTH'):
+                        self.hit('lengths', '%s %s' % (key_label(k), length_label(k, n)))
+                        if k in ADC_KEYS:
+                            self.hit('adc_reads', '%s %s' % (key_label(k), length_label(k, n)))
+                    klv_state = state
+                elif edge == 'cs':
+                    self.hit('frame_ends', klv_state)
+
+        return KLVMonitor
+
+def save(filename, runs):
+    """ Save the counts of runs, a dict of counts by run name, in a JSON file """
+    with open(filename, 'w') as f:
+        json.dump({'runs': runs}, f, indent = 1, sort_keys = True)
+
+def load(filenames):
+    """ Return the counts of the runs saved in JSON files, by run name """
+    runs = {}
+    for filename in filenames:
+        with open(filename) as f:
+            runs.update(json.load(f)['runs'])
+    return runs
+
+def merge(runs):
+    """ Return the sum of the counts of runs """
+    total = {}
+    for counts in runs.values():
+        for section, section_counts in counts.items():
+            for label, count in section_counts.items():
+                total.setdefault(section, {})
+                total[section][label] = total[section].get(label, 0) + count
+    return total
+
+def report(runs):
+    """ Return the coverage report of runs as a list of lines
+
+    The report gives the count of every bin and the uncovered ones for the
+    runs merged, then the number of bins hit by each run and the number of
+    bins that no other run hits: a run without such bins adds nothing to
+    the coverage of the others.
+
+    """
+    total = merge(runs)
+    lines = []
+    hit_bins = all_bins = 0
+    for section, section_bins in bins():
+        counts = total.get(section, {})
+        hit = [b for b in section_bins if counts.get(b)]
+        hit_bins += len(hit)
+        all_bins += len(section_bins)
+        lines.append('%s: %d/%d bins' % (section, len(hit), len(section_bins)))
+        for b in section_bins:
+            lines.append('  %-32s %s' % (b, counts.get(b, 'UNCOVERED')))
+    lines.append('total: %d/%d bins (%.1f%%)' % (hit_bins, all_bins, 100.0 * hit_bins / all_bins))
+
+    hits = dict((name, set((s, b) for s, c in counts.items() for b in c)) for name, counts in runs.items())
+    lines.append('runs: bins hit, bins hit by no other run')
+    for name in sorted(runs):
+        others = set().union(*[hits[n] for n in runs if n != name])
+        lines.append('  %-32s %6d %6d' % (name, len(hits[name]), len(hits[name] - others)))
+    return lines
+
+if __name__ == '__main__':
+    parser = OptionParser(usage = 'usage: %prog [options] file.json...',
+                          description = 'Merge the KLV coverage of runs saved with --coverage by '
+                                        'test_RobotIO.py and test_KLVStress.py, and report it.')
+    parser.add_option('-o', '--output', metavar = 'JSON',
+                      help = 'also save the runs of all files in JSON')
+    options, filenames = parser.parse_args()
+    if not filenames:
+        parser.error('no coverage file')
+
+    runs = load(filenames)
+    if options.output:
+        save(options.output, runs)
+    print '\n'.join(report(runs))
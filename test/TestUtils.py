@@ -1,6 +1,8 @@
-from myhdl import Signal, intbv, always, concat, delay, downrange
-from random import randrange
-from Robot.Utils.Constants import LOW, HIGH
+from myhdl import Signal, intbv, always, delay, downrange, join, now
+from Robot.Utils.Constants import LOW, HIGH, CLK_FREQ
+
+# simulation time of a clock period (see ClkGen)
+CLK_PERIOD = 2
 
 def ClkGen(clk):
     """ Test clock generator.
@@ -15,54 +17,148 @@ def ClkGen(clk):
         clk.next = not clk
     return genClk
 
-def random_write(n):
-    """ Generate and return a random intbv suitable for a write operation
+def to_bytes(value, length):
+    """ Return the length bytes of value, most significant first
 
-    n -- length of the written value in number of bytes
+    Negative values are sent in two's complement.
 
     """
-    data = intbv(randrange(0xFF))[8:] # key
-    data[7] = 1 # write
-    data = concat(data, intbv(n)[8:]) # length
-    for j in range(n):
-        data = concat(data, intbv(randrange(0xFF))[8:]) # value bytes
-    return data
+    value = int(value) & (2**(8*length) - 1)
+    return bytearray((value >> (8*i)) & 0xFF for i in downrange(length))
+
+def from_bytes(data, signed = False):
+    """ Return the value of data bytes, most significant first """
+    value = 0
+    for b in data:
+        value = (value << 8) | b
+    if signed and data and data[0] & 0x80:
+        value -= 2**(8*len(data))
+    return value
+
+def klv_write(key, length, value):
+    """ Return the bytes of a KLV command writing length bytes of value with key """
+    return bytearray([key, length]) + to_bytes(value, length)
+
+def klv_read(key, length):
+    """ Return the bytes of a KLV command reading length bytes with key
+
+    The slave answers the value in the last length bytes.
+
+    """
+    return bytearray([key, length]) + bytearray(length)
+
+class SPIMaster(object):
+    """ SPI master transactor: send bytes, get the bytes of the slave
+
+    Bytes are sent most significant bit first. A frame starts gap after the
+    previous one (or after the call), with ss_n going low, and its first
+    clock edge comes lead later. The default timing is the one of
+    spi_transfer in the attic tests.
+
+    sclk, mosi, miso, ss_n -- SPI signals (the test bench is the master)
+    mode -- SPI mode: 0 to 3 (CPOL and CPHA bits)
+    freq -- SPI clock frequency in Hz, in simulated time (see ClkGen)
+    gap -- simulation time between frames (ss_n high)
+    lead -- simulation time between ss_n going low and the first clock edge
+
+    """
+
+    def __init__(self, sclk, mosi, miso, ss_n, mode = 1, freq = CLK_FREQ // 10, gap = 50, lead = 10):
+        assert 0 <= mode <= 3, 'wrong SPI mode'
+        self.sclk = sclk
+        self.mosi = mosi
+        self.miso = miso
+        self.ss_n = ss_n
+        self.cpol = mode >> 1
+        self.cpha = mode & 1
+        # each delay unit simulates a half-period of the 25MHz clock
+        self.half_period = CLK_FREQ // freq
+        assert self.half_period >= 1, 'SPI clock too fast for the simulation'
+        self.gap = gap
+        self.lead = lead
+
+    def transfer(self, data, response = None):
+        """ Send the data bytes in one frame
+
+        response -- if not None, bytearray set to the bytes of the slave
+
+        """
+        leading, trailing = int(not self.cpol), self.cpol
+        received = bytearray()
+
+        # the clock is idle before ss_n goes low (a value set before the
+        # simulation starts would be lost)
+        self.sclk.next = self.cpol
+        yield delay(self.gap)
+        self.ss_n.next = LOW
+        yield delay(self.lead)
+        for b in bytearray(data):
+            r = 0
+            for i in downrange(8):
+                bit = (b >> i) & 1
+                if self.cpha:
+                    # data changes on the leading edge, sampled on the trailing one
+                    self.sclk.next = leading
+                    self.mosi.next = bit
+                    yield delay(self.half_period)
+                    self.sclk.next = trailing
+                    r = (r << 1) | int(self.miso.val)
+                    yield delay(self.half_period)
+                else:
+                    # data sampled on the leading edge, changes on the trailing one
+                    self.mosi.next = bit
+                    yield delay(self.half_period)
+                    self.sclk.next = leading
+                    r = (r << 1) | int(self.miso.val)
+                    yield delay(self.half_period)
+                    self.sclk.next = trailing
+            received.append(r)
+        self.ss_n.next = HIGH
 
-def random_read(n):
-    """ Generate and return a random intbv suitable for a read operation
+        if response is not None:
+            response[:] = received
 
-    n -- length of the expected value in number of bytes
+    def transfers(self, frames, responses = None):
+        """ Send frames back to back
+
+        responses -- if not None, list set to the bytearray of the slave for
+                     each frame
+
+        """
+        if responses is not None:
+            del responses[:]
+        for frame in frames:
+            response = bytearray()
+            yield self.transfer(frame, response)
+            if responses is not None:
+                responses.append(response)
+
+def measure_pwm(lines, measures):
+    """ Measure one period of each PWM line, all lines at once
+
+    The high time and the period are computed from the simulation time of
+    the rising and falling edges of each line, and not by sampling the
+    lines at each clock period.
+
+    lines -- list of PWM signals
+    measures -- list set to the (high time, period) of each line, in clock
+                periods (see ClkGen)
 
     """
-    data = intbv(randrange(0xFF))[8:] # key
-    data[7] = 0 # read
-    data = concat(data, intbv(n)[8:]) # length
-    for j in range(n):
-        data = concat(data, intbv(0)[8:]) # placeholder bytes for value
-    return data
-
-def spi_transfer(miso, mosi, sclk, ss_n, master_to_slave, slave_to_master):
-    """ Send data like an SPI master would """
-    yield delay(50)
-    ss_n.next = LOW
-    yield delay(10)
-    for i in downrange(len(master_to_slave)):
-        sclk.next = 1
-        mosi.next = master_to_slave[i]
-        yield delay(10)
-        sclk.next = 0
-        slave_to_master[i] = miso
-        yield delay(10)
-    ss_n.next = HIGH
-
-def count_high(line, clk, count):
-    """ Increment count while 'line' is high at clk.posedge """
-    yield clk.posedge
-    while line == HIGH:
-        count += 1
-        yield clk.posedge
-
-def quadrature_encode(steps, ch_a, ch_b):
+    measures[:] = [None] * len(lines)
+
+    def measure(i):
+        yield lines[i].posedge
+        rise = now()
+        yield lines[i].negedge
+        fall = now()
+        yield lines[i].posedge
+        measures[i] = ((fall - rise) // CLK_PERIOD, (now() - rise) // CLK_PERIOD)
+
+    yield join(*[measure(i) for i in range(len(lines))])
+
+def quadrature_encode(steps, ch_a, ch_b, step_delay = 10):
+    """ Move a quadrature encoder by steps ticks, one every step_delay """
     # - A rises before B:
     #  * if A is low, rise A
     #  * if A is already high, rise B
@@ -78,4 +174,54 @@ def quadrature_encode(steps, ch_a, ch_b):
             ch_a.next = LOW
         elif ch_a == LOW and ch_b == HIGH:
             ch_b.next = LOW
-        yield delay(10)
+        yield delay(step_delay)
+
+def fake_mcp3008(values, spi_clk, spi_ss_n, spi_miso, spi_mosi, channels = None):
+    """ Answer conversion requests like an MCP3008 would, forever
+
+    CPOL=1 and CPHA=1 here:
+     - the base value of the clock is HIGH
+     - data is captured on the clock's rising edge and data is
+       propagated on a falling edge.
+
+    values -- list of the 10-bit values of channels 0 to 7, read at each request
+    channels -- if not None, list where requested channels are appended
+
+    """
+    while True:
+        yield spi_ss_n.negedge
+
+        # like the real chip, deselecting it aborts the request: the
+        # driver does so when it is reset in the middle of a conversion
+        bits = None # request bits after the start bit, None before it
+        answer = [] # bits left to send, the null bit first
+        while spi_ss_n == LOW:
+            if bits is None:
+                # wait for start bit: first clock with mosi high
+                if spi_mosi == HIGH:
+                    bits = []
+                else:
+                    yield spi_clk.posedge, spi_ss_n.posedge
+                continue
+
+            if len(bits) < 5:
+                # single-ended bit, channel bits and one more bit for conversion
+                yield spi_clk.posedge, spi_ss_n.posedge
+                if spi_ss_n == LOW:
+                    bits.append(spi_mosi.val)
+                channel = int(bits[1]) << 2 | int(bits[2]) << 1 | int(bits[3]) if len(bits) >= 4 else None
+                if len(bits) == 4 and channels is not None:
+                    channels.append((channel, bits[0]))
+                if len(bits) == 5:
+                    # then MCP3008 sends a null bit and the 10-bit value
+                    value = intbv(values[channel])[10:]
+                    answer = [LOW] + [value[i] for i in downrange(len(value))]
+                continue
+
+            if not answer:
+                yield spi_ss_n.posedge
+                continue
+
+            yield spi_clk.negedge, spi_ss_n.posedge
+            if spi_ss_n == LOW:
+                spi_miso.next = answer.pop(0)
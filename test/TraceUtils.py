@@ -0,0 +1,170 @@
+import fnmatch
+import gzip
+import time
+
+from myhdl import EnumItemType, bin, delay, instance, now
+from myhdl import __version__ as myhdl_version
+from myhdl._extractHierarchy import _HierExtr
+
+def elaborate(dut, *args, **kwargs):
+    """ Elaborate dut like traceSignals does
+
+    This is the only use of the private hierarchy extractor of MyHDL (as of
+    0.8), shared by the tools that need the signals of the instances.
+
+    Return (top, hierarchy) where top is the instances of dut, and
+    hierarchy the list of instances, top first, each with its level, name,
+    sigdict (signals by name) and memdict (lists of signals by name).
+
+    """
+    h = _HierExtr(dut.func_name, dut, *args, **kwargs)
+    return h.top, h.hierarchy
+
+class SelectiveTracer(object):
+    """ Trace a subset of the signals of a design in a VCD file
+
+    Use it like traceSignals: tracer(dut, *args, **kwargs) elaborates dut
+    and returns its instances along with the tracer ones. Unlike
+    traceSignals, only the signals whose hierarchical name matches one of
+    the patterns are traced, only between start and end, and the changes
+    are streamed to the file as the simulation goes, gzip-compressed if the
+    file name ends with '.gz'. Call close() when the simulation is over.
+
+    filename -- VCD file name
+    patterns -- list of fnmatch patterns of hierarchical signal names, like
+                'RobotIO.Motor_inst_0.*' or 'RobotIO.sspi_*'
+    start -- simulation time of the first recorded change
+    end -- simulation time after which nothing is recorded (None: never)
+    timescale -- VCD timescale of a simulation time unit
+
+    """
+
+    def __init__(self, filename, patterns, start = 0, end = None, timescale = '1ns'):
+        self.filename = filename
+        self.patterns = patterns
+        self.start = start
+        self.end = end
+        self.timescale = timescale
+        self.f = None
+        self.time = None
+
+    def select(self, hierarchy):
+        """ Return the (scope, name, signal) of the selected signals """
+        selected = []
+        scope = []
+        for inst in hierarchy:
+            del scope[inst.level - 1:]
+            scope.append(inst.name)
+            signals = sorted(inst.sigdict.items())
+            for n in sorted(inst.memdict):
+                signals += [('%s(%d)' % (n, i), s) for i, s in enumerate(inst.memdict[n].mem)]
+            for n, s in signals:
+                path = '.'.join(scope + [n])
+                if any(fnmatch.fnmatchcase(path, p) for p in self.patterns):
+                    selected.append((tuple(scope), n, s))
+        return selected
+
+    def __call__(self, dut, *args, **kwargs):
+        top, hierarchy = elaborate(dut, *args, **kwargs)
+        selected = self.select(hierarchy)
+
+        # signals shared between instances get a single code
+        codes = {}
+        signals = []
+        for scope, n, s in selected:
+            if id(s) not in codes:
+                codes[id(s)] = self.code(len(codes))
+                signals.append(s)
+
+        if self.filename.endswith('.gz'):
+            self.f = gzip.open(self.filename, 'wb')
+        else:
+            self.f = open(self.filename, 'w')
+        self.write_header(selected, codes)
+
+        watchers = [self.watch(s, codes[id(s)]) for s in signals]
+        return top, self.dump(signals, codes), watchers
+
+    @staticmethod
+    def code(n):
+        """ Return the VCD identifier code of the nth traced signal """
+        code = ''
+        while True:
+            n, r = divmod(n, 94)
+            code = chr(33 + r) + code
+            if n == 0:
+                return code
+
+    @staticmethod
+    def value(s, code):
+        """ Return the VCD value change of signal s """
+        if isinstance(s.val, EnumItemType) or not s._nrbits:
+            return 's%s %s\n' % (s.val, code)
+        if s._nrbits == 1:
+            return '%d%s\n' % (int(s.val), code)
+        return 'b%s %s\n' % (bin(int(s.val) & (2**s._nrbits - 1), s._nrbits), code)
+
+    def write_header(self, selected, codes):
+        """ Write the VCD header and the scopes of the selected signals """
+        self.f.write('$date\n    %s\n$end\n' % time.asctime())
+        self.f.write('$version\n    MyHDL %s\n$end\n' % myhdl_version)
+        self.f.write('$timescale\n    %s\n$end\n' % self.timescale)
+        current = ()
+        for scope, n, s in selected:
+            common = 0
+            while common < min(len(scope), len(current)) and scope[common] == current[common]:
+                common += 1
+            for i in range(len(current) - common):
+                self.f.write('$upscope $end\n')
+            for name in scope[common:]:
+                self.f.write('$scope module %s $end\n' % name)
+            current = scope
+            if isinstance(s.val, EnumItemType) or not s._nrbits:
+                self.f.write('$var real 1 %s %s $end\n' % (codes[id(s)], n))
+            else:
+                self.f.write('$var reg %d %s %s $end\n' % (s._nrbits, codes[id(s)], n))
+        for i in range(len(current)):
+            self.f.write('$upscope $end\n')
+        self.f.write('$enddefinitions $end\n')
+
+    def recording(self):
+        """ Return True while changes are recorded """
+        return self.f is not None and (self.end is None or now() <= self.end)
+
+    def write(self, change):
+        """ Write a value change at the current simulation time """
+        if self.time != now():
+            self.time = now()
+            self.f.write('#%d\n' % self.time)
+        self.f.write(change)
+
+    def dump(self, signals, codes):
+        """ Dump the values of all signals at start """
+        @instance
+        def dumpvars():
+            if self.start > 0:
+                yield delay(self.start)
+            if self.recording():
+                self.write('$dumpvars\n')
+                for s in signals:
+                    self.f.write(self.value(s, codes[id(s)]))
+                self.f.write('$end\n')
+        return dumpvars
+
+    def watch(self, s, code):
+        """ Record the changes of signal s between start and end """
+        @instance
+        def watcher():
+            if self.start > 0:
+                yield delay(self.start)
+            while self.recording():
+                yield s
+                if self.recording():
+                    self.write(self.value(s, code))
+        return watcher
+
+    def close(self):
+        """ Flush and close the VCD file """
+        if self.f is not None:
+            self.f.close()
+            self.f = None
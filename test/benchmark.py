@@ -0,0 +1,236 @@
+import sys
+sys.path.append('../lib')
+
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import time
+
+from myhdl import Signal, Simulation, instance, intbv, __version__ as myhdl_version
+from optparse import OptionParser
+from Robot.Device.LED import LEDDriver
+from Robot.Device.MCP3008 import MCP3008Driver
+from Robot.Device.Motor import MotorBank, MotorDriver
+from Robot.Device.Odometer import OdometerReader
+from Robot.Device.Pose import PoseEstimator
+from Robot.Device.Servo import ServoBank, ServoDriver
+from Robot.Device.Velocity import VelocityEstimator
+from Robot.Utils.Constants import LOW, HIGH
+from TestUtils import CLK_PERIOD, ClkGen, fake_mcp3008, quadrature_encode
+
+# Each benchmark instanciates a module with a clock and a stimulus that
+# keeps it busy, and is simulated for a number of clk25 periods.
+
+def Encoder(a, b, step_delay = 10):
+    """ Move a quadrature encoder forwards forever """
+    while True:
+        yield quadrature_encode(1000, a, b, step_delay)
+
+def LEDBench():
+    led, clk, rst_n = Signal(LOW), Signal(LOW), Signal(HIGH)
+    return LEDDriver(led, clk, rst_n), ClkGen(clk)
+
+def MCP3008Bench():
+    ch = [Signal(intbv(0)[10:]) for i in range(8)]
+    spi_clk, spi_ss_n, spi_miso, spi_mosi = Signal(HIGH), Signal(HIGH), Signal(LOW), Signal(LOW)
+    clk, rst_n = Signal(LOW), Signal(HIGH)
+    return MCP3008Driver(*(ch + [spi_clk, spi_ss_n, spi_miso, spi_mosi, clk, rst_n]), scan_freq = 25000), \
+           fake_mcp3008(range(8), spi_clk, spi_ss_n, spi_miso, spi_mosi), ClkGen(clk)
+
+def MotorBench():
+    pwm, dir, en_n = Signal(LOW), Signal(LOW), Signal(LOW)
+    speed = Signal(intbv(300, min = -2**10, max = 2**10))
+    clk, rst_n = Signal(LOW), Signal(HIGH)
+    return MotorDriver(pwm, dir, en_n, clk, speed, rst_n, False), ClkGen(clk)
+
+def MotorBankBench():
+    pwms, dirs, en_ns = [[Signal(LOW) for i in range(8)] for j in range(3)]
+    speeds = [Signal(intbv(100 * i - 350, min = -2**10, max = 2**10)) for i in range(8)]
+    clk, rst_n = Signal(LOW), Signal(HIGH)
+    return MotorBank(pwms, dirs, en_ns, clk, speeds, rst_n, False), ClkGen(clk)
+
+def OdometerBench():
+    count = Signal(intbv(0, min = -2**15, max = 2**15))
+    a, b, clk, rst_n = Signal(LOW), Signal(LOW), Signal(LOW), Signal(HIGH)
+    return OdometerReader(count, a, b, clk, rst_n), Encoder(a, b), ClkGen(clk)
+
+def PoseBench():
+    x = Signal(intbv(0, min = -2**31, max = 2**31))
+    y = Signal(intbv(0, min = -2**31, max = 2**31))
+    theta = Signal(intbv(0)[32:])
+    left_count = Signal(intbv(0, min = -2**31, max = 2**31))
+    right_count = Signal(intbv(0, min = -2**31, max = 2**31))
+    angle_scale = Signal(intbv(2**16)[24:])
+    clear, clk, rst_n = Signal(LOW), Signal(LOW), Signal(HIGH)
+    a, b = Signal(LOW), Signal(LOW)
+    return PoseEstimator(x, y, theta, left_count, right_count, angle_scale, clear, clk, rst_n), \
+           OdometerReader(left_count, a, b, clk, rst_n), Encoder(a, b), ClkGen(clk)
+
+def ServoBench():
+    pwm, consign = Signal(LOW), Signal(intbv(37500)[16:])
+    clk, rst_n = Signal(LOW), Signal(HIGH)
+    return ServoDriver(pwm, clk, consign, rst_n, False), ClkGen(clk)
+
+def ServoBankBench():
+    pwms = [Signal(LOW) for i in range(8)]
+    consigns = [Signal(intbv(25000 + 5000 * i)[16:]) for i in range(8)]
+    clk, rst_n = Signal(LOW), Signal(HIGH)
+    return ServoBank(pwms, clk, consigns, rst_n, False), ClkGen(clk)
+
+def SpeedControlBench():
+    from test_SpeedControl import SHIFT, TestBench
+
+    def SpeedStimulus(speed, count, consign, gain_P, gain_I, gain_D, out_shift, max_I, accel, decel,
+                      strobe, clk, rst_n):
+        """ Set the gains and a consign, then let the loop drive the fake motor """
+        @instance
+        def SetConsign():
+            gain_P.next = 64
+            gain_I.next = 8
+            out_shift.next = 8
+            max_I.next = 2**20
+            accel.next = 2**SHIFT
+            decel.next = 2**SHIFT
+            consign.next = 20 * 2**SHIFT
+            yield clk.posedge
+
+        return SetConsign
+
+    return TestBench(SpeedStimulus)
+
+def VelocityBench():
+    ticks = Signal(intbv(0, min = -2**15, max = 2**15))
+    period = Signal(intbv(0, min = -2**11, max = 2**11))
+    count = Signal(intbv(0, min = -2**31, max = 2**31))
+    a, b, clk, rst_n = Signal(LOW), Signal(LOW), Signal(LOW), Signal(HIGH)
+    return OdometerReader(count, a, b, clk, rst_n), VelocityEstimator(ticks, period, count, clk, rst_n), \
+           Encoder(a, b), ClkGen(clk)
+
+def RobotIOBench():
+    from test_RobotIO import TestBench
+
+    def RobotIOStimulus(**s):
+        """ Answer the ADC scans and move the four odometers """
+        return fake_mcp3008(range(8), s['adc1_clk'], s['adc1_cs'], s['adc1_miso'], s['adc1_mosi']), \
+               [Encoder(s['rc%d_cha' % i], s['rc%d_chb' % i]) for i in range(1, 5)]
+
+    return TestBench(RobotIOStimulus)
+
+# (name, bench, number of clk25 periods to simulate)
+BENCHMARKS = [
+    ('LEDDriver', LEDBench, 100000),
+    ('MCP3008Driver', MCP3008Bench, 100000),
+    ('MotorDriver', MotorBench, 100000),
+    ('MotorBank', MotorBankBench, 20000),
+    ('OdometerReader', OdometerBench, 100000),
+    ('PoseEstimator', PoseBench, 20000),
+    ('ServoDriver', ServoBench, 100000),
+    ('ServoBank', ServoBankBench, 20000),
+    ('SpeedControl', SpeedControlBench, 100000),
+    ('VelocityEstimator', VelocityBench, 100000),
+    ('RobotIO', RobotIOBench, 5000),
+]
+
+def run_benchmark(args):
+    """ Run a benchmark in the current process
+
+    args -- (name, cycles) tuple
+    Return the results of the benchmark as a dict.
+
+    """
+    name, cycles = args
+    bench = dict((b[0], b[1]) for b in BENCHMARKS)[name]
+
+    start = time.time()
+    sim = Simulation(bench())
+    elaborated = time.time()
+    sim.run(cycles * CLK_PERIOD, quiet = 1)
+    seconds = time.time() - elaborated
+
+    return {
+        'cycles': cycles,
+        'elaboration_seconds': round(elaborated - start, 3),
+        'seconds': round(seconds, 3),
+        'cycles_per_second': round(cycles / seconds, 1),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+def run_benchmarks(names, scale):
+    """ Run benchmarks one after the other, each in a new process so that
+    its peak memory is its own, and return the results as a dict """
+    results = {}
+    for name, bench, cycles in BENCHMARKS:
+        if name in names:
+            pool = multiprocessing.Pool(1)
+            results[name] = pool.apply(run_benchmark, [(name, max(1, int(cycles * scale)))])
+            pool.close()
+            pool.join()
+            print '%-18s %10.1f cycles/s %8d kB' % (name, results[name]['cycles_per_second'],
+                                                  results[name]['peak_rss_kb'])
+    return results
+
+def git_commit():
+    """ Return the current commit, or None outside of a git repository """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr = subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    """ Print the changes from baseline, return the list of regressions
+
+    A benchmark regresses when it simulates more than threshold (a
+    fraction) slower than in baseline, or when it uses more than threshold
+    more memory.
+
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for key, worse in [('cycles_per_second', -1), ('peak_rss_kb', 1)]:
+            old, new = baseline[name][key], results[name][key]
+            change = float(new - old) / old
+            print '%-18s %-18s %12.1f -> %12.1f %+7.1f%%' % (name, key, old, new, 100 * change)
+            if change * worse > threshold:
+                regressions.append('%s %s' % (name, key))
+    return regressions
+
+if __name__ == '__main__':
+    parser = OptionParser(usage = 'usage: %prog [options] [benchmark...]',
+                          description = 'Measure the simulation speed and the peak memory of %s.' %
+                                        ', '.join(b[0] for b in BENCHMARKS))
+    parser.add_option('-o', '--output', default = 'benchmark.json',
+                      help = 'JSON file of the results (default: %default)')
+    parser.add_option('-c', '--compare', metavar = 'JSON',
+                      help = 'compare with the results of a previous run, fail on regressions')
+    parser.add_option('-t', '--threshold', type = 'float', default = 0.2,
+                      help = 'tolerated slow down or memory increase, as a fraction (default: %default)')
+    parser.add_option('-s', '--scale', type = 'float', default = 1.0,
+                      help = 'multiply the number of simulated cycles by SCALE (default: %default)')
+    options, names = parser.parse_args()
+    for name in names:
+        if name not in [b[0] for b in BENCHMARKS]:
+            parser.error('unknown benchmark: %s' % name)
+
+    report = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'myhdl': myhdl_version,
+        'benchmarks': run_benchmarks(names or [b[0] for b in BENCHMARKS], options.scale),
+    }
+    with open(options.output, 'w') as f:
+        json.dump(report, f, indent = 2, sort_keys = True)
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        print 'changes since', baseline['commit']
+        regressions = compare(report['benchmarks'], baseline['benchmarks'], options.threshold)
+        if regressions:
+            print 'FAILED (regressions: %s)' % ', '.join(regressions)
+            sys.exit(1)
+        print 'OK'
@@ -0,0 +1,68 @@
+import sys
+sys.path.append('../lib')
+
+import ast
+import inspect
+import re
+import textwrap
+import unittest
+
+from myhdl import Signal, instances, toVHDL
+from Robot.Main import _RobotIO, _body_lines, top_level
+from Robot.Utils.Config import DEFAULT, VARIANTS, ports
+
+# VHDL integers are 32-bit: larger constants must be written as bit strings
+INTEGER_RANGE = (-2**31, 2**31)
+
+def convert(config):
+    """ Return the VHDL of RobotIO for config (RobotIO.vhd is written in the current directory) """
+    signals = [Signal(bool(0)) for name in ports(config)]
+    toVHDL(top_level(config), *(signals + [True]))
+    with open('RobotIO.vhd') as f:
+        return f.read()
+
+class TestConversion(unittest.TestCase):
+
+    def checkIntegers(self, vhdl):
+        """ Check that the integer literals of vhdl fit in a VHDL integer """
+        for value in re.findall(r'to_(?:un)?signed\((-?\d+),', vhdl):
+            self.assertTrue(INTEGER_RANGE[0] <= int(value) < INTEGER_RANGE[1], 'integer literal %s out of range' % value)
+
+    def testVariants(self):
+        """ Convert RobotIO in each config and check its literals """
+        for name, config in sorted(VARIANTS.items()):
+            print 'converting', name
+            self.checkIntegers(convert(config))
+
+    def testTemplate(self):
+        """ Check that the module of a config has all the statements of _RobotIO """
+        def statements(lines):
+            """ Return the dump of each statement of lines """
+            return [ast.dump(node) for node in ast.parse(textwrap.dedent(''.join(lines))).body]
+
+        # the config and ports statements come first, then the statements
+        # of _RobotIO, then the names of the registers
+        body = _body_lines(top_level(DEFAULT))
+        expected = statements(_body_lines(_RobotIO))
+        self.assertEquals(statements(body)[2:2 + len(expected)], expected)
+        self.assertEquals(inspect.getsource(top_level(DEFAULT)).rstrip().splitlines()[-1], '    return instances()')
+
+        # a module without docstring keeps its first statement
+        def Module(a):
+            b = a
+            return instances()
+        self.assertEquals(statements(_body_lines(Module)), [ast.dump(ast.parse('b = a').body[0])])
+
+        # a module not ending with 'return instances()' alone is refused
+        def Module(a):
+            b = a
+            return instances(
+                )
+        self.assertRaises(ValueError, _body_lines, Module)
+        def Module(a):
+            return instances()
+            b = a
+        self.assertRaises(ValueError, _body_lines, Module)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import sys
+sys.path.append('../lib')
+
+import unittest
+
+from myhdl import Signal, instance, intbv
+from Robot.Main import KLV_State, SPI_State
+from Robot.Utils.Constants import LOW, HIGH
+from CoverageUtils import KLVCoverage
+from test_RobotIO import TestBench
+
+def FakeRobotIO(sspi_clk, sspi_cs):
+    """ TX() and RX() with the variables KLVCoverage samples """
+    spi_cnt = Signal(intbv(0, min = 0, max = 8))
+
+    @instance
+    def TX():
+        state = SPI_State.IDLE
+        while True:
+            yield sspi_clk.posedge
+
+    @instance
+    def RX():
+        state = KLV_State.READ_KEY
+        key = length = intbv(0)[8:]
+        while True:
+            yield sspi_clk.negedge, sspi_cs.posedge, spi_cnt
+
+    return TX, RX
+
+def NoKeyRobotIO(sspi_clk, sspi_cs):
+    """ RX() without the key nor the length """
+    spi_cnt = Signal(intbv(0, min = 0, max = 8))
+
+    @instance
+    def TX():
+        state = SPI_State.IDLE
+        while True:
+            yield sspi_clk.posedge
+
+    @instance
+    def RX():
+        state = KLV_State.READ_KEY
+        while True:
+            yield sspi_clk.negedge, sspi_cs.posedge, spi_cnt
+
+    return TX, RX
+
+def NoCounterRobotIO(sspi_clk, sspi_cs):
+    """ RX() without the chip select nor the SPI counter """
+
+    @instance
+    def TX():
+        state = SPI_State.IDLE
+        while True:
+            yield sspi_clk.posedge
+
+    @instance
+    def RX():
+        state = KLV_State.READ_KEY
+        key = length = intbv(0)[8:]
+        while True:
+            yield sspi_clk.negedge
+
+    return TX, RX
+
+class TestCoverageUtils(unittest.TestCase):
+
+    def testRobotIO(self):
+        """ RobotIO has the variables KLVCoverage samples """
+        TestBench(lambda **ports: [], tracer = KLVCoverage())
+
+    def testMissingVariables(self):
+        """ KLVCoverage fails when RX() loses a variable it samples """
+        coverage = KLVCoverage()
+        coverage(FakeRobotIO, Signal(LOW), Signal(HIGH))
+        with self.assertRaisesRegexp(ValueError, r'RX\(\) has no local variable key, length'):
+            coverage(NoKeyRobotIO, Signal(LOW), Signal(HIGH))
+        with self.assertRaisesRegexp(ValueError, r'RX\(\) does not use spi_cnt, sspi_cs'):
+            coverage(NoCounterRobotIO, Signal(LOW), Signal(HIGH))
+
+if __name__ == '__main__':
+    unittest.main()
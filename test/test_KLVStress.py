@@ -0,0 +1,400 @@
+import sys
+sys.path.append('../lib')
+
+import multiprocessing
+import random
+import time
+import traceback
+import unittest
+
+from functools import partial
+from myhdl import Simulation, StopSimulation, delay, now
+from optparse import OptionParser
+from StringIO import StringIO
+from Robot.Model import RobotIOModel, max_length
+from Robot.Utils.Config import DEFAULT, LARGE, SMALL, VARIANTS
+from Robot.Utils.RegisterMap import READ, WRITE, fields, key_fields, keys, length
+from Robot.Utils.Constants import CLK_FREQ
+from CoverageUtils import KLVCoverage, save
+from TestUtils import CLK_PERIOD, SPIMaster, fake_mcp3008, from_bytes
+from TraceUtils import elaborate
+from test_RobotIO import ADC_SCAN_FREQ, TestBench
+
+# number of frames sent by each seed of testStress
+STRESS_FRAMES = 25
+
+# number of frames sent to each config of testVariants
+VARIANT_FRAMES = 8
+
+# number of frames sent to the model alone by testSoak: the simulation of
+# RobotIO sends about one frame per second, the model some thousands
+SOAK_FRAMES = 20000
+
+# the frames of a soak are drawn by chunks, to keep few of them in memory
+SOAK_CHUNK = 1000
+
+# each SPI clock phase lasts 2 clk25 periods
+SPI_FREQ = CLK_FREQ // 4
+
+# simulation time for RobotIO to apply a write after the end of a frame
+SETTLE_TIME = 10
+
+# RobotIO latches the timestamp when it samples the last bit of the key,
+# up to half an SPI bit (in clk25 periods) before the model, which latches
+# it at the end of the key byte
+TIMESTAMP_SLACK = CLK_FREQ // SPI_FREQ // 2
+
+def written_registers(config):
+    """ Return the registers changed by writes in config: all fields written
+    by the master, except the strobes that only trigger an action """
+    return sorted(set(f.name for f in fields(config) if f.direction == WRITE) - set(['reset', 'pose_clear']))
+
+def timestamp_errors(mask, expected, received, slack = TIMESTAMP_SLACK):
+    """ Return the list of the differences between the expected and the received timestamps
+
+    Each run of bytes of mask (see KLVGenerator.command) holds the bytes of
+    a timestamp, or part of them when the command is cut or split between
+    frames: its value must be at most slack below the expected one, modulo
+    its width.
+
+    """
+    errors = []
+    i = 0
+    while i < len(mask):
+        if not mask[i]:
+            i += 1
+            continue
+        j = i
+        while j < len(mask) and mask[j]:
+            j += 1
+        value, expected_value = from_bytes(received[i:j]), from_bytes(expected[i:j])
+        if (expected_value - value) % 2**(8 * (j - i)) > slack:
+            errors.append('MISO bytes %d to %d: timestamp 0x%X, expected 0x%X or up to %d below' %
+                          (i, j - 1, value, expected_value, slack))
+        i = j
+    return errors
+
+class KLVGenerator(object):
+    """ Constrained-random stream of KLV commands, split into SPI frames
+
+    Everything is drawn from a random generator of its own, so that the
+    same seed always gives the same frames.
+
+    Kinds of commands, drawn with weights:
+    - read: a read key of the register map
+    - write: a write key of the register map, reset and pose clear included
+    - unknown: a key that is not in the register map
+    - empty: any key, with a zero length
+    - longest: any key, with the max length of the values of config
+    Read and write commands have the length of their key half of the time,
+    and a random length otherwise.
+
+    """
+
+    WEIGHTS = {'read': 8, 'write': 8, 'unknown': 2, 'empty': 1, 'longest': 1}
+
+    def __init__(self, seed, weights = WEIGHTS, config = DEFAULT):
+        self.random = random.Random(seed)
+        self.kinds = []
+        for kind in sorted(weights):
+            self.kinds += [kind] * weights[kind]
+        self.fields = fields(config)
+        self.max_length = max_length(config)
+        self.read_keys = keys(READ, self.fields)
+        self.write_keys = keys(WRITE, self.fields)
+        self.unknown_keys = sorted(set(range(256)) - set(self.read_keys) - set(self.write_keys))
+
+    def command(self):
+        """ Return a random KLV command and the mask of its bytes that depend on time """
+        r = self.random
+        kind = r.choice(self.kinds)
+        if kind == 'read':
+            k = r.choice(self.read_keys)
+        elif kind == 'write':
+            k = r.choice(self.write_keys)
+        elif kind == 'unknown':
+            k = r.choice(self.unknown_keys)
+        else:
+            k = r.randrange(256)
+
+        if kind == 'empty':
+            n = 0
+        elif kind == 'longest':
+            n = self.max_length
+        elif r.randrange(2) == 0 and key_fields(k, self.fields):
+            n = length(k, self.fields)
+        else:
+            n = r.randrange(self.max_length + 1)
+
+        # the slave ignores what the master sends while it answers a read
+        value = [r.randrange(256) for i in range(n)]
+
+        # timestamps: value bytes overlapping a timestamp field
+        mask = [False] * (2 + n)
+        if k < 0x80:
+            for f in key_fields(k, self.fields):
+                if f.name == 'timestamp':
+                    for j in range(n):
+                        bit = 8 * (n - 1 - j)
+                        if f.offset - 8 < bit < f.offset + f.width:
+                            mask[2 + j] = True
+        return [k, n] + value, mask
+
+    def frames(self, n):
+        """ Return n frames of random KLV commands and their masks
+
+        A frame holds one or more commands. Commands are sometimes split
+        between two frames, and some frames are empty.
+
+        """
+        r = self.random
+        frames = []
+        frame, mask = [], []
+        while len(frames) < n:
+            if r.randrange(50) == 0:
+                frames.append(([], []))
+                continue
+            klv, klv_mask = self.command()
+            frame += klv
+            mask += klv_mask
+            if r.randrange(4) == 0:
+                cut = r.randrange(1, len(frame) + 1)
+                frames.append((frame[:cut], mask[:cut]))
+                frame, mask = frame[cut:], mask[cut:]
+            elif r.randrange(2) == 0:
+                frames.append((frame, mask))
+                frame, mask = [], []
+        return frames
+
+class RegisterProbe(object):
+    """ Elaborate RobotIO and keep its internal signals, by name (see TestBench) """
+
+    def __call__(self, dut, *args, **kwargs):
+        top, hierarchy = elaborate(dut, *args, **kwargs)
+        self.signals = hierarchy[0].sigdict
+        return top
+
+class Scoreboard(object):
+    """ Predict what RobotIO does with each frame with RobotIOModel
+
+    model -- RobotIOModel with the same inputs as RobotIO
+    signals -- internal signals of RobotIO, by name (see RegisterProbe)
+    leds -- green and yellow LED lines (low when on)
+
+    """
+
+    def __init__(self, model, signals, leds):
+        self.model = model
+        self.signals = signals
+        self.leds = leds
+        self.written_registers = written_registers(model.config)
+
+    def expect(self, frame, start):
+        """ Return the bytes RobotIO sends with frame, starting at start (simulation time) """
+        # the first bit is sent 30 clk25 periods after the transfer starts
+        # (see SPIMaster gap and lead)
+        self.model.advance(start // CLK_PERIOD + 30 - self.model.time)
+        return self.model.transfer(frame)
+
+    def mismatches(self, frame, mask, expected, received):
+        """ Return the list of the differences between the expected and the received bytes, and
+        between the registers of the model and the ones of RobotIO """
+        errors = timestamp_errors(mask, expected, received)
+        for i, b in enumerate(expected):
+            if not mask[i] and received[i] != b:
+                errors.append('MISO byte %d: 0x%02X, expected 0x%02X' % (i, received[i], b))
+        for name in self.written_registers:
+            if int(self.signals[name].val) != self.model.registers[name]:
+                errors.append('%s: %d, expected %d' % (name, self.signals[name].val, self.model.registers[name]))
+        leds = tuple(not line for line in self.leds)
+        if leds != self.model.leds():
+            errors.append('green and yellow LEDs: %s, expected %s' % (leds, self.model.leds()))
+        return errors
+
+class TestKLVStress(unittest.TestCase):
+
+    def RobotIOTester(self, seed, frames, probe, config, **ports):
+
+        generator = KLVGenerator(seed, config = config)
+        model = RobotIOModel(adc_scan_freq = ADC_SCAN_FREQ, spi_freq = SPI_FREQ, config = config)
+        scoreboard = Scoreboard(model, probe.signals, [ports['led_green_n'], ports['led_yellow_n']])
+        spi = SPIMaster(ports['sspi_clk'], ports['sspi_mosi'], ports['sspi_miso'], ports['sspi_cs'], freq = SPI_FREQ)
+        adc1_clk, adc1_cs, adc1_miso, adc1_mosi = [ports['adc1_' + n] for n in ('clk', 'cs', 'miso', 'mosi')]
+
+        # same inputs for RobotIO and the model
+        ext_lines = [[ports['ext%d_%d' % (i, j)] for j in range(8)] for i in range(1, config.ext_ports + 1)]
+        for i, lines in enumerate(ext_lines):
+            model.ext_inputs[i] = generator.random.randrange(256)
+            for j, line in enumerate(lines):
+                line.next = (model.ext_inputs[i] >> j) & 1
+
+        model.adc_inputs = [generator.random.randrange(2**10) for i in range(8)]
+        channels = []
+        yield fake_mcp3008(model.adc_inputs, adc1_clk, adc1_cs, adc1_miso, adc1_mosi, channels), delay(0)
+
+        # wait for a whole scan so that the ADC values do not depend on time
+        while len(channels) < 9:
+            yield adc1_cs.posedge
+
+        for i, (frame, mask) in enumerate(generator.frames(frames)):
+            expected = scoreboard.expect(frame, now())
+            received = bytearray()
+            yield spi.transfer(frame, received)
+            # let the last write cross from the SPI clock to clk25
+            yield delay(SETTLE_TIME)
+            errors = scoreboard.mismatches(frame, mask, expected, received)
+            self.assertFalse(errors, 'seed %d, frame %d %s:\n%s' %
+                             (seed, i, ['0x%02X' % b for b in frame], '\n'.join(errors)))
+
+        raise StopSimulation()
+
+    def stress(self, seed, frames, coverage = False, config = DEFAULT):
+        """ Send frames random frames drawn from seed to RobotIO and check them with the scoreboard
+
+        Return the KLV coverage of the simulation (see KLVCoverage) if
+        coverage is True, else None. The coverage is only meaningful for the
+        register map of the robot.
+
+        config -- channel counts of RobotIO and of the model (see Robot.Utils.Config)
+
+        """
+        probe = RegisterProbe()
+        tester = partial(self.RobotIOTester, seed, frames, probe, config)
+        klv_coverage = KLVCoverage(probe) if coverage else None
+        sim = Simulation(TestBench(tester, tracer = klv_coverage or probe, config = config))
+        sim.run()
+        return klv_coverage.counts if coverage else None
+
+    def soak(self, seed, frames, config = DEFAULT):
+        """ Send frames random frames drawn from seed to RobotIOModel alone and check its answers
+
+        The simulation of RobotIO is far too slow for millions of frames:
+        the model gets them instead, and must answer every byte and keep
+        every register within its field. Time advances by a random number
+        of clk25 periods between frames.
+
+        """
+        generator = KLVGenerator(seed, config = config)
+        model = RobotIOModel(adc_scan_freq = ADC_SCAN_FREQ, spi_freq = SPI_FREQ, config = config)
+        bounds = {}
+        for f in fields(config):
+            bounds[f.name] = (-2**(f.width - 1), 2**(f.width - 1)) if f.signed else (0, 2**f.width)
+
+        sent = 0
+        while sent < frames:
+            for frame, mask in generator.frames(min(SOAK_CHUNK, frames - sent)):
+                model.advance(generator.random.randrange(100))
+                answer = model.transfer(frame)
+                errors = []
+                if len(answer) != len(frame):
+                    errors.append('%d MISO bytes, expected %d' % (len(answer), len(frame)))
+                for name, (low, high) in bounds.items():
+                    if not low <= model.registers[name] < high:
+                        errors.append('%s: %d, not in [%d, %d[' % (name, model.registers[name], low, high))
+                self.assertFalse(errors, 'seed %d, frame %d %s:\n%s' %
+                                 (seed, sent, ['0x%02X' % b for b in frame], '\n'.join(errors)))
+                sent += 1
+
+    def testStress(self):
+        """ Send random frames to RobotIO and check them with the scoreboard """
+        seed = random.randrange(2**31)
+        print 'seed', seed
+        self.stress(seed, STRESS_FRAMES)
+
+    def testVariants(self):
+        """ Send random frames to the large and small RobotIO and check them with the scoreboard """
+        seed = random.randrange(2**31)
+        print 'seed', seed
+        for config in [LARGE, SMALL]:
+            self.stress(seed, VARIANT_FRAMES, config = config)
+
+    def testSoak(self):
+        """ Send many random frames to the model of the robot and of the variants """
+        seed = random.randrange(2**31)
+        print 'seed', seed
+        for config in [DEFAULT, LARGE, SMALL]:
+            self.soak(seed, SOAK_FRAMES, config = config)
+
+def run_seed(args):
+    """ Run the soak and the stress test of a seed in the current process
+
+    args -- (seed, frames, soak, coverage, config) tuple: frames sent to
+            RobotIO and soak frames sent to the model alone (see
+            TestKLVStress.soak), none when 0, coverage is True to record the
+            KLV coverage of the seed
+    Return (seed, error, duration, counts) where error is None or the
+    traceback of the failure and counts is None or the KLV coverage of the
+    seed (see KLVCoverage).
+
+    """
+    seed, frames, soak, coverage, config = args
+    counts = None
+    stdout, sys.stdout = sys.stdout, StringIO()
+    start = time.time()
+    try:
+        if soak:
+            TestKLVStress('soak').soak(seed, soak, config)
+        if frames:
+            counts = TestKLVStress('stress').stress(seed, frames, coverage, config)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        sys.stdout = stdout
+    return seed, error, time.time() - start, counts
+
+if __name__ == '__main__':
+    parser = OptionParser(usage = 'usage: %prog [options] [seed...]',
+                          description = 'Send random KLV frames to RobotIO, one simulation per seed, '
+                                        'and check every MISO byte and register with RobotIOModel. '
+                                        'The simulation of RobotIO sends about one frame per second: '
+                                        'each seed also soaks the model alone with many more frames '
+                                        '(some thousands per second), millions in all with enough '
+                                        'seeds. '
+                                        'Give the seed of a failure to replay it.')
+    parser.add_option('-n', '--seeds', type = 'int', default = multiprocessing.cpu_count(),
+                      help = 'number of random seeds when none is given (default: number of CPUs)')
+    parser.add_option('-f', '--frames', type = 'int', default = STRESS_FRAMES,
+                      help = 'number of frames per seed sent to RobotIO, none when 0 (default: %default)')
+    parser.add_option('-s', '--soak', type = 'int', default = SOAK_FRAMES,
+                      help = 'number of frames per seed sent to the model alone, none when 0 (default: %default)')
+    parser.add_option('-j', '--jobs', type = 'int', default = multiprocessing.cpu_count(),
+                      help = 'number of processes (default: number of CPUs)')
+    parser.add_option('-c', '--config', type = 'choice', choices = sorted(VARIANTS), default = 'default',
+                      help = 'channel counts of RobotIO: %s (default: %%default, see '
+                             'Robot.Utils.Config)' % ', '.join(sorted(VARIANTS)))
+    parser.add_option('--coverage', metavar = 'JSON',
+                      help = 'save the KLV coverage of each seed in JSON (see CoverageUtils.py)')
+    options, args = parser.parse_args()
+    if options.coverage and options.config != 'default':
+        parser.error('the KLV coverage is only recorded for the default config')
+    if options.coverage and not options.frames:
+        parser.error('the KLV coverage is only recorded for the frames sent to RobotIO')
+    seeds = [int(a) for a in args] or [random.randrange(2**31) for i in range(options.seeds)]
+
+    start = time.time()
+    pool = multiprocessing.Pool(options.jobs)
+    failures = 0
+    runs = {}
+    config = VARIANTS[options.config]
+    tasks = [(seed, options.frames, options.soak, options.coverage is not None, config) for seed in seeds]
+    for seed, error, duration, counts in pool.imap_unordered(run_seed, tasks):
+        runs['KLVStress %d' % seed] = counts
+        print '%-12d %-4s %6.1fs' % (seed, 'FAIL' if error else 'ok', duration)
+        if error:
+            print error
+            failures += 1
+    pool.close()
+    pool.join()
+
+    print '-' * 70
+    print 'Sent %d frames to RobotIO and %d to the model with %d seeds in %.1fs' % \
+          (options.frames * len(seeds), options.soak * len(seeds), len(seeds), time.time() - start)
+    if options.coverage:
+        save(options.coverage, runs)
+        print 'KLV coverage saved in', options.coverage
+    if failures:
+        print 'FAILED (failures=%d), replay with: python test_KLVStress.py -c %s -f %d -s %d SEED' % \
+              (failures, options.config, options.frames, options.soak)
+        sys.exit(1)
+    print 'OK'
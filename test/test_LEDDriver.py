@@ -0,0 +1,56 @@
+import sys
+sys.path.append('../lib')
+
+import unittest
+
+from myhdl import Signal, Simulation, StopSimulation, now
+from Robot.Device.LED import LEDDriver
+from Robot.Utils.Constants import LOW, HIGH, CLK_FREQ
+from TestUtils import ClkGen, CLK_PERIOD
+
+NR_TOGGLES = 4
+
+# the LED toggles every 381 clk periods instead of every second with this
+# time scale
+TIME_SCALE = 2**16
+
+def TestBench(LEDTester, time_scale):
+    """ Instanciate modules and wire things up.
+    LEDTester -- test module to instanciate with LEDDriver and ClkGen
+    time_scale -- time scale of LEDDriver
+    """
+
+    # create signals with default values
+    led = Signal(LOW)
+    clk = Signal(LOW)
+    rst_n = Signal(HIGH)
+
+    # instanciate modules
+    LEDDriver_inst = LEDDriver(led, clk, rst_n, time_scale)
+    LEDTester_inst = LEDTester(led, clk, rst_n, time_scale)
+    ClkGen_inst = ClkGen(clk)
+
+    return LEDDriver_inst, LEDTester_inst, ClkGen_inst
+
+class TestLEDDriver(unittest.TestCase):
+
+    def LEDTester(self, led, clk, rst_n, time_scale):
+        # the LED toggles every second, divided by time_scale (rounded down)
+        period = CLK_FREQ // time_scale
+
+        yield led.posedge
+        previous = now()
+        for i in range(NR_TOGGLES):
+            yield led.posedge, led.negedge
+            self.assertEquals((now() - previous) // CLK_PERIOD, period)
+            previous = now()
+
+        raise StopSimulation()
+
+    def testLEDDriverTimeScale(self):
+        """ Test LEDDriver with a time scale """
+        sim = Simulation(TestBench(self.LEDTester, TIME_SCALE))
+        sim.run()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import sys
+sys.path.append('../lib')
+
+import unittest
+
+from myhdl import Signal, Simulation, StopSimulation, delay, intbv
+from random import randrange
+from Robot.Device.MCP3008 import MCP3008Driver
+from Robot.Utils.Constants import LOW, HIGH
+from TestUtils import ClkGen, fake_mcp3008
+
+NR_SCANS = 3
+
+# scan as fast as possible to keep the simulation short
+SCAN_FREQ = 25000
+
+def TestBench(MCP3008Tester):
+    """ Instanciate modules and wire things up.
+    MCP3008Tester -- test module to instanciate with MCP3008Driver and ClkGen
+    """
+
+    # create signals with default values
+    chs = [Signal(intbv(0)[10:]) for i in range(8)]
+    spi_clk = Signal(HIGH)
+    spi_ss_n = Signal(HIGH)
+    spi_miso = Signal(LOW)
+    spi_mosi = Signal(LOW)
+    clk = Signal(LOW)
+    rst_n = Signal(HIGH)
+
+    # instanciate modules
+    MCP3008Driver_inst = MCP3008Driver(chs[0], chs[1], chs[2], chs[3], chs[4], chs[5], chs[6], chs[7],
+                                       spi_clk, spi_ss_n, spi_miso, spi_mosi,
+                                       clk, rst_n, scan_freq = SCAN_FREQ)
+    MCP3008Tester_inst = MCP3008Tester(chs, spi_clk, spi_ss_n, spi_miso, spi_mosi, clk, rst_n)
+    ClkGen_inst = ClkGen(clk)
+
+    return MCP3008Driver_inst, MCP3008Tester_inst, ClkGen_inst
+
+class TestMCP3008Driver(unittest.TestCase):
+
+    def MCP3008Tester(self, chs, spi_clk, spi_ss_n, spi_miso, spi_mosi, clk, rst_n):
+        values = [0] * 8
+        channels = []
+
+        # fork: the fake MCP3008 answers in the background
+        yield fake_mcp3008(values, spi_clk, spi_ss_n, spi_miso, spi_mosi, channels), delay(0)
+
+        for i in range(NR_SCANS):
+            for j in range(8):
+                values[j] = randrange(2**10)
+            print 'ADC values:', values
+
+            # wait for the end of the current scan, then for a whole scan
+            while len(channels) == 0 or channels[-1][0] != 7:
+                yield spi_ss_n.posedge
+            del channels[:]
+            for j in range(8):
+                yield spi_ss_n.posedge
+            yield delay(1)
+
+            # channels are converted in order, in single-ended mode
+            self.assertEquals(channels, [(j, HIGH) for j in range(8)])
+            for j in range(8):
+                self.assertEquals(chs[j], values[j])
+
+        print 'DONE'
+
+        raise StopSimulation()
+
+    def testMCP3008Driver(self):
+        """ Test MCP3008Driver """
+        sim = Simulation(TestBench(self.MCP3008Tester))
+        sim.run()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,18 +3,25 @@ sys.path.append('../lib')
 
 import unittest
 
-from myhdl import Signal, Simulation, StopSimulation, delay, intbv, join
+from myhdl import Signal, Simulation, StopSimulation, delay, intbv, join, now
 from random import randrange
-from Robot.Device.Motor import MotorDriver
+from Robot.Device.Motor import MotorBank, MotorDriver
 from Robot.Utils.Constants import LOW, HIGH
-from TestUtils import ClkGen, count_high
+from TestUtils import CLK_PERIOD, ClkGen, measure_pwm
 
 NR_TESTS = 5
 NR_PERIODS_PER_TEST = 5
 
-def TestBench(MotorTester):
+# a period lasts 64 clk periods instead of 1024 with this time scale
+TIME_SCALE = 16
+
+# number of motors of the tested MotorBank
+NR_MOTORS = 4
+
+def TestBench(MotorTester, time_scale = 1):
     """ Instanciate modules and wire things up.
     MotorTester -- test module to instanciate with MotorDriver and ClkGen
+    time_scale -- time scale of MotorDriver
     """
 
     # create signals with default values
@@ -26,26 +33,54 @@ def TestBench(MotorTester):
     rst_n = Signal(HIGH)
 
     # instanciate modules
-    MotorDriver_inst = MotorDriver(pwm, dir, en_n, clk, speed, rst_n, False)
-    MotorTester_inst = MotorTester(pwm, dir, en_n, clk, speed, rst_n)
+    MotorDriver_inst = MotorDriver(pwm, dir, en_n, clk, speed, rst_n, False, time_scale)
+    MotorTester_inst = MotorTester(pwm, dir, en_n, clk, speed, rst_n, time_scale)
     ClkGen_inst = ClkGen(clk)
 
     return MotorDriver_inst, MotorTester_inst, ClkGen_inst
 
+def BankTestBench(BankTester, time_scale):
+    """ Instanciate modules and wire things up.
+    BankTester -- test module to instanciate with MotorBank and ClkGen
+    time_scale -- time scale of MotorBank
+    """
+
+    # create signals with default values
+    pwms = [Signal(LOW) for i in range(NR_MOTORS)]
+    dirs = [Signal(LOW) for i in range(NR_MOTORS)]
+    en_ns = [Signal(HIGH) for i in range(NR_MOTORS)]
+    clk = Signal(LOW)
+    speeds = [Signal(intbv(0, min = -2**10, max = 2**10)) for i in range(NR_MOTORS)]
+    resolutions = [Signal(intbv(10)[4:]) for i in range(NR_MOTORS)]
+    prescalers = [Signal(intbv(0)[3:]) for i in range(NR_MOTORS)]
+    rst_n = Signal(HIGH)
+
+    # instanciate modules
+    MotorBank_inst = MotorBank(pwms, dirs, en_ns, clk, speeds, rst_n, False, time_scale,
+                               resolutions = resolutions, prescalers = prescalers)
+    BankTester_inst = BankTester(pwms, dirs, clk, speeds, resolutions, prescalers, time_scale)
+    ClkGen_inst = ClkGen(clk)
+
+    return MotorBank_inst, BankTester_inst, ClkGen_inst
+
 class TestMotorDriver(unittest.TestCase):
 
-    def MotorTester(self, pwm, dir, en_n, clk, speed, rst_n):
+    def MotorTester(self, pwm, dir, en_n, clk, speed, rst_n, time_scale):
         def stimulus(dcl):
             speed.next = dcl
 
         def check(dcl):
-            count = intbv(0)
-            yield count_high(pwm, clk, count)
-            self.assertEquals(count, min(abs(speed), speed.max - 1))
+            measures = []
+            yield measure_pwm([pwm], measures)
+            # high time and period are divided by time_scale, rounded down
+            self.assertEquals(measures, [(min(abs(speed), speed.max - 1) // time_scale, 1024 // time_scale)])
 
         for i in range(NR_TESTS):
             dcl = randrange(-2**10, 2**10)
-            print 'ask for a PWM with duty cycle:', dcl, '/ 1024'
+            if abs(dcl) < time_scale:
+                # the PWM would stay low: there would be no edge to measure
+                dcl = time_scale
+            print 'ask for a PWM with duty cycle:', dcl, '/ 1024', '(time scale: %d)' % time_scale
 
             # First period is not correct as the counter had already started
             # before the speed was given. Start testing at the second period
@@ -53,8 +88,7 @@ class TestMotorDriver(unittest.TestCase):
             yield pwm.negedge # wait for end of PWM waveform of the first period
 
             for j in range(NR_PERIODS_PER_TEST - 1):
-                yield pwm.posedge # wait for the beginning of the period
-                yield check(dcl) # check the number of 'high's in this period
+                yield check(dcl) # check the high time and period
 
         print 'DONE'
 
@@ -65,5 +99,79 @@ class TestMotorDriver(unittest.TestCase):
         sim = Simulation(TestBench(self.MotorTester))
         sim.run()
 
+    def testMotorDriverTimeScale(self):
+        """ Test MotorDriver with a time scale """
+        sim = Simulation(TestBench(self.MotorTester, TIME_SCALE))
+        sim.run()
+
+    def BankTester(self, pwms, dirs, clk, speeds, resolutions, prescalers, time_scale):
+        period = 1024 // time_scale
+        dcls = [randrange(time_scale, 2**10) * (-1)**i for i in range(NR_MOTORS)]
+        print 'ask for PWMs with duty cycles:', dcls, '/ 1024', '(time scale: %d)' % time_scale
+        for speed, dcl in zip(speeds, dcls):
+            speed.next = dcl
+
+        # the new speeds are applied at the start of the next period
+        measures = []
+        yield measure_pwm(pwms, measures)
+        yield measure_pwm(pwms, measures)
+        self.assertEquals(measures, [(min(abs(dcl), 1023) // time_scale, period) for dcl in dcls])
+        self.assertEquals([int(d) for d in dirs], [dcl >= 0 for dcl in dcls])
+
+        # the periods are spread evenly: motor i rises i / NR_MOTORS of a
+        # period after motor 0
+        rises = [None] * NR_MOTORS
+        def rise(i):
+            yield pwms[i].posedge
+            rises[i] = now() // CLK_PERIOD
+        yield pwms[0].negedge
+        yield join(*[rise(i) for i in range(NR_MOTORS)])
+        self.assertEquals([(r - rises[0]) % period for r in rises],
+                          [period * i // NR_MOTORS for i in range(NR_MOTORS)])
+
+        print 'DONE'
+
+        raise StopSimulation()
+
+    def testMotorBank(self):
+        """ Test MotorBank with a time scale, all motors with their own speed and phase """
+        sim = Simulation(BankTestBench(self.BankTester, TIME_SCALE))
+        sim.run()
+
+    def PeriodTester(self, pwms, dirs, clk, speeds, resolutions, prescalers, time_scale):
+        # motor i: 10 - i bits of resolution, and ticks of 2**(2 * i) clk
+        # periods, that is periods of 2**(10 + i) clk periods
+        settings = [(10 - i, 2 * i) for i in range(NR_MOTORS)]
+        for test in range(2):
+            dcls = [randrange(time_scale * 2**NR_MOTORS, 2**10) * (-1)**i for i in range(NR_MOTORS)]
+            print 'ask for PWMs with duty cycles:', dcls, '/ 1024', 'and (resolution, prescaler):', settings
+            for i, (resolution, prescaler) in enumerate(settings):
+                speeds[i].next = dcls[i]
+                resolutions[i].next = resolution
+                prescalers[i].next = prescaler
+
+            # the new speeds, resolutions and prescalers are applied at the
+            # start of both the current and the requested periods, the
+            # speeds are scaled to the periods by dropping their low bits
+            yield delay(2**(10 + NR_MOTORS - 1) // time_scale * CLK_PERIOD)
+            measures = []
+            yield measure_pwm(pwms, measures)
+            self.assertEquals(measures, [((min(abs(dcl), 1023) >> (10 - resolution) << prescaler) // time_scale,
+                                          2**(resolution + prescaler) // time_scale)
+                                         for dcl, (resolution, prescaler) in zip(dcls, settings)])
+            self.assertEquals([int(d) for d in dirs], [dcl >= 0 for dcl in dcls])
+
+            # then shorter periods, with the same resolutions
+            settings = [(10 - i, 0) for i in range(NR_MOTORS)]
+
+        print 'DONE'
+
+        raise StopSimulation()
+
+    def testMotorBankPeriods(self):
+        """ Test MotorBank with a time scale, all motors with their own resolution and prescaler """
+        sim = Simulation(BankTestBench(self.PeriodTester, TIME_SCALE))
+        sim.run()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,111 @@
+import sys
+sys.path.append('../lib')
+
+import unittest
+
+from math import cos, pi, sin
+from myhdl import Signal, Simulation, StopSimulation, delay, intbv
+from Robot.Device.Pose import PoseEstimator
+from Robot.Utils.Constants import LOW, HIGH
+from TestUtils import ClkGen
+
+# a tick of difference between the odometers turns the robot by 2**22, so
+# that the robot turns by a quarter of a turn every 256 ticks of difference
+ANGLE_SCALE = 2**22
+
+def TestBench(PoseTester):
+    """ Instanciate modules and wire things up.
+    PoseTester -- test module to instanciate with PoseEstimator and ClkGen
+    """
+
+    x = Signal(intbv(0, min = -2**31, max = 2**31))
+    y = Signal(intbv(0, min = -2**31, max = 2**31))
+    theta = Signal(intbv(0)[32:])
+    left_count = Signal(intbv(0, min = -2**31, max = 2**31))
+    right_count = Signal(intbv(0, min = -2**31, max = 2**31))
+    angle_scale = Signal(intbv(ANGLE_SCALE)[24:])
+    clear = Signal(LOW)
+    clk = Signal(LOW)
+    rst_n = Signal(HIGH)
+
+    # instanciate modules
+    PoseEstimator_inst = PoseEstimator(x, y, theta, left_count, right_count, angle_scale, clear, clk, rst_n)
+    PoseTester_inst = PoseTester(x, y, theta, left_count, right_count, clear, clk, rst_n)
+    ClkGen_inst = ClkGen(clk)
+
+    return PoseEstimator_inst, PoseTester_inst, ClkGen_inst
+
+class TestPoseEstimator(unittest.TestCase):
+
+    def PoseTester(self, x, y, theta, left_count, right_count, clear, clk, rst_n):
+
+        # expected pose: x and y in ticks, theta in turns
+        pose = [0.0, 0.0, 0.0]
+
+        def move(left_steps, right_steps, step_delay = 80):
+            """ Move the odometers, one tick every step_delay (both at once while possible) """
+            print 'move left', left_steps, 'right', right_steps, '...',
+            left_dir = 1 if left_steps >= 0 else -1
+            right_dir = 1 if right_steps >= 0 else -1
+            for i in range(max(abs(left_steps), abs(right_steps))):
+                left_move = left_dir if i < abs(left_steps) else 0
+                right_move = right_dir if i < abs(right_steps) else 0
+                left_count.next = left_count + left_move
+                right_count.next = right_count + right_move
+                pose[0] += (left_move + right_move) / 2.0 * cos(2 * pi * pose[2])
+                pose[1] += (left_move + right_move) / 2.0 * sin(2 * pi * pose[2])
+                pose[2] += (right_move - left_move) * ANGLE_SCALE / 2.0**32
+                yield delay(step_delay)
+            # wait for the last update
+            yield delay(100)
+            print 'done'
+
+        def check_pose():
+            """ Compare the pose to the expected one """
+            self.assertTrue(abs(x / 256.0 - pose[0]) < 0.5)
+            self.assertTrue(abs(y / 256.0 - pose[1]) < 0.5)
+            self.assertTrue(abs(((theta / 2.0**32 - pose[2] + 0.5) % 1) - 0.5) < 0.001)
+
+        check_pose()
+
+        # forward, backward
+        yield move(100, 100)
+        check_pose()
+        self.assertEquals(x, 100 * 256)
+        yield move(-40, -40)
+        check_pose()
+
+        # turn left in place by a quarter of a turn, then forward
+        yield move(-128, 128)
+        check_pose()
+        self.assertEquals(theta, 2**30)
+        yield move(50, 50)
+        check_pose()
+
+        # curve
+        yield move(200, 328)
+        check_pose()
+
+        # full turn to the right, fast: several ticks per update
+        yield move(1024, -1024, 10)
+        check_pose()
+
+        # clear
+        clear.next = HIGH
+        yield clk.posedge
+        clear.next = LOW
+        pose[:] = [0.0, 0.0, 0.0]
+        yield move(10, 10)
+        check_pose()
+
+        print 'DONE'
+
+        raise StopSimulation()
+
+    def testPoseEstimator(self):
+        """ Ensures that the pose follows the odometers """
+        sim = Simulation(TestBench(self.PoseTester))
+        sim.run()
+
+if __name__ == '__main__':
+    unittest.main()
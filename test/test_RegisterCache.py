@@ -0,0 +1,138 @@
+import sys
+sys.path.append('../lib')
+
+import unittest
+
+from Robot.Host.Cache import RegisterCache
+from Robot.Host.Client import RobotIOClient
+from Robot.Host.Transport import ModelTransport
+from Robot.Model import RobotIOModel
+
+# ticks of the simulated control loop (not a multiple of REFRESH)
+TICKS = 95
+
+# ticks between the refreshes of unchanged registers
+REFRESH = 10
+
+class TestRegisterCache(unittest.TestCase):
+
+    def setUp(self):
+        self.model = RobotIOModel()
+        self.transport = ModelTransport(self.model)
+        self.client = RobotIOClient(self.transport.transfer)
+        self.cache = RegisterCache(self.client, REFRESH)
+
+    def tick(self, **values):
+        """ Sends one tick of the control loop, with the values set, and return the length of its batch """
+        self.client.clear()
+        for name, value in sorted(values.items()):
+            self.cache.set(name, value)
+        self.cache.flush()
+        self.client.send()
+        self.cache.commit()
+        return self.client.length
+
+    def testSuppress(self):
+        """ Check that unchanged values are only written again at refresh """
+        lengths = [self.tick(servo1_consign = 1500, motor1_speed = -20) for i in range(TICKS)]
+        self.assertEquals(lengths, [8 if i % REFRESH == 0 else 0 for i in range(TICKS)])
+        refreshes = len(range(0, TICKS, REFRESH))
+        self.assertEquals((self.cache.writes, self.cache.dropped), (2 * refreshes, 2 * (TICKS - refreshes)))
+        self.assertEquals(self.transport.stats()['bytes'], 8 * refreshes)
+
+        # a change is written at once, then refreshed from there (even if
+        # it is not set again)
+        self.assertEquals(self.tick(servo1_consign = 1500, motor1_speed = -21), 4)
+        self.assertEquals(self.model.registers['motor1_speed'], -21)
+        lengths = [self.tick(servo1_consign = 1500) for i in range(REFRESH)]
+        self.assertEquals(lengths, [4 if i in (refreshes * REFRESH - TICKS - 1, REFRESH - 1) else 0
+                                    for i in range(REFRESH)])
+
+        # values with the same bits are the same value
+        self.assertEquals(self.tick(motor1_speed = -21 & 0x7FF), 0)
+
+    def testMerge(self):
+        """ Check that the last value set in a tick is written once """
+        self.client.clear()
+        for consign in range(1000, 1010):
+            self.cache.set('servo2_consign', consign)
+        self.cache.set('led_green_consign', 1)
+        self.cache.flush()
+        read = self.client.read('stored_uint8')
+        self.client.send()
+        self.cache.commit()
+        self.assertEquals(self.client.length, 4 + 3 + 3)
+        self.assertEquals(self.model.registers['servo2_consign'], 1009)
+        self.assertEquals(self.model.registers['led_green_consign'], 1)
+        self.assertEquals(self.client.value(read), 0)
+        self.assertEquals((self.cache.writes, self.cache.dropped), (2, 9))
+
+    def testInvalidate(self):
+        """ Check that all registers are written again after invalidate() """
+        self.tick(servo1_consign = 1500, loop1_enable = 1)
+        self.model.registers['servo1_consign'] = 0
+        self.cache.invalidate()
+        self.assertEquals(self.tick(loop1_enable = 1), 7)
+        self.assertEquals(self.model.registers['servo1_consign'], 1500)
+
+        # without refresh, unchanged values are never written again
+        cache = RegisterCache(self.client, None)
+        self.client.clear()
+        cache.set('servo1_consign', 1500)
+        cache.flush()
+        cache.commit()
+        for i in range(TICKS):
+            cache.set('servo1_consign', 1500)
+            cache.flush()
+            cache.commit()
+        self.assertEquals((cache.writes, cache.dropped), (1, TICKS))
+
+    def testCoalesce(self):
+        """ Check that enough changed speeds are written with the bulk key """
+        speeds = dict(('motor%d_speed' % i, 10 * i - 40) for i in range(1, 9))
+        self.assertEquals(self.tick(servo1_consign = 1500, **speeds), 13 + 4)
+        self.assertEquals([self.model.registers['motor%d_speed' % i] for i in range(1, 9)], range(-30, 50, 10))
+        self.assertEquals(self.cache.writes, 2)
+
+        # 3 speeds are shorter with their own keys, 4 with the bulk key
+        speeds.update(motor1_speed = 1, motor2_speed = 2, motor3_speed = 3)
+        self.assertEquals(self.tick(**speeds), 3 * 4)
+        speeds.update(motor1_speed = 0, motor2_speed = 0, motor3_speed = 0, motor8_speed = -8)
+        self.assertEquals(self.tick(**speeds), 13)
+        self.assertEquals([self.model.registers['motor%d_speed' % i] for i in range(1, 9)],
+                          [0, 0, 0, 0, 10, 20, 30, -8])
+
+        # the speeds written with the bulk key are refreshed together with
+        # it, after the servo written before them
+        self.assertEquals([self.tick(motor1_speed = 0) for i in range(REFRESH)], [0] * 7 + [4, 0, 13])
+
+        # the speeds not known to be written are not coalesced
+        cache = RegisterCache(self.client, REFRESH)
+        self.client.clear()
+        for i in range(1, 5):
+            cache.set('motor%d_speed' % i, i)
+        cache.flush()
+        self.assertEquals(self.client.length, 4 * 4)
+
+    def testFailedSend(self):
+        """ Check that the writes of a batch not sent are written again """
+        self.tick(servo1_consign = 1500)
+
+        # the batch is lost before commit, the old value is set again
+        self.client.clear()
+        self.cache.set('servo1_consign', 1600)
+        self.cache.flush()
+        self.assertEquals(self.client.length, 4)
+        self.assertEquals(self.tick(servo1_consign = 1500), 4)
+        self.assertEquals(self.model.registers['servo1_consign'], 1500)
+
+        # or nothing is set
+        self.client.clear()
+        self.cache.set('servo1_consign', 1600)
+        self.cache.flush()
+        self.assertEquals(self.tick(), 4)
+        self.assertEquals(self.model.registers['servo1_consign'], 1600)
+        self.assertEquals(self.tick(servo1_consign = 1600), 0)
+
+if __name__ == '__main__':
+    unittest.main()
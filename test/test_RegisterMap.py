@@ -0,0 +1,92 @@
+import sys
+sys.path.append('../lib')
+
+import unittest
+
+from Robot.Utils.Config import DEFAULT, LARGE, SMALL, VARIANTS
+from Robot.Utils.RegisterMap import FIELDS, READ, WRITE, direction, fields, key, key_fields, keys, length, \
+                                    name_fields, names
+
+class TestRegisterMap(unittest.TestCase):
+
+    def testDirections(self):
+        """ Check that read keys are below 0x80 and write keys above """
+        for f in FIELDS:
+            self.assertEquals(direction(f.key), f.direction)
+
+    def testFields(self):
+        """ Check that the fields of a key do not overlap """
+        for k in keys(READ) + keys(WRITE):
+            offset = 0
+            for f in key_fields(k):
+                self.assertTrue(f.offset >= offset)
+                offset = f.offset + f.width
+
+    def testNames(self):
+        """ Check that each signal has one width """
+        for dir in (READ, WRITE):
+            for name in names(dir):
+                fields = name_fields(name, dir)
+                self.assertEquals(len(set(f.width for f in fields)), 1)
+                self.assertEquals(len(set(f.signed for f in fields)), 1)
+
+    def testWrittenNames(self):
+        """ Check that each written signal has its own key, and one shared key at most """
+        for name in names(WRITE):
+            self.assertTrue(len(name_fields(name, WRITE)) <= 2)
+            self.assertEquals([f.name for f in key_fields(key(name, WRITE))], [name])
+
+    def testLengths(self):
+        """ Check the length of some keys """
+        self.assertEquals(length(0x10), 16)
+        self.assertEquals(length(0x11), 4)
+        self.assertEquals(length(0x18), 20)
+        self.assertEquals(length(0x19), 8)
+        self.assertEquals(length(0x58), 16)
+        self.assertEquals(length(0x90), 11)
+        self.assertEquals(length(0x91), 2)
+        self.assertEquals(length(0x82), 1)
+
+    def testVariants(self):
+        """ Check the directions, the fields and the written names of each config """
+        for name, config in sorted(VARIANTS.items()):
+            variant = fields(config)
+            for f in variant:
+                self.assertEquals(direction(f.key), f.direction, name)
+            for k in keys(READ, variant) + keys(WRITE, variant):
+                self.assertTrue(length(k, variant) <= 256, name)
+                offset = 0
+                for f in key_fields(k, variant):
+                    self.assertTrue(f.offset >= offset, name)
+                    offset = f.offset + f.width
+            for n in names(WRITE, variant):
+                self.assertEquals([f.name for f in key_fields(key(n, WRITE, variant), variant)], [n], name)
+
+    def testSmallerKeys(self):
+        """ Check that a config with less channels keeps the keys of the robot """
+        self.assertEquals(fields(DEFAULT), FIELDS)
+        robot = set((f.key, f.name) for f in FIELDS)
+        for f in fields(SMALL):
+            if f.key not in (0x10, 0x18, 0x58, 0x90):
+                self.assertTrue((f.key, f.name) in robot, f)
+
+    def testLargerKeys(self):
+        """ Check the keys moved by the LARGE config (see Robot.Utils.RegisterMap) """
+        large = fields(LARGE)
+        moved = [(0x19, 0x1A), (0x1F, 0x22), (0x21, 0x23), (0x25, 0x2B), (0x31, 0x33), (0xB5, 0xB9), (0xD1, 0xD9)]
+        for robot_key, large_key in moved:
+            self.assertEquals([f.name for f in key_fields(large_key, large)], [f.name for f in key_fields(robot_key)])
+        for name in ['rc1_count', 'fixed_value', 'adc1_ch0_value', 'stored_uint8']:
+            self.assertEquals(key(name, READ, large), key(name, READ), name)
+        for name in ['reset', 'motor1_speed', 'servo1_consign', 'loop1_consign', 'loop_gain_p', 'motor1_resolution',
+                     'motor1_prescaler', 'stored_uint8']:
+            self.assertEquals(key(name, WRITE, large), key(name, WRITE), name)
+
+    def testTooManyKeys(self):
+        """ Check that configs without enough keys are refused """
+        self.assertRaises(ValueError, fields, DEFAULT._replace(odometers = 40))
+        self.assertRaises(ValueError, fields, DEFAULT._replace(motors = 120))
+        self.assertRaises(ValueError, fields, DEFAULT._replace(odometers = 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,202 +1,70 @@
 import sys
 sys.path.append('../lib')
 
+import multiprocessing
+import random
+import time
+import traceback
 import unittest
 
-from myhdl import Signal, Simulation, StopSimulation, always, concat, delay, downrange, intbv, join, traceSignals
+from functools import partial
+from myhdl import Signal, Simulation, StopSimulation, always, delay, intbv, join, now, traceSignals
+from optparse import OptionParser
 from random import randrange
-from Robot.Main import RobotIO
+from StringIO import StringIO
+from Robot.Main import top_level
+from Robot.Utils.Config import DEFAULT, LARGE, SMALL, VARIANTS, ports, servo_port
+from Robot.Utils.RegisterMap import READ, WRITE, UNKNOWN_VALUE, fields, key, key_fields, keys, length
 from Robot.Utils.Constants import LOW, HIGH
-from TestUtils import ClkGen, count_high, quadrature_encode
-
-def TestBench(RobotIOTester):
-
-    # Create signals with default values
-    clk25      = Signal(LOW)
-
-    sspi_clk   = Signal(LOW)
-    sspi_cs    = Signal(HIGH)
-    sspi_miso  = Signal(LOW)
-    sspi_mosi  = Signal(LOW)
-
-    rc1_cha    = Signal(LOW)
-    rc1_chb    = Signal(LOW)
-    rc2_cha    = Signal(LOW)
-    rc2_chb    = Signal(LOW)
-    rc3_cha    = Signal(LOW)
-    rc3_chb    = Signal(LOW)
-    rc4_cha    = Signal(LOW)
-    rc4_chb    = Signal(LOW)
-
-    mot1_brake = Signal(LOW)
-    mot1_dir   = Signal(LOW)
-    mot1_pwm   = Signal(LOW)
-
-    mot2_brake = Signal(LOW)
-    mot2_dir   = Signal(LOW)
-    mot2_pwm   = Signal(LOW)
-
-    mot3_brake = Signal(LOW)
-    mot3_dir   = Signal(LOW)
-    mot3_pwm   = Signal(LOW)
-
-    mot4_brake = Signal(LOW)
-    mot4_dir   = Signal(LOW)
-    mot4_pwm   = Signal(LOW)
-
-    mot5_brake = Signal(LOW)
-    mot5_dir   = Signal(LOW)
-    mot5_pwm   = Signal(LOW)
-
-    mot6_brake = Signal(LOW)
-    mot6_dir   = Signal(LOW)
-    mot6_pwm   = Signal(LOW)
-
-    mot7_brake = Signal(LOW)
-    mot7_dir   = Signal(LOW)
-    mot7_pwm   = Signal(LOW)
-
-    mot8_brake = Signal(LOW)
-    mot8_dir   = Signal(LOW)
-    mot8_pwm   = Signal(LOW)
-
-    adc1_clk   = Signal(LOW)
-    adc1_cs    = Signal(HIGH)
-    adc1_miso  = Signal(LOW)
-    adc1_mosi  = Signal(LOW)
-
-    pwm1_ch0   = Signal(LOW)
-    pwm1_ch1   = Signal(LOW)
-    pwm1_ch2   = Signal(LOW)
-    pwm1_ch3   = Signal(LOW)
-    pwm1_ch4   = Signal(LOW)
-    pwm1_ch5   = Signal(LOW)
-    pwm1_ch6   = Signal(LOW)
-    pwm1_ch7   = Signal(LOW)
-
-    ext1_0     = Signal(LOW)
-    ext1_1     = Signal(LOW)
-    ext1_2     = Signal(LOW)
-    ext1_3     = Signal(LOW)
-    ext1_4     = Signal(LOW)
-    ext1_5     = Signal(LOW)
-    ext1_6     = Signal(LOW)
-    ext1_7     = Signal(LOW)
-
-    ext2_0     = Signal(LOW)
-    ext2_1     = Signal(LOW)
-    ext2_2     = Signal(LOW)
-    ext2_3     = Signal(LOW)
-    ext2_4     = Signal(LOW)
-    ext2_5     = Signal(LOW)
-    ext2_6     = Signal(LOW)
-    ext2_7     = Signal(LOW)
-
-    ext3_0     = Signal(LOW)
-    ext3_1     = Signal(LOW)
-    ext3_2     = Signal(LOW)
-    ext3_3     = Signal(LOW)
-    ext3_4     = Signal(LOW)
-    ext3_5     = Signal(LOW)
-    ext3_6     = Signal(LOW)
-    ext3_7     = Signal(LOW)
-
-    ext4_0     = Signal(LOW)
-    ext4_1     = Signal(LOW)
-    ext4_2     = Signal(LOW)
-    ext4_3     = Signal(LOW)
-    ext4_4     = Signal(LOW)
-    ext4_5     = Signal(LOW)
-    ext4_6     = Signal(LOW)
-    ext4_7     = Signal(LOW)
-
-    ext5_0     = Signal(LOW)
-    ext5_1     = Signal(LOW)
-    ext5_2     = Signal(LOW)
-    ext5_3     = Signal(LOW)
-    ext5_4     = Signal(LOW)
-    ext5_5     = Signal(LOW)
-    ext5_6     = Signal(LOW)
-    ext5_7     = Signal(LOW)
-
-    ext6_0     = Signal(LOW)
-    ext6_1     = Signal(LOW)
-    ext6_2     = Signal(LOW)
-    ext6_3     = Signal(LOW)
-    ext6_4     = Signal(LOW)
-    ext6_5     = Signal(LOW)
-    ext6_6     = Signal(LOW)
-    ext6_7     = Signal(LOW)
-
-    ext7_0     = Signal(LOW)
-    ext7_1     = Signal(LOW)
-    ext7_2     = Signal(LOW)
-    ext7_3     = Signal(LOW)
-    ext7_4     = Signal(LOW)
-    ext7_5     = Signal(LOW)
-    ext7_6     = Signal(LOW)
-    ext7_7     = Signal(LOW)
-
-    led_yellow_n = Signal(HIGH)
-    led_green_n  = Signal(HIGH)
-    led_red_n    = Signal(HIGH)
-
-    # Instanciate module under test
-    RobotIO_inst = traceSignals(RobotIO,
-        clk25,
-        sspi_clk, sspi_cs, sspi_miso, sspi_mosi,
-        rc1_cha, rc1_chb,
-        rc2_cha, rc2_chb,
-        rc3_cha, rc3_chb,
-        rc4_cha, rc4_chb,
-        mot1_brake, mot1_dir, mot1_pwm,
-        mot2_brake, mot2_dir, mot2_pwm,
-        mot3_brake, mot3_dir, mot3_pwm,
-        mot4_brake, mot4_dir, mot4_pwm,
-        mot5_brake, mot5_dir, mot5_pwm,
-        mot6_brake, mot6_dir, mot6_pwm,
-        mot7_brake, mot7_dir, mot7_pwm,
-        mot8_brake, mot8_dir, mot8_pwm,
-        adc1_clk, adc1_cs, adc1_miso, adc1_mosi,
-        pwm1_ch0, pwm1_ch1, pwm1_ch2, pwm1_ch3, pwm1_ch4, pwm1_ch5, pwm1_ch6, pwm1_ch7,
-        ext1_0, ext1_1, ext1_2, ext1_3, ext1_4, ext1_5, ext1_6, ext1_7,
-        ext2_0, ext2_1, ext2_2, ext2_3, ext2_4, ext2_5, ext2_6, ext2_7,
-        ext3_0, ext3_1, ext3_2, ext3_3, ext3_4, ext3_5, ext3_6, ext3_7,
-        ext4_0, ext4_1, ext4_2, ext4_3, ext4_4, ext4_5, ext4_6, ext4_7,
-        ext5_0, ext5_1, ext5_2, ext5_3, ext5_4, ext5_5, ext5_6, ext5_7,
-        ext6_0, ext6_1, ext6_2, ext6_3, ext6_4, ext6_5, ext6_6, ext6_7,
-        ext7_0, ext7_1, ext7_2, ext7_3, ext7_4, ext7_5, ext7_6, ext7_7,
-        led_yellow_n, led_green_n, led_red_n,
-        False
+from TestUtils import CLK_PERIOD, ClkGen, SPIMaster, fake_mcp3008, from_bytes, klv_read, klv_write, \
+                      measure_pwm, quadrature_encode, to_bytes
+from CoverageUtils import KLVCoverage, save
+from TraceUtils import SelectiveTracer
+
+# scan ADC channels as fast as possible to keep the simulation short
+ADC_SCAN_FREQ = 25000
+
+# divide motor and servo PWM periods by 256 (4 and 1953 clk25 periods) to
+# keep the simulation short
+TIME_SCALE = 256
+
+# independent scenarios of RobotIOTester, each run in its own simulation
+SCENARIOS = ['leds', 'adc_ports', 'ext_ports', 'rc_ports', 'motors', 'stored_values', 'servos']
+
+# signals traced for each subsystem (see SelectiveTracer)
+TRACE_GROUPS = {
+    'spi': ['RobotIO.clk25', 'RobotIO.sspi_*', 'RobotIO.spi_cnt', 'RobotIO.txdata', 'RobotIO.write_*'],
+    'leds': ['RobotIO.led_*', 'RobotIO.Led1_inst.*'],
+    'adc': ['RobotIO.adc1_*', 'RobotIO.ADC1_inst.*'],
+    'ext': ['RobotIO.ext*'],
+    'odometers': ['RobotIO.rc*', 'RobotIO.Odometer*', 'RobotIO.Velocity*', 'RobotIO.timebase', 'RobotIO.timestamp'],
+    'pose': ['RobotIO.pose_*', 'RobotIO.Pose_inst.*'],
+    'motors': ['RobotIO.mot*', 'RobotIO.Motor*', 'RobotIO.loop*', 'RobotIO.Loop*'],
+    'servos': ['RobotIO.pwm*', 'RobotIO.servo*', 'RobotIO.Servo*'],
+}
+
+def TestBench(RobotIOTester, time_scale = 1, tracer = None, config = DEFAULT):
+
+    # Create signals with default values: SPI chip selects and LEDs are
+    # active low
+    signals = dict((name, Signal(HIGH if name in ('sspi_cs', 'adc1_cs') or name.startswith('led_') else LOW))
+                   for name in ports(config))
+    clk25 = signals['clk25']
+
+    # Instanciate module under test, traced by tracer (like traceSignals)
+    # if tracer is given
+    RobotIO = top_level(config)
+    if tracer is not None:
+        elaborate = partial(tracer, RobotIO)
+    else:
+        elaborate = RobotIO
+    RobotIO_inst = elaborate(
+        *[signals[name] for name in ports(config)] + [False],
+        adc_scan_freq = ADC_SCAN_FREQ, time_scale = time_scale
     )
 
     # Instanciate tester module
-    RobotIOTester_inst = RobotIOTester(
-        clk25,
-        sspi_clk, sspi_cs, sspi_miso, sspi_mosi,
-        rc1_cha, rc1_chb,
-        rc2_cha, rc2_chb,
-        rc3_cha, rc3_chb,
-        rc4_cha, rc4_chb,
-        mot1_brake, mot1_dir, mot1_pwm,
-        mot2_brake, mot2_dir, mot2_pwm,
-        mot3_brake, mot3_dir, mot3_pwm,
-        mot4_brake, mot4_dir, mot4_pwm,
-        mot5_brake, mot5_dir, mot5_pwm,
-        mot6_brake, mot6_dir, mot6_pwm,
-        mot7_brake, mot7_dir, mot7_pwm,
-        mot8_brake, mot8_dir, mot8_pwm,
-        adc1_clk, adc1_cs, adc1_miso, adc1_mosi,
-        pwm1_ch0, pwm1_ch1, pwm1_ch2, pwm1_ch3, pwm1_ch4, pwm1_ch5, pwm1_ch6, pwm1_ch7,
-        ext1_0, ext1_1, ext1_2, ext1_3, ext1_4, ext1_5, ext1_6, ext1_7,
-        ext2_0, ext2_1, ext2_2, ext2_3, ext2_4, ext2_5, ext2_6, ext2_7,
-        ext3_0, ext3_1, ext3_2, ext3_3, ext3_4, ext3_5, ext3_6, ext3_7,
-        ext4_0, ext4_1, ext4_2, ext4_3, ext4_4, ext4_5, ext4_6, ext4_7,
-        ext5_0, ext5_1, ext5_2, ext5_3, ext5_4, ext5_5, ext5_6, ext5_7,
-        ext6_0, ext6_1, ext6_2, ext6_3, ext6_4, ext6_5, ext6_6, ext6_7,
-        ext7_0, ext7_1, ext7_2, ext7_3, ext7_4, ext7_5, ext7_6, ext7_7,
-        led_yellow_n, led_green_n, led_red_n
-    )
+    RobotIOTester_inst = RobotIOTester(**signals)
 
     # Clock generator
     ClkGen_inst = ClkGen(clk25)
@@ -205,45 +73,25 @@ def TestBench(RobotIOTester):
 
 class TestRobotIO(unittest.TestCase):
 
-    def RobotIOTester(self,
-                 clk25,
-                 sspi_clk, sspi_cs, sspi_miso, sspi_mosi,
-                 rc1_cha, rc1_chb,
-                 rc2_cha, rc2_chb,
-                 rc3_cha, rc3_chb,
-                 rc4_cha, rc4_chb,
-                 mot1_brake, mot1_dir, mot1_pwm,
-                 mot2_brake, mot2_dir, mot2_pwm,
-                 mot3_brake, mot3_dir, mot3_pwm,
-                 mot4_brake, mot4_dir, mot4_pwm,
-                 mot5_brake, mot5_dir, mot5_pwm,
-                 mot6_brake, mot6_dir, mot6_pwm,
-                 mot7_brake, mot7_dir, mot7_pwm,
-                 mot8_brake, mot8_dir, mot8_pwm,
-                 adc1_clk, adc1_cs, adc1_miso, adc1_mosi,
-                 pwm1_ch0, pwm1_ch1, pwm1_ch2, pwm1_ch3, pwm1_ch4, pwm1_ch5, pwm1_ch6, pwm1_ch7,
-                 ext1_0, ext1_1, ext1_2, ext1_3, ext1_4, ext1_5, ext1_6, ext1_7,
-                 ext2_0, ext2_1, ext2_2, ext2_3, ext2_4, ext2_5, ext2_6, ext2_7,
-                 ext3_0, ext3_1, ext3_2, ext3_3, ext3_4, ext3_5, ext3_6, ext3_7,
-                 ext4_0, ext4_1, ext4_2, ext4_3, ext4_4, ext4_5, ext4_6, ext4_7,
-                 ext5_0, ext5_1, ext5_2, ext5_3, ext5_4, ext5_5, ext5_6, ext5_7,
-                 ext6_0, ext6_1, ext6_2, ext6_3, ext6_4, ext6_5, ext6_6, ext6_7,
-                 ext7_0, ext7_1, ext7_2, ext7_3, ext7_4, ext7_5, ext7_6, ext7_7,
-                 led_yellow_n, led_green_n, led_red_n):
-
-        def spi_transfer(master_to_slave, slave_to_master):
-            """ Send data like an SPI master would """
-            yield delay(50)
-            sspi_cs.next = LOW
-            yield delay(10)
-            for i in downrange(len(master_to_slave)):
-                sspi_clk.next = HIGH
-                sspi_mosi.next = master_to_slave[i]
-                yield delay(10)
-                sspi_clk.next = LOW
-                slave_to_master[i] = sspi_miso
-                yield delay(10)
-            sspi_cs.next = HIGH
+    def RobotIOTester(self, config, scenarios = SCENARIOS, **ports):
+
+        spi = SPIMaster(ports['sspi_clk'], ports['sspi_mosi'], ports['sspi_miso'], ports['sspi_cs'])
+
+        # channels and keys of config
+        RC = range(1, config.odometers + 1)
+        MOT = range(1, config.motors + 1)
+        SERVO = range(1, config.servos + 1)
+        EXT = range(1, config.ext_ports + 1)
+        register_fields = fields(config)
+
+        def own_key(name, dir = READ):
+            """ Return the key reading or writing name alone """
+            return key(name, dir, register_fields)
+
+        def group_key(names, dir = READ):
+            """ Return the key reading or writing exactly the signals names together """
+            return [k for k in keys(dir, register_fields)
+                    if set(f.name for f in key_fields(k, register_fields)) == set(names)][0]
 
 
         #
@@ -251,43 +99,30 @@ class TestRobotIO(unittest.TestCase):
         #
 
         def get_write_led_command(color, on_off):
-            """ Return an intbv suitable to be sent to the slave to set led[color] on/off """
-            keys = {'yellow': 0x83, 'green': 0x82, 'red': 0x84}
-            ret = intbv(0)[24:]
-            ret[24:16] = keys[color] # set led on/off
-            ret[16:8] = 1            # send 1 byte
-            ret[8:] = on_off         # the value is the new state
-            return ret
+            """ Return the bytes to send to the slave to set led[color] on/off """
+            return klv_write(own_key('led_%s_consign' % color, WRITE), 1, on_off)
 
         def set_led_on_off(color, on_off):
             """ Set led[color] on/off """
             print 'set', color, 'led:', ('on' if on_off == 1 else 'off'), '...',
-            master_to_slave = get_write_led_command(color, on_off)
-            slave_to_master = intbv(0)
-            yield spi_transfer(master_to_slave, slave_to_master)
+            yield spi.transfer(get_write_led_command(color, on_off))
             print 'done'
 
         def set_leds_on_offs(on_offs):
             """ Set all leds on/off in one SPI transfer """
             print 'set all leds'
             master_to_slave = get_write_led_command('yellow', on_offs['yellow'])
-            master_to_slave = concat(master_to_slave, get_write_led_command('green', on_offs['green']))
-            #master_to_slave = concat(master_to_slave, get_write_led_command('red', on_offs['red']))
-            slave_to_master = intbv(0)
-            yield spi_transfer(master_to_slave, slave_to_master)
+            master_to_slave += get_write_led_command('green', on_offs['green'])
+            #master_to_slave += get_write_led_command('red', on_offs['red'])
+            yield spi.transfer(master_to_slave)
             print 'done'
 
         def check_led_on_off(color, on_off):
             """ Checks that the duty cycle of the led[color] really corresponds to on_off[10:] """
             print 'check', color, 'led is:', ('on' if on_off == 1 else 'off')
-            lines = {
-                'yellow': led_yellow_n,
-                'green': led_green_n,
-            #    'red': led_red_n
-            }
 
             # LEDs glow when line is low
-            self.assertEquals(not lines[color], on_off)
+            self.assertEquals(not ports['led_%s_n' % color], on_off)
 
         def test_leds():
             # Generate random on_offs for leds
@@ -321,100 +156,51 @@ class TestRobotIO(unittest.TestCase):
         # Ext ports
         #
 
-        def set_ext_lines(data, l0, l1, l2, l3, l4, l5, l6, l7):
-            """ Pull l[0-7] lines high or low to match bits [0-7] of data """
-            l0.next = data[0]
-            l1.next = data[1]
-            l2.next = data[2]
-            l3.next = data[3]
-            l4.next = data[4]
-            l5.next = data[5]
-            l6.next = data[6]
-            l7.next = data[7]
-
-        def set_ext1_port(data):
-            """ Pull ext1_[0-7] lines high or low to match bits [0-7] of data """
-            print 'set ext1 port'
-            set_ext_lines(data, ext1_0, ext1_1, ext1_2, ext1_3, ext1_4, ext1_5, ext1_6, ext1_7)
-
-        def set_ext2_port(data):
-            """ Pull ext2_[0-7] lines high or low to match bits [0-7] of data """
-            print 'set ext2 port'
-            set_ext_lines(data, ext2_0, ext2_1, ext2_2, ext2_3, ext2_4, ext2_5, ext2_6, ext2_7)
-
-        def set_ext3_port(data):
-            """ Pull ext3_[0-7] lines high or low to match bits [0-7] of data """
-            print 'set ext3 port'
-            set_ext_lines(data, ext3_0, ext3_1, ext3_2, ext3_3, ext3_4, ext3_5, ext3_6, ext3_7)
-
-        def set_ext4_port(data):
-            """ Pull ext4_[0-7] lines high or low to match bits [0-7] of data """
-            print 'set ext4 port'
-            set_ext_lines(data, ext4_0, ext4_1, ext4_2, ext4_3, ext4_4, ext4_5, ext4_6, ext4_7)
-
-        def set_ext5_port(data):
-            """ Pull ext5_[0-7] lines high or low to match bits [0-7] of data """
-            print 'set ext5 port'
-            set_ext_lines(data, ext5_0, ext5_1, ext5_2, ext5_3, ext5_4, ext5_5, ext5_6, ext5_7)
-
-        def set_ext6_port(data):
-            """ Pull ext6_[0-7] lines high or low to match bits [0-7] of data """
-            print 'set ext6 port'
-            set_ext_lines(data, ext6_0, ext6_1, ext6_2, ext6_3, ext6_4, ext6_5, ext6_6, ext6_7)
-
-        def set_ext7_port(data):
-            """ Pull ext7_[0-7] lines high or low to match bits [0-7] of data """
-            print 'set ext7 port'
-            set_ext_lines(data, ext7_0, ext7_1, ext7_2, ext7_3, ext7_4, ext7_5, ext7_6, ext7_7)
+        def set_ext_port(number, data):
+            """ Pull ext[number]_[0-7] lines high or low to match bits [0-7] of data """
+            print 'set ext%d port' % number
+            for i in range(8):
+                ports['ext%d_%d' % (number, i)].next = data[i]
 
         def set_ext_ports(datas):
-            """ Pull ext[1-7]_[0-7] lines high or low to match bits [0-7] of datas [1-7] """
+            """ Pull the lines of all ext ports high or low to match bits [0-7] of datas [1:] """
             print 'set all ext ports'
-            set_ext1_port(datas[1])
-            set_ext2_port(datas[2])
-            set_ext3_port(datas[3])
-            set_ext4_port(datas[4])
-            set_ext5_port(datas[5])
-            set_ext6_port(datas[6])
-            set_ext7_port(datas[7])
+            for i in EXT:
+                set_ext_port(i, datas[i])
 
         def get_read_ext_port_command(number):
-            """ Return an intbv suitable to be sent to the slave to read ext[number] port """
-            ret = intbv(0)[24:]
-            ret[24:16] = 0x30 + number  # read ext port (1 to 7)
-            ret[16:8] = 1               # expect 1 byte
-            return ret
+            """ Return the bytes to send to the slave to read ext[number] port (from 1) """
+            return klv_read(own_key('ext%d_port' % number), 1)
 
         def read_ext_port(number, expected_data):
             """ Read ext[number] port and compare the result byte to expected_data """
             print 'read ext port nb:', number, '...',
-            master_to_slave = get_read_ext_port_command(number)
-            slave_to_master = intbv(0)
-            yield spi_transfer(master_to_slave, slave_to_master)
-            self.assertEquals(slave_to_master[8:], expected_data)
+            slave_to_master = bytearray()
+            yield spi.transfer(get_read_ext_port_command(number), slave_to_master)
+            self.assertEquals(slave_to_master[2], expected_data)
             print 'done'
 
         def read_ext_ports(expected_datas):
             """ Read all ext ports in one SPI transfer and compare the result bytes to expected_datas """
             print 'read all ext ports at once...',
-            master_to_slave = get_read_ext_port_command(7)
-            for i in downrange(7, 1):
-                master_to_slave = concat(master_to_slave, get_read_ext_port_command(i))
-            slave_to_master = intbv(0)
-            yield spi_transfer(master_to_slave, slave_to_master)
-            for i in downrange(8, 1):
-                self.assertEquals(slave_to_master[i*24-16:(i-1)*24], expected_datas[i])
+            master_to_slave = bytearray()
+            for i in reversed(EXT):
+                master_to_slave += get_read_ext_port_command(i)
+            slave_to_master = bytearray()
+            yield spi.transfer(master_to_slave, slave_to_master)
+            for i in reversed(EXT):
+                self.assertEquals(slave_to_master[(len(EXT)-i)*3+2], expected_datas[i])
             print 'done'
 
         def test_ext_ports():
             # Generate random inputs for ext ports
-            ext_port_config = [intbv(randrange(0xFF)) for i in range(8) ]
+            ext_port_config = [intbv(randrange(0xFF)) for i in range(len(EXT) + 1)]
 
             # Set up ext ports
             set_ext_ports(ext_port_config)
 
             # Read ext ports separately
-            for i in range(1, 8):
+            for i in EXT:
                 yield read_ext_port(i, ext_port_config[i])
 
             # Read ext ports together
@@ -425,157 +211,164 @@ class TestRobotIO(unittest.TestCase):
         # Odometers
         #
 
+        # bytes of a count
+        COUNT_LENGTH = config.odometer_width // 8
+
         def set_rc_lines(forward_steps, backward_steps, rc_a, rc_b):
             yield quadrature_encode(forward_steps, rc_a, rc_b)
             yield quadrature_encode(backward_steps, rc_b, rc_a)
 
-        def set_rc1_port(forward_steps, backward_steps):
-            """ Make rc1 roll 'forward_steps' forwards and 'backward_steps' backwards """
-            print 'roll rc1', forward_steps, 'forwards and', backward_steps, 'backwards'
-            yield set_rc_lines(forward_steps, backward_steps, rc1_cha, rc1_chb)
-
-        def set_rc2_port(forward_steps, backward_steps):
-            """ Make rc2 roll 'forward_steps' forwards and 'backward_steps' backwards """
-            print 'roll rc2', forward_steps, 'forwards and', backward_steps, 'backwards'
-            yield set_rc_lines(forward_steps, backward_steps, rc2_cha, rc2_chb)
-
-        def set_rc3_port(forward_steps, backward_steps):
-            """ Make rc3 roll 'forward_steps' forwards and 'backward_steps' backwards """
-            print 'roll rc3', forward_steps, 'forwards and', backward_steps, 'backwards'
-            yield set_rc_lines(forward_steps, backward_steps, rc3_cha, rc3_chb)
-
-        def set_rc4_port(forward_steps, backward_steps):
-            """ Make rc4 roll 'forward_steps' forwards and 'backward_steps' backwards """
-            print 'roll rc4', forward_steps, 'forwards and', backward_steps, 'backwards'
-            yield set_rc_lines(forward_steps, backward_steps, rc4_cha, rc4_chb)
+        def set_rc_port(number, forward_steps, backward_steps):
+            """ Make rc[number] roll 'forward_steps' forwards and 'backward_steps' backwards """
+            print 'roll rc%d' % number, forward_steps, 'forwards and', backward_steps, 'backwards'
+            yield set_rc_lines(forward_steps, backward_steps, ports['rc%d_cha' % number], ports['rc%d_chb' % number])
 
         def set_rc_ports(forward_steps_array, backward_steps_array):
             """ Make all rc roll """
             print 'roll all rc'
-            yield join(set_rc1_port(forward_steps_array[1], backward_steps_array[1]),
-                       set_rc2_port(forward_steps_array[2], backward_steps_array[2]),
-                       set_rc3_port(forward_steps_array[3], backward_steps_array[3]),
-                       set_rc4_port(forward_steps_array[4], backward_steps_array[4]))
+            yield join(*[set_rc_port(i, forward_steps_array[i], backward_steps_array[i]) for i in RC])
 
         def get_read_rc_port_command(number):
-            """ Return an intbv suitable to be sent to the slave to read rc[number] port """
-            ret = intbv(0)[32:]
-            ret[32:24] = 0x10 + number  # read rc port (1 to 4)
-            ret[24:16] = 2              # expect 2 bytes
-            return ret
+            """ Return the bytes to send to the slave to read rc[number] port (from 1) """
+            return klv_read(own_key('rc%d_count' % number), COUNT_LENGTH)
 
         def read_rc_port(number, expected_data):
-            """ Read rc[number] port and compare the result byte to expected_data """
+            """ Read rc[number] port and compare the result to expected_data """
             print 'read rc port nb:', number, '...',
-            master_to_slave = get_read_rc_port_command(number)
-            slave_to_master = intbv(0)
-            yield spi_transfer(master_to_slave, slave_to_master)
-            self.assertEquals(slave_to_master[16:].signed(), expected_data)
+            slave_to_master = bytearray()
+            yield spi.transfer(get_read_rc_port_command(number), slave_to_master)
+            self.assertEquals(from_bytes(slave_to_master[2:], signed = True), expected_data)
             print 'done'
 
         def read_rc_ports(expected_datas):
-            """ Read all rc ports in one SPI transfer and compare the result bytes to expected_datas """
+            """ Read all rc ports in one SPI transfer and compare the results to expected_datas """
             print 'read all rc ports at once...',
-            master_to_slave = get_read_rc_port_command(4)
-            for i in downrange(4, 1):
-                master_to_slave = concat(master_to_slave, get_read_rc_port_command(i))
-            slave_to_master = intbv(0)
-            yield spi_transfer(master_to_slave, slave_to_master)
-            for i in downrange(5, 1):
-                self.assertEquals(slave_to_master[i*32-16:(i-1)*32].signed(), expected_datas[i])
+            master_to_slave = bytearray()
+            for i in reversed(RC):
+                master_to_slave += get_read_rc_port_command(i)
+            slave_to_master = bytearray()
+            yield spi.transfer(master_to_slave, slave_to_master)
+            for i in reversed(RC):
+                offset = (len(RC)-i)*(COUNT_LENGTH+2)+2
+                self.assertEquals(from_bytes(slave_to_master[offset:offset+COUNT_LENGTH], signed = True),
+                                  expected_datas[i])
+            print 'done'
+
+        def read_rc_snapshot(expected_datas):
+            """ Read all rc ports with the snapshot key and compare the results to expected_datas """
+            print 'read rc snapshot...',
+            slave_to_master = bytearray()
+            yield spi.transfer(klv_read(group_key(['rc%d_snapshot' % i for i in RC]), len(RC) * COUNT_LENGTH),
+                               slave_to_master)
+            # last rc first, rc1 last
+            for i in RC:
+                offset = (len(RC)-i)*COUNT_LENGTH+2
+                self.assertEquals(from_bytes(slave_to_master[offset:offset+COUNT_LENGTH], signed = True),
+                                  expected_datas[i])
+            print 'done'
+
+        def read_rc_timestamped(number, expected_data, timestamps):
+            """ Read rc[number] port with a timestamp, compare the result to expected_data and append the timestamp to timestamps """
+            print 'read rc port nb:', number, 'with timestamp...',
+            slave_to_master = bytearray()
+            yield spi.transfer(klv_read(group_key(['rc%d_snapshot' % number, 'timestamp']), COUNT_LENGTH + 4),
+                               slave_to_master)
+            self.assertEquals(from_bytes(slave_to_master[2:2+COUNT_LENGTH], signed = True), expected_data)
+            timestamps.append((from_bytes(slave_to_master[2+COUNT_LENGTH:]), now()))
+            print 'done'
+
+        def read_pose(expected_x, expected_y, expected_theta):
+            """ Read the pose and compare it to the expected one (x and y in ticks) """
+            print 'read pose...',
+            slave_to_master = bytearray()
+            yield spi.transfer(klv_read(group_key(['pose_x_snapshot', 'pose_y_snapshot', 'pose_theta_snapshot']), 12),
+                               slave_to_master)
+            self.assertTrue(abs(from_bytes(slave_to_master[2:6], signed = True) / 256.0 - expected_x) < 0.5)
+            self.assertTrue(abs(from_bytes(slave_to_master[6:10], signed = True) / 256.0 - expected_y) < 0.5)
+            self.assertEquals(from_bytes(slave_to_master[10:14]), expected_theta)
             print 'done'
 
         def test_rc_ports():
             # Generate random inputs for rc ports
-            rc_port_forwards  = [intbv(randrange(0xFF)) for i in range(5)]
-            rc_port_backwards = [intbv(randrange(0xFF)) for i in range(5)]
+            rc_port_forwards  = [intbv(randrange(0xFF)) for i in range(len(RC) + 1)]
+            rc_port_backwards = [intbv(randrange(0xFF)) for i in range(len(RC) + 1)]
 
             # Set up rc ports
             yield set_rc_ports(rc_port_forwards, rc_port_backwards)
 
             # Expected results
-            expected_datas = [intbv(rc_port_forwards[i] - rc_port_backwards[i], min = -2**15, max = 2**15) for i in range(5)]
+            expected_datas = [intbv(rc_port_forwards[i] - rc_port_backwards[i], min = -2**15, max = 2**15)
+                              for i in range(len(RC) + 1)]
 
             # Read rc ports separately
-            for i in range(1, 5):
+            for i in RC:
                 yield read_rc_port(i, expected_datas[i])
 
             # Read rc ports together
             yield read_rc_ports(expected_datas)
 
+            # Read rc ports snapshot
+            yield read_rc_snapshot(expected_datas)
 
-        #
-        # ADC
-        #
-
-        def fake_mcp3008(channel, values):
-            """
-
-            Send data like an MCP3008 would
-
-            CPOL=1 and CPHA=1 here:
-             - the base value of the clock is HIGH
-             - data is captured on the clock's rising edge and data is
-               propagated on a falling edge.
-
-            """
-            yield adc1_cs.negedge
-
-            # wait for start bit: first clock with mosi high
-            while adc1_mosi == LOW:
-                yield adc1_clk.posedge
-            self.assertEqual(adc1_mosi, HIGH)
-
-            # single-ended bit
-            yield adc1_clk.posedge
-            self.assertEqual(adc1_mosi, HIGH)
+            # Read rc ports with timestamps: the timestamps follow the
+            # simulation time (CLK_PERIOD delay units per clk25 period)
+            timestamps = []
+            for i in RC:
+                yield read_rc_timestamped(i, expected_datas[i], timestamps)
+            for i in range(1, len(timestamps)):
+                self.assertTrue(abs((timestamps[i][0] - timestamps[i-1][0]) * CLK_PERIOD -
+                                    (timestamps[i][1] - timestamps[i-1][1])) <= 4)
 
-            # channel bits
-            for i in downrange(len(channel)):
-                yield adc1_clk.posedge
-                channel[i] = adc1_mosi
+            # Read pose: rc1 and rc2 are the left and right odometers, the
+            # angle scale is 0 so the robot moved along the x axis
+            yield read_pose((expected_datas[1] + expected_datas[2]) / 2.0, 0, 0)
 
-            print 'master wants channel:', channel
 
-            # one more bit for conversion
-            yield adc1_clk.posedge
-
-            # then MCP3008 sends a null byte
-            yield adc1_clk.negedge
-            adc1_miso.next = LOW
-
-            # and then the 10-bit value
-            value = values[channel]
-            print 'slave sending:', value
-            for i in downrange(len(value)):
-                yield adc1_clk.negedge
-                adc1_miso.next = value[i]
+        #
+        # ADC
+        #
 
-            yield adc1_cs.posedge
-            print "slave done"
+        def read_adc_channel(number, expected_value):
+            """ Read adc channel[number] (0 to 7) and compare the result to expected_value """
+            print 'read adc channel nb:', number, '...',
+            slave_to_master = bytearray()
+            yield spi.transfer(klv_read(own_key('adc1_ch%d_value' % number), 2), slave_to_master)
+            self.assertEquals(from_bytes(slave_to_master[2:]), expected_value)
+            print 'done'
 
-        def get_read_adc_channel_command(number):
-            ret = intbv(0)[32:]
-            ret[32:24] = 0x50 + number  # read adc channel (0 to 7)
-            ret[24:16] = 2              # expect 2 bytes
-            return ret
+        def read_adc_channels(expected_values):
+            """ Read all adc channels with the burst key and compare the results to expected_values """
+            print 'read all adc channels at once...',
+            slave_to_master = bytearray()
+            yield spi.transfer(klv_read(group_key(['adc1_ch%d_value' % i for i in range(8)]), 16), slave_to_master)
+            # channel 7 first, channel 0 last
+            for i in range(8):
+                offset = (7-i)*2+2
+                self.assertEquals(from_bytes(slave_to_master[offset:offset+2]), expected_values[i])
+            print 'done'
 
-        def read_adc_channel(number):
-            master_to_slave = get_read_adc_channel_command(number)
-            slave_to_master = intbv(0)
+        def test_adc_ports():
+            values = [randrange(2**10) for i in range(8)]
+            channels = []
 
-            channel = intbv(0)[3:]
-            values = [intbv(randrange(2**10))[10:] for i in range(8)]
+            # fork: the fake MCP3008 answers in the background
+            yield fake_mcp3008(values, ports['adc1_clk'], ports['adc1_cs'], ports['adc1_miso'], ports['adc1_mosi'],
+                               channels), delay(0)
 
-            yield join(fake_mcp3008(channel, values), spi_transfer(master_to_slave, slave_to_master))
-            self.assertEquals(channel, number)
-            self.assertEquals(slave_to_master[16:], values[number])
-            print 'done'
+            # wait for a whole scan, then for the end of the scan in progress
+            while len(channels) == 0 or channels[-1][0] != 7:
+                yield ports['adc1_cs'].posedge
+            del channels[:]
+            while len(channels) == 0 or channels[-1][0] != 7:
+                yield ports['adc1_cs'].posedge
+            self.assertEquals(channels, [(i, HIGH) for i in range(8)])
 
-        def test_adc_ports():
             # Read channels separately
             for i in range(8):
-                yield read_adc_channel(i)
+                yield read_adc_channel(i, values[i])
+
+            # Read channels together
+            yield read_adc_channels(values)
 
 
         #
@@ -583,78 +376,124 @@ class TestRobotIO(unittest.TestCase):
         #
 
         def get_write_motor_command(number, speed):
-            """ Return an intbv suitable to be sent to the slave to set motor[number] speed """
-            ret = intbv(0)[32:]
-            ret[32:24] = 0x90 + number  # set motor speed (1 to 6)
-            ret[24:16] = 2              # send 2 bytes
-            ret[11:] = speed[11:]       # the value is the new speed
-            return ret
+            """ Return the bytes to send to the slave to set motor[number] speed (from 1) """
+            return klv_write(own_key('motor%d_speed' % number, WRITE), 2, speed[11:])
 
         def set_motor_speed(number, speed):
             """ Set motor[number] speed """
             print 'set motor:', number, '...',
-            master_to_slave = get_write_motor_command(number, speed)
-            slave_to_master = intbv(0)
-            yield spi_transfer(master_to_slave, slave_to_master)
+            yield spi.transfer(get_write_motor_command(number, speed))
             print 'done'
 
         def set_motors_speeds(speeds):
             """ Set all motors speeds in one SPI transfer """
             print 'set all motors'
-            master_to_slave = get_write_motor_command(8, speeds[8])
-            for i in downrange(8, 1):
-                master_to_slave = concat(master_to_slave, get_write_motor_command(i, speeds[i]))
-            slave_to_master = intbv(0)
-            yield spi_transfer(master_to_slave, slave_to_master)
+            master_to_slave = bytearray()
+            for i in reversed(MOT):
+                master_to_slave += get_write_motor_command(i, speeds[i])
+            yield spi.transfer(master_to_slave)
             print 'done'
 
-        def check_motor_duty_cycle(number, speed):
-            """ Checks that the duty cycle of the motor[number] really corresponds to speed[10:] """
-            print 'check motor', number
-            lines = [None, mot1_pwm, mot2_pwm, mot3_pwm, mot4_pwm, mot5_pwm, mot6_pwm, mot7_pwm, mot8_pwm]
-            count = intbv(0)
+        def get_write_motors_command(speeds):
+            """ Return the bytes to send to the slave to set all motors speeds at once """
+            # 11-bit speeds, last motor first
+            value = 0
+            for i in reversed(MOT):
+                value = (value << 11) | int(speeds[i][11:])
+            k = group_key(['motor%d_speed' % i for i in MOT], WRITE)
+            return klv_write(k, length(k, register_fields), value)
+
+        def set_motors_speeds_at_once(speeds):
+            """ Set all motors speeds with the bulk key """
+            print 'set all motors at once...',
+            yield spi.transfer(get_write_motors_command(speeds))
+            print 'done'
+
+        def set_motors_periods(settings):
+            """ Set the PWM resolution and prescaler of all motors in one SPI transfer """
+            print 'set all motors periods...',
+            master_to_slave = bytearray()
+            for i in MOT:
+                resolution, prescaler = settings[i]
+                master_to_slave += klv_write(own_key('motor%d_resolution' % i, WRITE), 1, resolution)
+                master_to_slave += klv_write(own_key('motor%d_prescaler' % i, WRITE), 1, prescaler)
+            yield spi.transfer(master_to_slave)
+            print 'done'
+
+            # a longer period starts at a start of both the current and the
+            # new periods: wait for the longest one
+            yield delay(max(2**(resolution + prescaler) for resolution, prescaler in settings[1:]) //
+                        TIME_SCALE * CLK_PERIOD)
+
+        def check_motors_duty_cycles(speeds, settings = [None] + [(10, 0)] * len(MOT)):
+            """ Checks that the duty cycles of all motors really correspond to speeds[1:], with the
+            (resolution, prescaler) of settings[1:] """
+            print 'check motors'
+            lines = [ports['mot%d_pwm' % i] for i in MOT]
 
             # First period is not correct as the counter had already started
             # before the speed was given. Start testing at the second period
-            yield lines[number].negedge # wait for end of PWM waveform of the first period
-            yield lines[number].posedge # wait for the beginning of the period
-
-            yield count_high(lines[number], clk25, count)
-            self.assertEquals(count, min(abs(speed), speed.max - 1))
+            yield join(*[line.negedge for line in lines]) # wait for end of PWM waveform of the first period
+
+            measures = []
+            yield measure_pwm(lines, measures)
+            # speeds lose the bits the resolution drops, the prescaler slows
+            # ticks down
+            self.assertEquals(measures, [((min(abs(speed), speed.max - 1) >> (10 - resolution) << prescaler) //
+                                          TIME_SCALE, 2**(resolution + prescaler) // TIME_SCALE)
+                                         for speed, (resolution, prescaler) in zip(speeds[1:], settings[1:])])
+
+        def random_speeds(minimum = TIME_SCALE):
+            """ Return random speeds for speeds[1:], high enough for the PWM to toggle with TIME_SCALE
+            (or higher than minimum) """
+            speeds = []
+            for i in range(len(MOT) + 1):
+                speed = randrange(minimum, 2**10)
+                if randrange(2) == 0:
+                    speed = -speed
+                speeds.append(intbv(speed, min = -2**10, max = 2**10))
+            return speeds
 
         def test_motors():
             # Generate random speeds for motors
-            speeds = [intbv(randrange(-2**10, 2**10), min = -2**10, max = 2**10) for i in range(9)]
+            speeds = random_speeds()
 
             # Set motor speeds one at a time
-            for i in range(1, 9):
+            for i in MOT:
                 yield set_motor_speed(i, speeds[i])
 
             # Check actual duty cycles
-            yield join(check_motor_duty_cycle(1, speeds[1]),
-                       check_motor_duty_cycle(2, speeds[2]),
-                       check_motor_duty_cycle(3, speeds[3]),
-                       check_motor_duty_cycle(4, speeds[4]),
-                       check_motor_duty_cycle(5, speeds[5]),
-                       check_motor_duty_cycle(6, speeds[6]),
-                       check_motor_duty_cycle(7, speeds[7]),
-                       check_motor_duty_cycle(8, speeds[8]))
+            yield check_motors_duty_cycles(speeds)
 
             # Regen random speeds
-            speeds = [intbv(randrange(-2**10, 2**10), min = -2**10, max = 2**10) for i in range(9)]
+            speeds = random_speeds()
 
             # Set all motor speeds together
             yield set_motors_speeds(speeds)
 
             # Check actual duty cycles
-            yield join(check_motor_duty_cycle(1, speeds[1]),
-                       check_motor_duty_cycle(2, speeds[2]),
-                       check_motor_duty_cycle(3, speeds[3]),
-                       check_motor_duty_cycle(4, speeds[4]),
-                       check_motor_duty_cycle(5, speeds[5]),
-                       check_motor_duty_cycle(6, speeds[6]),
-                       check_motor_duty_cycle(7, speeds[7]),
-                       check_motor_duty_cycle(8, speeds[8]))
+            yield check_motors_duty_cycles(speeds)
+
+            # Regen random speeds
+            speeds = random_speeds()
+
+            # Set all motor speeds with the bulk key
+            yield set_motors_speeds_at_once(speeds)
+
+            # Check actual duty cycles
+            yield check_motors_duty_cycles(speeds)
+
+            # Regen random speeds, high enough for half periods
+            speeds = random_speeds(2 * TIME_SCALE)
+
+            # Halve the period of even motors, slow the ticks of all but
+            # motors 4 and 8 down
+            settings = [None] + [(10 - (i + 1) % 2, i % 4) for i in MOT]
+            yield set_motors_speeds_at_once(speeds)
+            yield set_motors_periods(settings)
+
+            # Check actual duty cycles
+            yield check_motors_duty_cycles(speeds, settings)
 
 
         #
@@ -662,105 +501,284 @@ class TestRobotIO(unittest.TestCase):
         #
 
         def get_write_servo_command(number, consign):
-            """ Return an intbv suitable to be sent to the slave to set servo[number] consign """
-            ret = intbv(0)[32:]
-            ret[32:24] = 0xA0 + number  # set servo consign (1 to 8)
-            ret[24:16] = 2              # send 2 bytes
-            ret[16:] = consign          # the value is the new consign
-            return ret
+            """ Return the bytes to send to the slave to set servo[number] consign (from 1) """
+            return klv_write(own_key('servo%d_consign' % number, WRITE), 2, consign)
 
         def set_servo_consign(number, consign):
             """ Set servo[number] consign """
             print 'set servo:', number, '...',
-            master_to_slave = get_write_servo_command(number, consign)
-            slave_to_master = intbv(0)
-            yield spi_transfer(master_to_slave, slave_to_master)
+            yield spi.transfer(get_write_servo_command(number, consign))
             print 'done'
 
         def set_servos_consigns(consigns):
             """ Set all servos consigns in one SPI transfer """
             print 'set all servos'
-            master_to_slave = get_write_servo_command(8, consigns[8])
-            for i in downrange(8, 1):
-                master_to_slave = concat(master_to_slave, get_write_servo_command(i, consigns[i]))
-            slave_to_master = intbv(0)
-            yield spi_transfer(master_to_slave, slave_to_master)
+            master_to_slave = bytearray()
+            for i in reversed(SERVO):
+                master_to_slave += get_write_servo_command(i, consigns[i])
+            yield spi.transfer(master_to_slave)
             print 'done'
 
-        def check_servo_duty_cycle(number, consign):
-            """ Checks that the duty cycle of the servo[number] really corresponds to consign """
-            print 'check servo', number, 'beginning'
-            lines = [None, pwm1_ch0, pwm1_ch1, pwm1_ch2, pwm1_ch3, pwm1_ch4, pwm1_ch5, pwm1_ch6, pwm1_ch7]
-            count = intbv(0)
+        def check_servos_duty_cycles(consigns):
+            """ Checks that the duty cycles of all servos really correspond to consigns[1:] """
+            print 'check servos'
+            lines = [ports[servo_port(i)] for i in SERVO]
 
             # First period is not correct as the counter had already started
             # before the consign was given. Start testing at the second period
-            yield lines[number].negedge # wait for end of PWM waveform of the first period
-            print 'check servo', number, 'wait for the beginning of the period'
-            yield lines[number].posedge # wait for the beginning of the period
-            print 'check servo', number, 'count highs'
+            yield join(*[line.negedge for line in lines]) # wait for end of PWM waveform of the first period
 
-            yield count_high(lines[number], clk25, count)
-            self.assertEquals(count, consign)
-            print 'check servo', number, 'done'
+            measures = []
+            yield measure_pwm(lines, measures)
+            self.assertEquals(measures, [(consign // TIME_SCALE, 500000 // TIME_SCALE) for consign in consigns[1:]])
 
         def test_servos():
+            # there would be no PWM to measure
+            if not SERVO:
+                return
+
             # Generate random consigns for servos
             # respect min/max useful consigns
-            consigns = [intbv(randrange(12500, 62500))[16:] for i in range(9)]
+            consigns = [intbv(randrange(12500, 62500))[16:] for i in range(len(SERVO) + 1)]
 
             # Set servo consigns one at a time
-            for i in range(1, 9):
+            for i in SERVO:
                 yield set_servo_consign(i, consigns[i])
 
             # Check actual duty cycles
-            yield join(check_servo_duty_cycle(1, consigns[1]),
-                       check_servo_duty_cycle(2, consigns[2]),
-                       check_servo_duty_cycle(3, consigns[3]),
-                       check_servo_duty_cycle(4, consigns[4]),
-                       check_servo_duty_cycle(5, consigns[5]),
-                       check_servo_duty_cycle(6, consigns[6]),
-                       check_servo_duty_cycle(7, consigns[7]),
-                       check_servo_duty_cycle(8, consigns[8]))
+            yield check_servos_duty_cycles(consigns)
 
             # Regen random consigns
             # respect min/max useful consigns
-            consigns = [intbv(randrange(12500, 62500))[16:] for i in range(9)]
+            consigns = [intbv(randrange(12500, 62500))[16:] for i in range(len(SERVO) + 1)]
 
             # Set all servo consigns together
             yield set_servos_consigns(consigns)
 
             # Check actual duty cycles
-            yield join(check_servo_duty_cycle(1, consigns[1]),
-                       check_servo_duty_cycle(2, consigns[2]),
-                       check_servo_duty_cycle(3, consigns[3]),
-                       check_servo_duty_cycle(4, consigns[4]),
-                       check_servo_duty_cycle(5, consigns[5]),
-                       check_servo_duty_cycle(6, consigns[6]),
-                       check_servo_duty_cycle(7, consigns[7]),
-                       check_servo_duty_cycle(8, consigns[8]))
+            yield check_servos_duty_cycles(consigns)
+
+
+        #
+        # Stored values
+        #
+
+        # (write key, read key, length, signed) of each stored value
+        STORED_VALUES = [(own_key(f.name, WRITE), own_key(f.name), f.width // 8, f.signed)
+                         for f in register_fields if f.direction == WRITE and f.name.startswith('stored_')]
+
+        def write_value(key, length, value):
+            """ Write length bytes of value with key """
+            print 'write key: 0x%02X' % key, '...',
+            yield spi.transfer(klv_write(key, length, value))
+            print 'done'
+
+        def read_value(key, length, expected_value):
+            """ Read length bytes with key and compare the result bytes to expected_value """
+            print 'read key: 0x%02X' % key, '...',
+            slave_to_master = bytearray()
+            yield spi.transfer(klv_read(key, length), slave_to_master)
+            self.assertEquals(slave_to_master[2:], to_bytes(expected_value, length))
+            print 'done'
+
+        def test_stored_values():
+            # Write random values and read them back
+            for write_key, read_key, length, signed in STORED_VALUES:
+                if signed:
+                    value = intbv(randrange(-2**(length*8-1), 2**(length*8-1)), min = -2**(length*8-1), max = 2**(length*8-1))
+                else:
+                    value = intbv(randrange(2**(length*8)))[length*8:]
+                yield write_value(write_key, length, value)
+                yield read_value(read_key, length, value)
+
+            # Read fixed value
+            yield read_value(own_key('fixed_value'), 4, intbv(0xDEADC0DE)[32:])
+
+            # Read unknown key
+            unknown_key = max(set(range(0x80)) - set(keys(READ, register_fields)))
+            yield read_value(unknown_key, 8, intbv(UNKNOWN_VALUE)[64:])
 
 
         #
         # Tests
         #
 
-        yield test_leds()
-        yield test_adc_ports()
-        yield test_ext_ports()
-        yield test_rc_ports()
-        yield test_motors()
-        if False:
-            yield test_servos()
-        else:
-            print "Skipping servo tests"
+        tests = {
+            'leds': test_leds,
+            'adc_ports': test_adc_ports,
+            'ext_ports': test_ext_ports,
+            'rc_ports': test_rc_ports,
+            'motors': test_motors,
+            'stored_values': test_stored_values,
+            'servos': test_servos,
+        }
+        for scenario in scenarios:
+            yield tests[scenario]()
 
         raise StopSimulation();
 
-    def testRobotIO(self):
-        """ Test RobotIO """
-        sim = Simulation(TestBench(self.RobotIOTester))
+    def simulate(self, scenario, tracer = None, config = DEFAULT):
+        """ Run scenario in its own simulation of RobotIO with the channels of config """
+        tester = partial(self.RobotIOTester, config, scenarios = [scenario])
+        sim = Simulation(TestBench(tester, TIME_SCALE, tracer, config))
         sim.run()
 
+    def testLEDs(self):
+        """ Test RobotIO LEDs """
+        self.simulate('leds')
+
+    def testADCPorts(self):
+        """ Test RobotIO ADC channels """
+        self.simulate('adc_ports')
+
+    def testExtPorts(self):
+        """ Test RobotIO ext ports """
+        self.simulate('ext_ports')
+
+    def testRCPorts(self):
+        """ Test RobotIO odometers and pose """
+        self.simulate('rc_ports')
+
+    def testMotors(self):
+        """ Test RobotIO motors """
+        self.simulate('motors')
+
+    def testStoredValues(self):
+        """ Test RobotIO stored values """
+        self.simulate('stored_values')
+
+    def testServos(self):
+        """ Test RobotIO servos """
+        self.simulate('servos')
+
+    def testLargeConfig(self):
+        """ Test RobotIO odometers, pose and motors with the channels of the LARGE config """
+        for scenario in ['rc_ports', 'motors']:
+            self.simulate(scenario, config = LARGE)
+
+    def testSmallConfig(self):
+        """ Test RobotIO with the channels of the SMALL config (16-bit odometers, no servos nor ext ports) """
+        for scenario in ['rc_ports', 'motors', 'ext_ports', 'servos']:
+            self.simulate(scenario, config = SMALL)
+
+def run_scenario(args):
+    """ Run a scenario in the current process (see run_scenarios)
+
+    args -- (scenario, seed, trace, coverage, config) tuple, trace is None,
+            'all' or the (patterns, start, end) of a SelectiveTracer,
+            coverage is True to record the KLV coverage of the scenario,
+            config gives the channels of RobotIO
+    Return (scenario, seed, error, duration, log, counts) where error is
+    None or the traceback of the failure, log is the output of the scenario
+    and counts is None or its KLV coverage (see KLVCoverage).
+
+    """
+    scenario, seed, trace, coverage, config = args
+    if trace == 'all':
+        traceSignals.name = 'RobotIO_' + scenario
+        tracer = traceSignals
+    elif trace is not None:
+        tracer = SelectiveTracer('RobotIO_%s.vcd.gz' % scenario, *trace)
+    else:
+        tracer = None
+    klv_coverage = KLVCoverage(tracer) if coverage else None
+
+    random.seed(seed)
+    log = StringIO()
+    stdout, sys.stdout = sys.stdout, log
+    start = time.time()
+    try:
+        TestRobotIO('simulate').simulate(scenario, klv_coverage or tracer, config)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        sys.stdout = stdout
+        if isinstance(tracer, SelectiveTracer):
+            tracer.close()
+    counts = klv_coverage.counts if coverage else None
+    return scenario, seed, error, time.time() - start, log.getvalue(), counts
+
+def run_scenarios(scenarios, seed, jobs, trace, coverage = None, config = DEFAULT):
+    """ Run scenarios in a pool of jobs processes, print a report
+
+    Each scenario has its own simulation of RobotIO with the channels of
+    config, seeded with seed and traced as specified by trace (see
+    run_scenario) in RobotIO_<scenario>.vcd, or RobotIO_<scenario>.vcd.gz
+    for a selective trace. If coverage is given,
+    the KLV coverage of each scenario is saved in this JSON file.
+    Return True if all scenarios passed.
+
+    """
+    tasks = [(scenario, seed, trace, coverage is not None, config) for scenario in scenarios]
+    start = time.time()
+    if jobs > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.map(run_scenario, tasks, 1)
+        pool.close()
+        pool.join()
+    else:
+        results = map(run_scenario, tasks)
+    wall = time.time() - start
+
+    failures = [r for r in results if r[2] is not None]
+    for scenario, seed, error, duration, log, counts in failures:
+        print '=' * 70
+        print 'FAIL: %s (seed %d)' % (scenario, seed)
+        print '-' * 70
+        print log + error
+    for scenario, seed, error, duration, log, counts in results:
+        print '%-16s %-4s %6.1fs' % (scenario, 'FAIL' if error else 'ok', duration)
+    print '-' * 70
+    print 'Ran %d scenarios in %.1fs (%.1fs in simulations), %d jobs, seed %d' % \
+          (len(results), wall, sum(r[3] for r in results), jobs, seed)
+    if coverage is not None:
+        save(coverage, dict(('RobotIO %s' % r[0], r[5]) for r in results))
+        print 'KLV coverage saved in', coverage
+    print 'FAILED (failures=%d)' % len(failures) if failures else 'OK'
+    return not failures
+
 if __name__ == '__main__':
-    unittest.main()
+    parser = OptionParser(usage = 'usage: %prog [options] [scenario...]',
+                          description = 'Run RobotIO test scenarios in parallel: %s.' % ', '.join(SCENARIOS))
+    parser.add_option('-j', '--jobs', type = 'int', default = multiprocessing.cpu_count(),
+                      help = 'number of processes (default: number of CPUs)')
+    parser.add_option('-s', '--seed', type = 'int', default = random.randrange(2**31),
+                      help = 'random seed of the scenarios (default: random)')
+    parser.add_option('--vcd', action = 'store_true', default = False,
+                      help = 'trace all signals of each scenario in RobotIO_<scenario>.vcd')
+    parser.add_option('-t', '--trace', action = 'append', default = [], metavar = 'PATTERN',
+                      help = 'trace the signals matching PATTERN, like RobotIO.Motor_inst_0.*, or '
+                             'the signals of a subsystem (%s), in RobotIO_<scenario>.vcd.gz; '
+                             'can be repeated' % ', '.join(sorted(TRACE_GROUPS)))
+    parser.add_option('--trace-start', type = 'int', default = 0, metavar = 'N',
+                      help = 'start tracing after N clk25 periods')
+    parser.add_option('--trace-end', type = 'int', default = None, metavar = 'N',
+                      help = 'stop tracing after N clk25 periods')
+    parser.add_option('-c', '--config', type = 'choice', choices = sorted(VARIANTS), default = 'default',
+                      help = 'channel counts of RobotIO: %s (default: %%default, see '
+                             'Robot.Utils.Config)' % ', '.join(sorted(VARIANTS)))
+    parser.add_option('--coverage', metavar = 'JSON',
+                      help = 'save the KLV coverage of each scenario in JSON (see CoverageUtils.py)')
+    options, scenarios = parser.parse_args()
+    if options.coverage and options.config != 'default':
+        parser.error('the KLV coverage is only recorded for the default config')
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error('unknown scenario: %s' % scenario)
+
+    if options.vcd:
+        trace = 'all'
+    elif options.trace:
+        patterns = []
+        for pattern in options.trace:
+            patterns += TRACE_GROUPS.get(pattern, [pattern])
+        trace = (patterns,
+                 options.trace_start * CLK_PERIOD,
+                 options.trace_end * CLK_PERIOD if options.trace_end is not None else None)
+    else:
+        trace = None
+
+    if not run_scenarios(scenarios or SCENARIOS, options.seed, options.jobs, trace, options.coverage,
+                         VARIANTS[options.config]):
+        sys.exit(1)
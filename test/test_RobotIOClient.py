@@ -0,0 +1,98 @@
+import sys
+sys.path.append('../lib')
+
+import unittest
+
+from Robot.Host.Client import RobotIOClient
+from Robot.Host.Transport import ModelTransport
+from Robot.Model import RobotIOModel
+from Robot.Utils.Config import SMALL
+from Robot.Utils.Constants import CLK_FREQ
+from TestUtils import klv_read, klv_write
+
+class TestRobotIOClient(unittest.TestCase):
+
+    def testBatch(self):
+        """ Check the bytes of a batch against the KLV commands of the test benches """
+        client = RobotIOClient(None, size = 64)
+        for i in range(2):
+            client.clear()
+            client.write('motor1_speed', -100)
+            client.read('rc2_count')
+            client.write_key(0x90, *range(-4, 4))
+            client.read_key(0x10)
+            client.write('led_green_consign', 1)
+        speeds = 0
+        for i, speed in enumerate(range(-4, 4)):
+            speeds |= (speed & 0x7FF) << (11 * i)
+        self.assertEquals(client.tx[:client.length],
+                          klv_write(0x91, 2, -100 & 0x7FF) + klv_read(0x12, 4) + klv_write(0x90, 11, speeds) +
+                          klv_read(0x10, 16) + klv_write(0x82, 1, 1))
+        self.assertEquals(client.reads, 2)
+
+    def testModel(self):
+        """ Write and read RobotIOModel in one batch """
+        model = RobotIOModel()
+        client = RobotIOClient(ModelTransport(model).transfer)
+        model.move(1, -1000)
+        model.move(2, 70000)
+        model.adc_inputs = [100 * i for i in range(8)]
+        model.advance(CLK_FREQ // 100)
+
+        client.write('motor2_speed', -1024)
+        client.write('stored_int16', -2)
+        client.write_key(0xD1, 1)
+        counts = [client.read('rc%d_count' % i) for i in range(1, 5)]
+        snapshot = client.read_key(0x10)
+        timestamp = client.read_key(0x19)
+        adc = [client.read('adc1_ch%d_value' % i) for i in range(8)]
+        adc_all = client.read_key(0x58)
+        stored = client.read('stored_int16')
+        fixed = client.read('fixed_value')
+        client.send()
+
+        self.assertEquals([client.value(i) for i in counts], [-1000, 70000, 0, 0])
+        self.assertEquals(client.values(snapshot), [-1000, 70000, 0, 0])
+        self.assertEquals(client.value(snapshot, 'rc2_snapshot'), 70000)
+        self.assertEquals(client.value(timestamp, 'rc1_snapshot'), -1000)
+        self.assertTrue(CLK_FREQ // 100 < client.value(timestamp, 'timestamp') < model.time)
+        self.assertEquals([client.value(i) for i in adc], model.adc_inputs)
+        self.assertEquals(client.values(adc_all), model.adc_inputs)
+        self.assertEquals(client.value(stored), -2)
+        self.assertEquals(client.value(fixed), 0xDEADC0DE)
+        self.assertEquals(model.registers['pose_left'], 1)
+        model.advance(1024)
+        self.assertEquals(model.motor(2), -1023)
+
+        # the next batch reuses the buffers
+        client.clear()
+        client.write('motor2_speed', 5)
+        stored = client.read('stored_int16')
+        client.send()
+        self.assertEquals(client.value(stored), -2)
+        self.assertEquals(model.registers['motor2_speed'], 5)
+
+    def testConfig(self):
+        """ Check that the client follows the register map of its config """
+        model = RobotIOModel(config = SMALL)
+        client = RobotIOClient(ModelTransport(model).transfer, SMALL)
+        model.move(2, -3)
+        count = client.read('rc2_count')
+        client.send()
+        self.assertEquals(client.value(count), -3)
+        self.assertRaises(KeyError, client.read, 'rc3_count')
+
+    def testErrors(self):
+        """ Check that wrong commands are refused """
+        client = RobotIOClient(None, size = 10)
+        self.assertRaises(ValueError, client.write_key, 0x90, 1, 2)
+        self.assertRaises(KeyError, client.write, 'rc1_count', 0)
+        self.assertRaises(KeyError, client.read, 'rc1_snapshot')
+        client.read('rc1_count')
+        self.assertRaises(ValueError, client.read, 'rc1_count')
+        self.assertEquals((client.length, client.reads), (6, 1))
+        client.clear()
+        self.assertRaises(ValueError, client.value, client.read_key(0x1A))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import sys
+sys.path.append('../lib')
+
+import os
+import unittest
+
+from functools import partial
+from myhdl import Simulation, StopSimulation, delay, now
+from random import randrange
+from Robot.Model import RobotIOModel
+from Robot.Utils.Config import DEFAULT
+from Robot.Utils.Constants import CLK_FREQ
+from TestUtils import CLK_PERIOD, SPIMaster, fake_mcp3008
+from test_KLVStress import KLVGenerator, timestamp_errors
+from test_RobotIO import ADC_SCAN_FREQ, TestBench
+
+# number of random frames sent to RobotIO and to the model
+CROSS_CHECK_FRAMES = 20
+
+# environment variable giving the seed of testCrossCheck, random if unset;
+# the seed of a failure replays it:
+#   python test_RobotIOModel.py TestRobotIOModel.testCrossCheck SEED
+# or
+#   CROSS_CHECK_SEED=SEED python -m unittest test_RobotIOModel
+SEED_VARIABLE = 'CROSS_CHECK_SEED'
+
+# the test bench sends one SPI bit every 10 clk25 periods
+SPI_FREQ = CLK_FREQ // 10
+
+# RobotIO latches the timestamp up to half an SPI bit before the model (see
+# test_KLVStress)
+TIMESTAMP_SLACK = CLK_FREQ // SPI_FREQ // 2
+
+class TestRobotIOModel(unittest.TestCase):
+
+    def testModel(self):
+        """ Test the model alone """
+        model = RobotIOModel(spi_freq = SPI_FREQ)
+
+        # stored values, fixed value and unknown key
+        self.assertEquals(list(model.transfer([0xF6, 4, 0x80, 1, 2, 3, 0x76, 4, 0, 0, 0, 0])),
+                          [0] * 8 + [0x80, 1, 2, 3])
+        self.assertEquals(model.registers['stored_int32'], -0x7FFEFDFD)
+        self.assertEquals(list(model.transfer([0x42, 4, 0, 0, 0, 0])), [0, 0, 0xDE, 0xAD, 0xC0, 0xDE])
+        self.assertEquals(list(model.transfer([0x7F, 2, 0, 0])), [0, 0, 0xF0, 0x0D])
+
+        # a command may continue in the next frame
+        model.transfer([0xF1, 1])
+        model.transfer([0x42, 0x71, 1])
+        self.assertEquals(list(model.transfer([0])), [0x42])
+
+        # motor speeds apply at the start of the next PWM period
+        model.transfer([0x90, 11] + [0] * 9 + [0x07, 0xFF])
+        self.assertEquals(model.motor(1), 0)
+        model.advance(1024)
+        self.assertEquals([model.motor(i) for i in range(1, 9)], [-1] + [0] * 7)
+
+        # the periods of the motors are spread over the PWM period: the one
+        # of motor 2 starts 128 clk25 periods after the one of motor 1
+        model.write(0x81, 0)
+        model.write(0x92, 16)
+        model.advance(127)
+        self.assertEquals(model.motor(2), 0)
+        model.advance(1)
+        self.assertEquals(model.motor(2), 16)
+
+        # so do their PWM resolutions and prescalers: 2**8 ticks of 2**1
+        # clk25 periods for motor 2
+        model.write(0xCA, 8)
+        model.write(0xE2, 1)
+        model.write(0x92, 32)
+        model.advance(1023)
+        self.assertEquals((model.motor(2), model.motor_period(2)), (16, 1024))
+        model.advance(1)
+        self.assertEquals((model.motor(2), model.motor_period(2)), (32, 512))
+        # speeds lose the bits the resolution drops
+        model.write(0x92, 50)
+        model.advance(511)
+        self.assertEquals(model.motor(2), 32)
+        model.advance(1)
+        self.assertEquals(model.motor(2), 48)
+
+        # a longer period starts with one of its own: 2048 clk25 periods
+        # from the first period of motor 2 after reset
+        model.write(0xCA, 10)
+        model.advance(511)
+        self.assertEquals((model.motor(2), model.motor_period(2)), (48, 512))
+        model.advance(1)
+        self.assertEquals((model.motor(2), model.motor_period(2)), (50, 2048))
+
+        # odometers, velocity and pose: forward at 10000 ticks per second
+        model.set_speed(1, 10000)
+        model.set_speed(2, 10000)
+        model.advance(CLK_FREQ // 10)
+        self.assertAlmostEquals(model.count(1), 1000, delta = 1)
+        self.assertEquals(model.read(0x21), 100)
+        self.assertEquals(model.read(0x25), 2500)
+        model.transfer([0x60, 12] + [0] * 12)
+        self.assertAlmostEquals(model.registers['pose_x_snapshot'] / 256.0, 1000, delta = 1)
+        self.assertEquals(model.registers['pose_y_snapshot'], 0)
+
+        # reset
+        model.transfer([0x81, 1, 0])
+        self.assertEquals(model.count(1), 0)
+        self.assertEquals(model.registers['stored_int32'], -0x7FFEFDFD)
+
+    def RobotIOTester(self, seed, config, **ports):
+
+        generator = KLVGenerator(seed, config = config)
+        model = RobotIOModel(adc_scan_freq = ADC_SCAN_FREQ, spi_freq = SPI_FREQ, config = config)
+        spi = SPIMaster(ports['sspi_clk'], ports['sspi_mosi'], ports['sspi_miso'], ports['sspi_cs'], freq = SPI_FREQ)
+        adc1_clk, adc1_cs, adc1_miso, adc1_mosi = [ports['adc1_' + n] for n in ('clk', 'cs', 'miso', 'mosi')]
+
+        def cross_check(frame, mask):
+            """ Send frame to RobotIO and to the model and compare the answers """
+            slave_to_master = bytearray()
+
+            # the first bit is sent 30 clk25 periods after the transfer starts
+            model.advance(now() // CLK_PERIOD + 30 - model.time)
+            expected = model.transfer(frame)
+
+            yield spi.transfer(frame, slave_to_master)
+            errors = timestamp_errors(mask, expected, slave_to_master, TIMESTAMP_SLACK)
+            self.assertFalse(errors, 'seed %d, frame %s: %s' % (seed, ['0x%02X' % x for x in frame], errors))
+            for i, b in enumerate(expected):
+                if not mask[i]:
+                    self.assertEquals(slave_to_master[i], b,
+                                      'seed %d, byte %d of frame %s: 0x%02X, expected 0x%02X' %
+                                      (seed, i, ['0x%02X' % x for x in frame], slave_to_master[i], b))
+
+        # same inputs for RobotIO and the model
+        ext_lines = [[ports['ext%d_%d' % (i, j)] for j in range(8)] for i in range(1, config.ext_ports + 1)]
+        for i, lines in enumerate(ext_lines):
+            model.ext_inputs[i] = generator.random.randrange(256)
+            for j, line in enumerate(lines):
+                line.next = (model.ext_inputs[i] >> j) & 1
+
+        model.adc_inputs = [generator.random.randrange(2**10) for i in range(8)]
+        channels = []
+        yield fake_mcp3008(model.adc_inputs, adc1_clk, adc1_cs, adc1_miso, adc1_mosi, channels), delay(0)
+
+        # wait for a whole scan so that the ADC values do not depend on time
+        while len(channels) < 9:
+            yield adc1_cs.posedge
+
+        for frame, mask in generator.frames(CROSS_CHECK_FRAMES):
+            yield cross_check(frame, mask)
+
+        raise StopSimulation()
+
+    def testCrossCheck(self):
+        """ Compare the model with RobotIO on random frames """
+        seed = int(os.environ.get(SEED_VARIABLE) or randrange(2**31))
+        print 'seed', seed
+        sim = Simulation(TestBench(partial(self.RobotIOTester, seed, DEFAULT)))
+        sim.run()
+
+if __name__ == '__main__':
+    # python test_RobotIOModel.py [unittest options] [SEED]
+    if len(sys.argv) > 1 and sys.argv[-1].isdigit():
+        os.environ[SEED_VARIABLE] = sys.argv.pop()
+    unittest.main()
@@ -0,0 +1,82 @@
+import sys
+sys.path.append('../lib')
+
+import unittest
+
+from myhdl import Signal, Simulation, StopSimulation, downrange, instance
+from Robot.Utils.Constants import LOW, HIGH
+from TestUtils import SPIMaster
+
+# bytes of the master and of the slave, their bits differ in each position
+MASTER_BYTES = [0xA5, 0x0F, 0x81]
+SLAVE_BYTES = [0x5A, 0xF0, 0x7E]
+
+def SPISlave(sclk, mosi, miso, ss_n, mode, answer, received, errors):
+    """ Model of an SPI slave, independent of SPIMaster
+
+    The slave checks that the clock is idle when ss_n changes, and moves
+    its bits on the edges given by mode: with CPHA=0 the first bit is out
+    when ss_n goes low, bits are sampled on the leading edges and the next
+    ones are out on the trailing edges, with CPHA=1 bits are out on the
+    leading edges and sampled on the trailing ones.
+
+    answer -- bytes sent to the master
+    received -- list set to the bytes received
+    errors -- list of the protocol errors seen
+
+    """
+    cpol, cpha = mode >> 1, mode & 1
+
+    @instance
+    def Slave():
+        out = [(b >> i) & 1 for b in answer for i in downrange(8)]
+        bits = []
+        yield ss_n.negedge
+        if sclk != cpol:
+            errors.append('clock not idle at start')
+        if not cpha:
+            miso.next = out.pop(0)
+        while True:
+            yield sclk.posedge, sclk.negedge, ss_n.posedge
+            if ss_n == HIGH:
+                break
+            leading = sclk != cpol
+            if leading != bool(cpha):
+                bits.append(int(mosi))
+            elif out:
+                miso.next = out.pop(0)
+        if sclk != cpol:
+            errors.append('clock not idle at end')
+        if len(bits) % 8:
+            errors.append('%d bits received' % len(bits))
+        received[:] = [int(''.join(str(b) for b in bits[i:i + 8]), 2) for i in range(0, len(bits), 8)]
+
+    return Slave
+
+class TestSPIMaster(unittest.TestCase):
+
+    def loopback(self, mode):
+        """ Exchange bytes between SPIMaster and the slave model in mode """
+        sclk, mosi, miso, ss_n = Signal(LOW), Signal(LOW), Signal(LOW), Signal(HIGH)
+        spi = SPIMaster(sclk, mosi, miso, ss_n, mode = mode)
+        from_master, from_slave, errors = [], bytearray(), []
+
+        @instance
+        def Master():
+            yield spi.transfer(MASTER_BYTES, from_slave)
+            # let the slave see the end of the frame
+            yield spi.transfer([])
+            raise StopSimulation()
+
+        Simulation(Master, SPISlave(sclk, mosi, miso, ss_n, mode, SLAVE_BYTES, from_master, errors)).run(quiet = 1)
+        self.assertEquals(errors, [], 'mode %d: %s' % (mode, errors))
+        self.assertEquals(from_master, MASTER_BYTES, 'mode %d' % mode)
+        self.assertEquals(list(from_slave), SLAVE_BYTES, 'mode %d' % mode)
+
+    def testModes(self):
+        """ Check the clock polarity and the edges of each SPI mode """
+        for mode in range(4):
+            self.loopback(mode)
+
+if __name__ == '__main__':
+    unittest.main()
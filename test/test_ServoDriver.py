@@ -3,18 +3,30 @@ sys.path.append('../lib')
 
 import unittest
 
-from myhdl import Signal, Simulation, StopSimulation, delay, intbv, join
+from myhdl import Signal, Simulation, StopSimulation, delay, intbv
 from random import randrange
-from Robot.Device.Servo import ServoDriver
+from Robot.Device.Servo import ServoBank, ServoDriver
 from Robot.Utils.Constants import LOW, HIGH
-from TestUtils import ClkGen, count_high
+from TestUtils import ClkGen, measure_pwm
 
 NR_TESTS = 2
 NR_PERIODS_PER_TEST = 2
 
-def TestBench(ServoTester):
+# a period lasts 500000 clk periods without time scale: check one only,
+# the random consigns are left to the time scaled test
+NR_UNSCALED_TESTS = 1
+
+# a period lasts 5000 clk periods instead of 500000 with this time scale
+TIME_SCALE = 100
+NR_TIME_SCALE_TESTS = 10
+
+# number of outputs of the tested ServoBank
+NR_CHANNELS = 5
+
+def TestBench(ServoTester, time_scale = 1):
     """ Instanciate modules and wire things up.
     ServoTester -- test module to instanciate with ServoDriver and ClkGen
+    time_scale -- time scale of ServoDriver
     """
 
     # create signals with default values
@@ -24,44 +36,98 @@ def TestBench(ServoTester):
     rst_n = Signal(HIGH)
 
     # instanciate modules
-    ServoDriver_inst = ServoDriver(pwm, clk, consign, rst_n, False)
-    ServoTester_inst = ServoTester(pwm, clk, consign, rst_n)
+    ServoDriver_inst = ServoDriver(pwm, clk, consign, rst_n, False, time_scale)
+    ServoTester_inst = ServoTester(pwm, clk, consign, rst_n, time_scale)
     ClkGen_inst = ClkGen(clk)
 
     return ServoDriver_inst, ServoTester_inst, ClkGen_inst
 
+def BankTestBench(BankTester, time_scale):
+    """ Instanciate modules and wire things up.
+    BankTester -- test module to instanciate with ServoBank and ClkGen
+    time_scale -- time scale of ServoBank
+    """
+
+    # create signals with default values
+    pwms = [Signal(LOW) for i in range(NR_CHANNELS)]
+    clk = Signal(LOW)
+    consigns = [Signal(intbv(0)[16:]) for i in range(NR_CHANNELS)]
+    rst_n = Signal(HIGH)
+
+    # instanciate modules
+    ServoBank_inst = ServoBank(pwms, clk, consigns, rst_n, False, time_scale)
+    BankTester_inst = BankTester(pwms, clk, consigns, rst_n, time_scale)
+    ClkGen_inst = ClkGen(clk)
+
+    return ServoBank_inst, BankTester_inst, ClkGen_inst
+
 class TestServoDriver(unittest.TestCase):
 
-    def ServoTester(self, pwm, clk, consign, rst_n):
+    def ServoTester(self, pwm, clk, consign, rst_n, time_scale):
         def stimulus(dcl):
             consign.next = intbv(dcl)[16:] # duty cycle
 
         def check(dcl):
-            count = intbv(0)
-            yield count_high(pwm, clk, count)
-            self.assertEquals(count, dcl)
+            measures = []
+            yield measure_pwm([pwm], measures)
+            # high time and period are divided by time_scale, rounded down
+            self.assertEquals(measures, [(dcl // time_scale, 500000 // time_scale)])
 
-        for i in range(NR_TESTS):
+        for i in range(NR_UNSCALED_TESTS if time_scale == 1 else NR_TIME_SCALE_TESTS):
             dcl = randrange(12500, 62500) # min/max useful consigns
-            print 'ask for a PWM with duty cycle:', dcl, '/ 500000'
+            print 'ask for a PWM with duty cycle:', dcl, '/ 500000', '(time scale: %d)' % time_scale
 
-            # First period is not correct as the counter had already started
-            # before the consign was given. Start testing at the second period
+            # The counter had already started before the consign was given:
+            # reset it so that the next period starts with the new consign
             yield stimulus(dcl) # set consign
-            yield pwm.negedge # wait for end of PWM waveform of the first period
+            rst_n.next = LOW
+            yield clk.negedge
+            rst_n.next = HIGH
 
             for j in range(NR_PERIODS_PER_TEST - 1):
-                yield pwm.posedge # wait for the beginning of the period
-                yield check(dcl) # check the number of 'high's in this period
+                yield check(dcl) # check the high time and period
 
         print 'DONE'
 
         raise StopSimulation()
 
     def testServoDriver(self):
-        """ Test ServoDriver """
+        """ Test one period of ServoDriver without time scale """
         sim = Simulation(TestBench(self.ServoTester))
         sim.run()
 
+    def testServoDriverTimeScale(self):
+        """ Test ServoDriver with a time scale """
+        sim = Simulation(TestBench(self.ServoTester, TIME_SCALE))
+        sim.run()
+
+    def BankTester(self, pwms, clk, consigns, rst_n, time_scale):
+        for i in range(NR_TESTS):
+            dcls = [randrange(12500, 62500) for consign in consigns]
+            print 'ask for PWMs with duty cycles:', dcls, '/ 500000', '(time scale: %d)' % time_scale
+            for consign, dcl in zip(consigns, dcls):
+                consign.next = dcl
+
+            # the new consigns are applied at the start of the next period
+            measures = []
+            yield measure_pwm(pwms, measures)
+            yield measure_pwm(pwms, measures)
+            self.assertEquals(measures, [(dcl // time_scale, 500000 // time_scale) for dcl in dcls])
+
+        # reset: all outputs low until the end of the reset
+        rst_n.next = LOW
+        yield clk.negedge
+        self.assertEquals([int(pwm) for pwm in pwms], [LOW] * NR_CHANNELS)
+        rst_n.next = HIGH
+
+        print 'DONE'
+
+        raise StopSimulation()
+
+    def testServoBank(self):
+        """ Test ServoBank with a time scale, all outputs with their own consign """
+        sim = Simulation(BankTestBench(self.BankTester, TIME_SCALE))
+        sim.run()
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,141 @@
+import sys
+sys.path.append('../lib')
+
+import unittest
+
+from myhdl import Signal, Simulation, StopSimulation, instance, intbv
+from Robot.ControlSystem.Speed import SpeedControl
+from Robot.Utils.Constants import LOW, HIGH
+from TestUtils import ClkGen
+
+# the loop runs every 256 clk25 periods
+STROBE_PERIOD = 256
+
+# fractional bits of speeds
+SHIFT = 8
+
+# the fake motor moves by speed/2**13 ticks per clk25 period
+MOTOR_SHIFT = 13
+
+def FakeMotor(count, speed, clk):
+    """ Move count proportionally to speed, like a motor and its odometer """
+
+    @instance
+    def Move():
+        phase = 0
+        while True:
+            yield clk.posedge
+            phase += int(speed)
+            if phase >= 2**MOTOR_SHIFT:
+                phase -= 2**MOTOR_SHIFT
+                count.next = count + 1
+            elif phase <= -2**MOTOR_SHIFT:
+                phase += 2**MOTOR_SHIFT
+                count.next = count - 1
+
+    return Move
+
+def TestBench(SpeedTester):
+    """ Instanciate modules and wire things up.
+    SpeedTester -- test module to instanciate with SpeedControl, FakeMotor and ClkGen
+    """
+
+    speed = Signal(intbv(0, min = -2**10, max = 2**10))
+    count = Signal(intbv(0, min = -2**31, max = 2**31))
+    consign = Signal(intbv(0, min = -2**15, max = 2**15))
+    gain_P = Signal(intbv(0)[16:])
+    gain_I = Signal(intbv(0)[16:])
+    gain_D = Signal(intbv(0)[16:])
+    out_shift = Signal(intbv(0)[6:])
+    max_I = Signal(intbv(0)[24:])
+    accel = Signal(intbv(0)[16:])
+    decel = Signal(intbv(0)[16:])
+    strobe = Signal(LOW)
+    clk = Signal(LOW)
+    rst_n = Signal(HIGH)
+
+    @instance
+    def DriveStrobe():
+        cnt = 0
+        while True:
+            yield clk.posedge
+            cnt = (cnt + 1) % STROBE_PERIOD
+            strobe.next = cnt == 0
+
+    # instanciate modules
+    SpeedControl_inst = SpeedControl(speed, count, consign,
+                                     gain_P, gain_I, gain_D, out_shift, max_I, accel, decel,
+                                     strobe, clk, rst_n, SHIFT)
+    SpeedTester_inst = SpeedTester(speed, count, consign,
+                                   gain_P, gain_I, gain_D, out_shift, max_I, accel, decel,
+                                   strobe, clk, rst_n)
+    FakeMotor_inst = FakeMotor(count, speed, clk)
+    ClkGen_inst = ClkGen(clk)
+
+    return SpeedControl_inst, SpeedTester_inst, DriveStrobe, FakeMotor_inst, ClkGen_inst
+
+class TestSpeedControl(unittest.TestCase):
+
+    def SpeedTester(self, speed, count, consign,
+                    gain_P, gain_I, gain_D, out_shift, max_I, accel, decel,
+                    strobe, clk, rst_n):
+
+        def wait_strobes(n):
+            """ Wait for n runs of the loop """
+            for i in range(n):
+                yield strobe.posedge
+
+        def check_speed(ticks):
+            """ Set the consign to ticks per strobe period and check the actual speed """
+            print 'consign', ticks, 'ticks per strobe period...',
+            consign.next = ticks * 2**SHIFT
+
+            # settle
+            yield wait_strobes(60)
+
+            # check the mean speed over 20 strobe periods
+            start = int(count)
+            yield wait_strobes(20)
+            self.assertTrue(abs(int(count) - start - 20 * ticks) <= 2)
+            print 'done'
+
+        # PI filter
+        gain_P.next = 64
+        gain_I.next = 8
+        out_shift.next = 8
+        max_I.next = 2**20
+        accel.next = 2**SHIFT
+        decel.next = 2**SHIFT
+
+        # reset
+        rst_n.next = LOW
+        yield clk.posedge
+        rst_n.next = HIGH
+        self.assertEquals(speed, 0)
+
+        # ramp: the consign filter moves by accel per strobe
+        consign.next = 20 * 2**SHIFT
+        yield wait_strobes(3)
+        self.assertTrue(speed > 0)
+
+        yield check_speed(20)
+        yield check_speed(5)
+        yield check_speed(-10)
+
+        # stopped when reset
+        rst_n.next = LOW
+        yield clk.posedge
+        yield clk.posedge
+        self.assertEquals(speed, 0)
+
+        print 'DONE'
+
+        raise StopSimulation()
+
+    def testSpeedControl(self):
+        """ Ensures that the speed follows the consign """
+        sim = Simulation(TestBench(self.SpeedTester))
+        sim.run()
+
+if __name__ == '__main__':
+    unittest.main()
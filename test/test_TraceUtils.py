@@ -0,0 +1,75 @@
+import sys
+sys.path.append('../lib')
+
+import os
+import unittest
+
+from myhdl import Signal, Simulation, StopSimulation, instance, intbv
+from Robot.Device.Odometer import OdometerReader
+from Robot.Utils.Constants import LOW, HIGH
+from TestUtils import ClkGen, quadrature_encode
+from TraceUtils import SelectiveTracer
+
+# the encoder moves by one tick every 10 time units from 0 to 400
+STEPS = 40
+
+# recorded window
+START = 100
+END = 300
+
+VCD_FILE = 'TraceUtils.vcd'
+
+def TestBench(a, b, clk, rst_n):
+    """ Two odometers reading the same encoder, moved by the test """
+    counts = [Signal(intbv(0, min = -2**10, max = 2**10)) for i in range(2)]
+    Odometer_inst = [OdometerReader(counts[i], a, b, clk, rst_n) for i in range(2)]
+    ClkGen_inst = ClkGen(clk)
+
+    @instance
+    def Move():
+        yield quadrature_encode(STEPS, a, b)
+        raise StopSimulation()
+
+    return Odometer_inst, ClkGen_inst, Move
+
+def read_vcd(filename):
+    """ Return the hierarchical names of the variables of a VCD file, and its times """
+    names = []
+    times = []
+    scope = []
+    with open(filename) as f:
+        for line in f:
+            words = line.split()
+            if words[:1] == ['$scope']:
+                scope.append(words[2])
+            elif words[:1] == ['$upscope']:
+                scope.pop()
+            elif words[:1] == ['$var']:
+                names.append('.'.join(scope + [words[4]]))
+            elif line.startswith('#'):
+                times.append(int(line[1:]))
+    return names, times
+
+class TestTraceUtils(unittest.TestCase):
+
+    def testSelectiveTracer(self):
+        """ Trace the signals matching the patterns between start and end """
+        tracer = SelectiveTracer(VCD_FILE, ['TestBench.a', 'TestBench.Odometer_inst_1.c*'], START, END)
+        sim = Simulation(tracer(TestBench, Signal(LOW), Signal(LOW), Signal(LOW), Signal(HIGH)))
+        sim.run(quiet = 1)
+        tracer.close()
+        names, times = read_vcd(VCD_FILE)
+        os.remove(VCD_FILE)
+
+        # the clock is traced in the scope of the odometer only
+        self.assertEquals(names, ['TestBench.a', 'TestBench.Odometer_inst_1.clk25',
+                                  'TestBench.Odometer_inst_1.count'])
+
+        # initial values at start, then the changes until end
+        self.assertEquals(times[0], START)
+        self.assertEquals(times, sorted(times))
+        self.assertTrue(times[-1] <= END)
+        self.assertTrue(len(times) > 1)
+
+if __name__ == '__main__':
+    unittest.main()
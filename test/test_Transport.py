@@ -0,0 +1,105 @@
+import sys
+sys.path.append('../lib')
+
+import unittest
+
+from myhdl import Simulation, instance
+from Robot.Host.Client import RobotIOClient
+from Robot.Host.Transport import ModelTransport, Transport
+from Robot.Model import RobotIOModel
+from Robot.Utils.Config import DEFAULT
+from Robot.Utils.Constants import CLK_FREQ
+from TestUtils import CLK_PERIOD, SPIMaster
+from test_RobotIO import TestBench
+
+# each SPI clock phase lasts 2 clk25 periods
+SPI_FREQ = CLK_FREQ // 4
+
+class SimulationTransport(Transport):
+    """ Transport to the MyHDL simulation of RobotIO (see test_RobotIO)
+
+    The simulation runs while a frame is transferred, and with sleep().
+
+    spi_freq -- frequency of the SPI clock, in simulated time
+    config -- channel counts of RobotIO (see Robot.Utils.Config)
+
+    """
+
+    def __init__(self, spi_freq = SPI_FREQ, config = DEFAULT):
+        Transport.__init__(self, spi_freq)
+        self.frame = None
+        self.answer = bytearray()
+        self.sim = Simulation(TestBench(self.Master, config = config))
+
+    def Master(self, clk25, sspi_clk, sspi_cs, sspi_miso, sspi_mosi, **ports):
+        """ Sends the frame of the current transfer """
+        spi = SPIMaster(sspi_clk, sspi_mosi, sspi_miso, sspi_cs, freq = self.spi_freq)
+
+        @instance
+        def SendFrames():
+            while True:
+                yield clk25.posedge
+                if self.frame is not None:
+                    yield spi.transfer(self.frame, self.answer)
+                    self.frame = None
+
+        return SendFrames
+
+    def _transfer(self, tx, rx):
+        self.frame = tx.tobytes()
+        while self.frame is not None:
+            self.sim.run(100 * CLK_PERIOD, quiet = 1)
+        rx[:] = self.answer
+
+    def sleep(self, seconds):
+        self.sim.run(int(round(seconds * CLK_FREQ)) * CLK_PERIOD, quiet = 1)
+
+class TestTransport(unittest.TestCase):
+
+    def testStats(self):
+        """ Check the accounting of the transfers """
+        ticks = iter([0.0, 0.5, 1.0, 3.0])
+        transport = ModelTransport(RobotIOModel(spi_freq = 1000000), clock = lambda: next(ticks))
+        rx = memoryview(bytearray(6))
+        transport.transfer(memoryview(bytearray([0x42, 4, 0, 0, 0, 0])), rx)
+        self.assertEquals(rx.tolist(), [0, 0, 0xDE, 0xAD, 0xC0, 0xDE])
+        transport.transfer(memoryview(bytearray([0x82, 1, 1, 0, 0, 0])), rx)
+        self.assertEquals(transport.stats(), dict(transfers = 2, bytes = 12, bus_time = 12 * 8 / 1e6,
+                                                  host_time = 2.5, max_host_time = 2.0))
+        transport.reset_stats()
+        self.assertEquals(transport.stats()['transfers'], 0)
+
+        # the model runs with sleep()
+        time = transport.model.time
+        transport.sleep(0.01)
+        self.assertEquals(transport.model.time, time + CLK_FREQ // 100)
+
+    def testSimulation(self):
+        """ Send the same batches to the simulation of RobotIO and to its model """
+        transports = [SimulationTransport(), ModelTransport(RobotIOModel(spi_freq = SPI_FREQ))]
+        clients = [RobotIOClient(t.transfer, size = 64) for t in transports]
+        answers = []
+        for client in clients:
+            client.write('stored_int16', -1234)
+            client.write('led_yellow_consign', 1)
+            client.write_key(0x90, *range(-4, 4))
+            client.read('fixed_value')
+            client.read('stored_int16')
+            client.read_key(0x10)
+            client.send()
+            answers.append(client.rx[:client.length])
+        self.assertEquals(answers[0], answers[1])
+        self.assertEquals(clients[0].value(1), -1234)
+
+        # a transfer with sleep() in between runs the same way
+        for transport, client in zip(transports, clients):
+            transport.sleep(0.0001)
+            client.clear()
+            client.read('stored_int16')
+            client.send()
+            self.assertEquals(client.value(0), -1234)
+            self.assertEquals(transport.stats()['transfers'], 2)
+            self.assertEquals(transport.stats()['bytes'], clients[0].length + len(answers[0]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import sys
+sys.path.append('../lib')
+
+import unittest
+
+from myhdl import Signal, Simulation, StopSimulation, delay, intbv, join
+from Robot.Device.Odometer import OdometerReader
+from Robot.Device.Velocity import VelocityEstimator
+from Robot.Utils.Constants import LOW, HIGH
+from TestUtils import ClkGen, quadrature_encode
+
+# windows of 1000 clk25 periods (2000 delay units)
+WINDOW_FREQ = 25000
+WINDOW = 2000
+
+def TestBench(VelocityTester):
+    """ Instanciate modules and wire things up.
+    VelocityTester -- test module to instanciate with OdometerReader, VelocityEstimator and ClkGen
+    """
+
+    ticks = Signal(intbv(0, min = -2**15, max = 2**15))
+    period = Signal(intbv(0, min = -2**11, max = 2**11))
+    count = Signal(intbv(0, min = -2**31, max = 2**31))
+    a = Signal(LOW)
+    b = Signal(LOW)
+    clk = Signal(LOW)
+    rst_n = Signal(HIGH)
+
+    # instanciate modules
+    OdometerReader_inst = OdometerReader(count, a, b, clk, rst_n)
+    VelocityEstimator_inst = VelocityEstimator(ticks, period, count, clk, rst_n, WINDOW_FREQ)
+    VelocityTester_inst = VelocityTester(ticks, period, a, b, clk, rst_n)
+    ClkGen_inst = ClkGen(clk)
+
+    return OdometerReader_inst, VelocityEstimator_inst, VelocityTester_inst, ClkGen_inst
+
+class TestVelocityEstimator(unittest.TestCase):
+
+    def VelocityTester(self, ticks, period, a, b, clk, rst_n):
+
+        def check_velocity(forward, step_delay):
+            """ Move for 3 windows and check ticks and period after 2 windows """
+            steps = 3*WINDOW/step_delay
+            if forward:
+                encode = quadrature_encode(steps, a, b, step_delay)
+                sign = 1
+            else:
+                encode = quadrature_encode(steps, b, a, step_delay)
+                sign = -1
+            print 'move', sign*steps, 'steps, 1 step every', step_delay/2, 'clk25 periods...',
+
+            # fork: move in the background
+            yield encode, delay(0)
+
+            yield delay(2*WINDOW + step_delay/2)
+            self.assertEquals(period, sign*step_delay/2)
+            self.assertTrue(abs(ticks - sign*WINDOW/step_delay) <= 1)
+            yield delay(WINDOW)
+            print 'done'
+
+        self.assertEquals(ticks, 0)
+        self.assertEquals(period, 0)
+
+        yield check_velocity(True, 20)
+        yield check_velocity(False, 40)
+        yield check_velocity(True, 200)
+
+        # slowing down: no tick for longer than the last period
+        print 'stop...',
+        yield delay(400)
+        self.assertTrue(period > 100)
+
+        # stopped
+        yield delay(2*(period.max - 1))
+        self.assertEquals(period, 0)
+        yield delay(WINDOW)
+        self.assertEquals(ticks, 0)
+        print 'done'
+
+        print 'DONE'
+
+        raise StopSimulation()
+
+    def testVelocityEstimator(self):
+        """ Ensures that ticks and period follow the speed of the odometer """
+        sim = Simulation(TestBench(self.VelocityTester))
+        sim.run()
+
+if __name__ == '__main__':
+    unittest.main()